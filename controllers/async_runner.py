@@ -0,0 +1,58 @@
+'''
+Readme:
+Example usage: python controllers/async_runner.py --num 15 --builds 4 --pass_masks _img,_mask
+
+The same sets of trials as multiple_runner.py, but all builds are driven from this one Python process, see helpers/async_runtime.py
+Every build still has its own thread in this process, only the sockets share one event loop
+Every controller/trial_type combination runs on its own build, at most --builds builds at the same time, on the ports from --port
+'''
+from helpers.async_runtime import BuildRuntime
+from helpers.helpers import create_arg_parser, message
+from helpers.stream_client import get_stream_address
+
+from collision import Collision
+from containment import Containment
+from occlusion import Occlusion
+from rolling_down import Slope
+
+if __name__ == "__main__":
+    args = create_arg_parser()
+    print(message('The trial_type param will be ignored', 'warning'))
+
+    # Same settings as the separate controllers use, see their main
+    settings = {Collision: dict(add_object_to_scene=False, tot_frames=150, extra_pass_mask='_category'),
+                Containment: dict(add_object_to_scene=True, tot_frames=200, extra_pass_mask=None),
+                Occlusion: dict(add_object_to_scene=False, tot_frames=200, extra_pass_mask='_mask'),
+                Slope: dict(add_object_to_scene=True, tot_frames=args.tot_frames, extra_pass_mask=None)}
+    jobs = []
+    for controller_class, setting in settings.items():
+        pass_masks = list(args.pass_masks)
+        if setting['extra_pass_mask'] is not None and setting['extra_pass_mask'] not in pass_masks:
+            pass_masks.append(setting['extra_pass_mask'])
+        for trial_type in ['object', 'transition', 'agent']:
+            run_kwargs = dict(num=args.num, pass_masks=pass_masks, room=args.room, tot_frames=setting['tot_frames'],
+                              add_object_to_scene=setting['add_object_to_scene'], trial_type=trial_type,
+                              png=args.png, save_frames=args.save_frames, save_mp4=args.save_mp4,
+                              resume=args.resume, save_delta=args.save_delta, save_roi=args.save_roi, roi_size=args.roi_size,
+                              pipeline=args.pipeline, save_raw=args.save_raw, check_visibility=args.check_visibility,
+                              save_trajectory=args.save_trajectory, timeout=args.timeout,
+                              coverage=args.coverage, quota=args.quota, render_profile=args.render_profile,
+                              video_format=args.video_format, img_codec=args.img_codec, occupancy=args.occupancy,
+                              assets=args.assets, skip_settle=args.skip_settle, stream_mode=args.stream_mode, stream_hwm=args.stream_hwm)
+            if args.stream is not None:
+                # Every job binds its own socket, the clients connect to all of them
+                run_kwargs.update(stream=get_stream_address(args.stream, len(jobs)), stream_timeout=args.stream_timeout, stream_only=args.stream_only)
+            if controller_class is not Occlusion:
+                run_kwargs.update(open_loop_agent=args.open_loop_agent, correction_every=args.correction_every)
+            if args.twins:
+                # The object trials are the twins of the transition trials
+                if trial_type == 'object':
+                    continue
+                run_kwargs.update(twins=trial_type == 'transition')
+            jobs.append((controller_class, run_kwargs))
+
+    if args.stream is not None:
+        print(message(f'The trials are streamed on {get_stream_address(args.stream, 0)} to {get_stream_address(args.stream, len(jobs)-1)}', 'warning'))
+    runtime = BuildRuntime()
+    for result in runtime.run(jobs, port_start=args.port, builds=args.builds):
+        print(result)
@@ -0,0 +1,93 @@
+'''
+Readme:
+Example usage: python benchmark_render.py --pass_masks _img,_id --frames 200
+Measures the frames/sec and bytes/frame of every render profile (see helpers/render_profiles.py),
+so the cheapest profile that is still good enough for a model can be chosen.
+
+For every profile the same scene is rendered: the empty room with a couple of falling objects and the camera of the controllers,
+the frames of the pass masks are saved like Runner saves them (jpg for _img, png for the other passes).
+The results are printed and saved in {path_main}/benchmarks/render_profiles.csv (by default data/batch2/benchmarks/render_profiles.csv)
+'''
+from tdw.controller import Controller
+from tdw.tdw_utils import TDWUtils
+from tdw.add_ons.third_person_camera import ThirdPersonCamera
+from tdw.add_ons.image_capture import ImageCapture
+import pandas as pd
+import argparse
+import random
+import shutil
+import time
+import os
+
+from helpers.helpers import message
+from helpers.objects import SCENE_OBJECTS
+from helpers.render_profiles import PROFILES, get_profile_commands
+
+
+class RenderBenchmark(Controller):
+    def __init__(self, path_main, port=1071):
+        self.path_capture = f'{path_main}/benchmarks/capture_temp'
+        super().__init__(port=port)
+
+    def benchmark(self, profile, pass_masks, png, frames, num_objects=5):
+        '''Render frames frames with profile, returns frames/sec and bytes/frame'''
+        shutil.rmtree(self.path_capture, ignore_errors=True)
+        self.add_ons.clear()
+        self.add_ons.append(ThirdPersonCamera(position={"x": 2, "y": 1.6, "z": -1}, look_at={"x": 0, "y": .5, "z": 0},
+                                              avatar_id='frames_temp'))
+        self.add_ons.append(ImageCapture(path=self.path_capture, avatar_ids=['frames_temp'], png=png, pass_masks=pass_masks))
+
+        # The same objects for every profile
+        rng = random.Random(0)
+        commands = [{"$type": "load_scene", "scene_name": "ProcGenScene"}, TDWUtils.create_empty_room(12, 12)]
+        commands.extend(get_profile_commands(profile))
+        for i in range(num_objects):
+            commands.extend(self.get_add_physics_object(model_name=rng.choice(SCENE_OBJECTS),
+                                                        library='models_flex.json',
+                                                        object_id=self.get_unique_id(),
+                                                        position={"x": rng.uniform(-1, 1), "y": rng.uniform(1, 3), "z": rng.uniform(-1, 1)}))
+        self.communicate(commands)
+
+        start = time.perf_counter()
+        for _ in range(frames):
+            self.communicate([])
+        seconds = time.perf_counter() - start
+
+        size = sum(os.path.getsize(os.path.join(root, fn)) for root, _, fns in os.walk(self.path_capture) for fn in fns)
+        shutil.rmtree(self.path_capture, ignore_errors=True)
+        return frames / seconds, size / (frames + 1)
+
+    def run(self, profiles, pass_masks, png=False, frames=200):
+        rows = []
+        for i, profile in enumerate(profiles):
+            fps, bytes_per_frame = self.benchmark(profile, pass_masks, png, frames)
+            settings = PROFILES[profile] if profile is not None else {}
+            rows.append({'profile': profile or 'default', **settings, 'pass_masks': ','.join(pass_masks),
+                         'fps': round(fps, 1), 'bytes_per_frame': int(bytes_per_frame)})
+            print(message(f'Benchmarked profile {profile or "default"} ({i+1}/{len(profiles)})', 'success', round((i+1)/len(profiles)*10)))
+        self.communicate({"$type": "terminate"})
+        return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    # The same base path as Runner
+    default_path = '../data/batch2' if os.getcwd().endswith('controllers') else 'data/batch2'
+
+    parser = argparse.ArgumentParser(description="Benchmark the frames/sec and bytes/frame of the render profiles")
+    parser.add_argument("--profiles", type=str, default='default,' + ','.join(PROFILES), help="Comma separated profiles, default is the build default")
+    parser.add_argument("--pass_masks", type=str, default='_img,_id', help="Comma separated pass masks that are saved")
+    parser.add_argument("--png", action='store_true', help="Save _img as png instead of jpg")
+    parser.add_argument("--frames", type=int, default=200, help="Number of frames per profile")
+    parser.add_argument("--path_main", type=str, default=default_path, help="Folder of the data")
+    args = parser.parse_args()
+
+    profiles = [None if profile == 'default' else profile for profile in args.profiles.split(',')]
+    unknown = [profile for profile in profiles if profile is not None and profile not in PROFILES]
+    if unknown:
+        print(message(f'Unknown profiles {unknown}, use any of {list(PROFILES)}', 'error'))
+    else:
+        c = RenderBenchmark(args.path_main)
+        df = c.run(profiles, args.pass_masks.split(','), png=args.png, frames=args.frames)
+        os.makedirs(f'{args.path_main}/benchmarks', exist_ok=True)
+        df.to_csv(f'{args.path_main}/benchmarks/render_profiles.csv', index=False)
+        print(df.to_string(index=False))
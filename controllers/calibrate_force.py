@@ -0,0 +1,217 @@
+'''
+Readme:
+Example usage: python calibrate_force.py --scenes empty,box_room_2018 --num_magnitudes 8 --batch_size 8
+The goal of this file is to replace the get_magnitude heuristic with measured forces,
+so objects that get a force neither barely move nor fly off
+
+For every model a range of magnitudes around the heuristic is swept, without cameras (no rendering):
+a batch of (model, magnitude) pairs is spawned in a row, every object settles and gets the force in the same direction.
+The horizontal displacement, peak speed and rise of every object are measured after a fixed number of frames.
+The magnitudes that reached the target displacement without flying off are the calibrated range of the model on that floor,
+every scene has its own floor material (e.g. the carpet of box_room_2018), 'empty' is the empty room.
+The objects are spawned with the physics settings of the controllers (see PHYSICS in helpers/force_table.py),
+collision and occlusion spawn them with a mass of 1, the other controllers with the mass and friction of the library.
+
+The table is cached in data/calibration/forces.json, see helpers/force_table.py
+Models that are already calibrated on a floor with the same physics settings for the same library version are skipped, so runs can be interrupted and resumed.
+helpers.get_magnitude samples from the calibrated ranges.
+
+Possible improvements:
+Calibrate the forces of the agents as well
+'''
+from tdw.controller import Controller
+from tdw.tdw_utils import TDWUtils
+from tdw.output_data import OutputData, Transforms, Rigidbodies
+from tdw.version import __version__
+import numpy as np
+import argparse
+
+from helpers.helpers import message, get_record_with_name, get_heuristic_magnitude, get_librarian
+from helpers.force_table import PHYSICS, load_force_table, save_force_table, is_calibrated, fit_range, get_table_path
+from helpers.objects import CONTAINERS, CONTAINED, OCCLUDED, ROLLING_FLIPPED
+
+
+class ForceCalibrator(Controller):
+    def __init__(self, library='models_core.json', batch_size=8, spacing=1.5, port=1071):
+        '''
+        param library: the model library of the calibrated models
+        param batch_size: number of (model, magnitude) pairs that are spawned and measured at the same time
+        param spacing: distance in meters between the objects in the row
+        '''
+        self.library = library
+        self.batch_size = batch_size
+
+        # Every pair in a batch gets a fixed slot in a row along z, the force pushes along x
+        self.slots = [{"x": -2, "y": 0, "z": (i - (batch_size-1)/2)*spacing} for i in range(batch_size)]
+        self.room_size = int(batch_size*spacing + 8)
+        super().__init__(port=port)
+
+    def load_floor(self, floor):
+        '''Load the scene of the floor, 'empty' is the empty room of the controllers'''
+        if floor == 'empty':
+            command = TDWUtils.create_empty_room(self.room_size, self.room_size)
+        else:
+            command = self.get_add_scene(scene_name=floor)
+        self.communicate([command, {"$type": "set_target_framerate", "framerate": 30}])
+
+    def measure_batch(self, pairs, physics, settle_frames, measure_frames):
+        '''Spawn all (name, magnitude) pairs with the physics settings, apply the forces and measure the motion
+        Returns: list with (displacement, peak speed, rise) per pair, None for pairs without output'''
+        commands, o_ids = [], []
+        for (name, _), slot in zip(pairs, self.slots):
+            o_id = self.get_unique_id()
+            commands.extend(self.get_add_physics_object(model_name=name,
+                                                        library=self.library,
+                                                        object_id=o_id,
+                                                        position=slot,
+                                                        rotation={"x": 0, "y": 0, "z": 0},
+                                                        **PHYSICS[physics]))
+            o_ids.append(o_id)
+        commands.extend([{"$type": "send_transforms", "frequency": "always", "ids": o_ids},
+                         {"$type": "send_rigidbodies", "frequency": "always", "ids": o_ids}])
+        self.communicate(commands)
+
+        # Let the objects settle, the start positions are taken from the last frame
+        for _ in range(settle_frames):
+            resp = self.communicate([])
+        start = self.get_positions(resp, o_ids)
+
+        # The same force commands as the controllers use, every object is pushed along x
+        commands = []
+        for o_id, (_, magnitude), slot in zip(o_ids, pairs, self.slots):
+            commands.extend([{"$type": "object_look_at_position", "position": {"x": 10, "y": 0, "z": slot['z']}, "id": o_id},
+                             {"$type": "apply_force_magnitude_to_object", "magnitude": magnitude, "id": o_id}])
+        peak_speed, peak_height = np.zeros(len(o_ids)), np.full(len(o_ids), -np.inf)
+        index = {o_id: k for k, o_id in enumerate(o_ids)}
+        for i in range(measure_frames):
+            resp = self.communicate(commands if i == 0 else [])
+            for j in range(len(resp) - 1):
+                if OutputData.get_data_type_id(resp[j]) == "rigi":
+                    rigidbodies = Rigidbodies(resp[j])
+                    for k in range(rigidbodies.get_num()):
+                        if rigidbodies.get_id(k) in index:
+                            velocity = np.array(rigidbodies.get_velocity(k))
+                            speed = np.linalg.norm(velocity[[0, 2]])
+                            peak_speed[index[rigidbodies.get_id(k)]] = max(peak_speed[index[rigidbodies.get_id(k)]], speed)
+            positions = self.get_positions(resp, o_ids)
+            for k, o_id in enumerate(o_ids):
+                if o_id in positions:
+                    peak_height[k] = max(peak_height[k], positions[o_id][1])
+        end = self.get_positions(resp, o_ids)
+
+        # Reset the scene by destroying the objects
+        destroy_commands = [{"$type": "destroy_object", "id": o_id} for o_id in o_ids]
+        destroy_commands.extend([{"$type": "send_transforms", "frequency": "never"},
+                                 {"$type": "send_rigidbodies", "frequency": "never"}])
+        self.communicate(destroy_commands)
+
+        results = []
+        for k, o_id in enumerate(o_ids):
+            if o_id not in start or o_id not in end:
+                results.append(None)
+                continue
+            displacement = float(np.linalg.norm((end[o_id] - start[o_id])[[0, 2]]))
+            results.append((displacement, float(peak_speed[k]), float(peak_height[k] - start[o_id][1])))
+        return results
+
+    @staticmethod
+    def get_positions(resp, o_ids):
+        '''Returns dict with o_id:position of the transforms in resp'''
+        positions = {}
+        for i in range(len(resp) - 1):
+            if OutputData.get_data_type_id(resp[i]) == "tran":
+                transforms = Transforms(resp[i])
+                for j in range(transforms.get_num()):
+                    if transforms.get_id(j) in o_ids:
+                        positions[transforms.get_id(j)] = np.array(transforms.get_position(j))
+        return positions
+
+    def run(self, names, floors=['empty'], physics=list(PHYSICS), num_magnitudes=8, min_factor=.25, max_factor=4., settle_frames=20, measure_frames=60,
+            min_displacement=.5, max_displacement=3., max_rise=.5, redo=False):
+        '''
+        param names: the models that are calibrated
+        param floors: the scenes that are calibrated, 'empty' is the empty room
+        param physics: the physics settings that are calibrated, see PHYSICS in helpers/force_table.py
+        param num_magnitudes: number of magnitudes per model, spaced geometrically from min_factor to max_factor times the heuristic
+        param settle_frames: number of frames before the force is applied
+        param measure_frames: number of frames after the force after which the displacement is measured
+        param min_displacement, max_displacement: target range of the horizontal displacement in meters
+        param max_rise: objects that rise more than this (in meters) fly off
+        param redo: if True, calibrate all models again, even if they are already calibrated for this library version
+        '''
+        table = load_force_table()
+        factors = np.geomspace(min_factor, max_factor, num_magnitudes)
+        for f, floor in enumerate(floors):
+            loaded = False
+            for setting in physics:
+                todo = [name for name in names if redo or not is_calibrated(table, name, floor, setting, __version__)]
+                print(f'Floor {floor}, physics {setting}: {len(names)-len(todo)} models are already calibrated, {len(todo)} models left')
+                if not todo:
+                    continue
+                if not loaded:
+                    self.load_floor(floor)
+                    loaded = True
+
+                pairs = [(name, float(get_heuristic_magnitude(get_record_with_name(name))*factor)) for name in todo for factor in factors]
+                results = {name: {'magnitudes': [], 'displacements': [], 'speeds': [], 'rises': []} for name in todo}
+                num_batches = int(np.ceil(len(pairs)/self.batch_size))
+                for b in range(num_batches):
+                    batch = pairs[b*self.batch_size:(b+1)*self.batch_size]
+                    for (name, magnitude), result in zip(batch, self.measure_batch(batch, setting, settle_frames, measure_frames)):
+                        if result is None:
+                            continue
+                        for key, value in zip(['magnitudes', 'displacements', 'speeds', 'rises'], (magnitude,) + result):
+                            results[name][key].append(value)
+
+                    # Save every model of which all magnitudes are measured, so the run can be resumed
+                    done = {name for name, _ in batch} - {name for name, _ in pairs[(b+1)*self.batch_size:]}
+                    for name in done:
+                        result = results[name]
+                        result['range'] = fit_range(result['magnitudes'], result['displacements'], result['rises'],
+                                                    min_displacement, max_displacement, max_rise)
+                        entry = table.get(name, {})
+                        if entry.get('library_version') != __version__ or 'physics' not in entry:
+                            entry = {'library_version': __version__, 'physics': {}}
+                        entry['physics'].setdefault(setting, {})[floor] = result
+                        table[name] = entry
+                    save_force_table(table)
+                    print(message(f'Calibrated batch ({b+1}/{num_batches}) of floor {floor} ({f+1}/{len(floors)}) with physics {setting}', 
+                                  'success', round((b+1)/num_batches*10)))
+
+        self.communicate({"$type": "terminate"})
+        calibrated = [name for name in names if all(table.get(name, {}).get('physics', {}).get(setting, {}).get(floor, {}).get('range') 
+                                                    for setting in physics for floor in floors)]
+        return message(f'{len(calibrated)}/{len(names)} models have a calibrated range on every floor with all physics settings, see {get_table_path()}', 'success')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate the force magnitudes of the models on the floors of the scenes")
+    parser.add_argument("--library", type=str, default='models_core.json', help="Model library of the models")
+    parser.add_argument("--names", type=str, default=None, help="Comma separated models, default are the objects of helpers.objects")
+    parser.add_argument("--scenes", type=str, default='empty', help="Comma separated scenes, 'empty' is the empty room, 'all' are all scenes")
+    parser.add_argument("--physics", type=str, default=','.join(PHYSICS), help=f"Comma separated physics settings of helpers/force_table.py: {list(PHYSICS)}")
+    parser.add_argument("--batch_size", type=int, default=8, help="Number of objects measured at the same time")
+    parser.add_argument("--num_magnitudes", type=int, default=8, help="Number of magnitudes per model")
+    parser.add_argument("--min_displacement", type=float, default=.5, help="Smallest displacement in meters of a good force")
+    parser.add_argument("--max_displacement", type=float, default=3., help="Largest displacement in meters of a good force")
+    parser.add_argument("--redo", action='store_true', help="Calibrate models again, even if already calibrated for this library version")
+    args = parser.parse_args()
+
+    library_names = {record.name for record in get_librarian(args.library).records}
+    if args.names is not None:
+        names = args.names.split(',')
+    else:
+        names = sorted(name for name in set(CONTAINERS + CONTAINED + OCCLUDED + ROLLING_FLIPPED) if name in library_names)
+    if args.scenes == 'all':
+        floors = ['empty'] + [record.name for record in get_librarian('scenes.json').records]
+    else:
+        floors = args.scenes.split(',')
+    physics = args.physics.split(',')
+    unknown = [setting for setting in physics if setting not in PHYSICS]
+    if unknown:
+        print(message(f'physics should be any of {list(PHYSICS)}, not {unknown}', 'error'))
+    else:
+        c = ForceCalibrator(library=args.library, batch_size=args.batch_size)
+        success = c.run(names, floors=floors, physics=physics, num_magnitudes=args.num_magnitudes, min_displacement=args.min_displacement,
+                        max_displacement=args.max_displacement, redo=args.redo)
+        print(success)
@@ -13,10 +13,7 @@ Add rolling down collision
 Noise in position could be dependend on width of objects
 Random force positions could better
 Make sure objects stop at wall
-Check if it's likely target is visible: 
--ball category is in screen, 
--albedo is empty where id is not (ball is not spotted on albedo)
--assumed ball is completely in camera view
+Check if it's likely target is visible: use --check_visibility True (needs _id pass), see accept_visibility
 '''
 # Added for collisions
 from helpers.runner_main import Runner
@@ -27,6 +24,8 @@ import random
 from helpers.objects import *
 from tdw.add_ons.third_person_camera import ThirdPersonCamera
 from helpers.helpers import *
+from helpers.planner import OpenLoopAgent
+from helpers.visibility import visible_at_end
 from copy import deepcopy
 from tdw.tdw_utils import TDWUtils
 from random import uniform
@@ -73,7 +72,8 @@ class Collision(Runner):
             bounds_target = np.max(TDWUtils.get_bounds_extents(self.target_rec.bounds))*.2/2 
             bounds = bounds_agent + bounds_target
 
-            force = get_magnitude(get_record_with_name(self.objects[1]))
+            force = get_magnitude(get_record_with_name(self.objects[1]), randomness=self.get_param('magnitude_randomness', 5), floor=self.loaded_scene,
+                                  physics='mass_1')
 
             agent_success = False
 
@@ -92,6 +92,14 @@ class Collision(Runner):
                 hor_distance.append(np.nan)
                 last_hor_distance.append(np.nan)
 
+            if self.open_loop_agent:
+                # Plan the whole path, including the obstacle hops, from the spawn positions
+                # self.positions[-1] is the position of the agent, the positions before are the obstacles
+                agent = OpenLoopAgent(self.o_ids[-2], self.o_ids[-1], self.positions[-1], self.target_pos, speed, bounds+.4, tot_frames,
+                                      obstacles=[(self.positions[j], bounds_obstacle[j]+bounds_agent, height_obstacle[j]) for j in range(self.num_objects-2)],
+                                      correction_every=self.correction_every)
+                resp = None
+
         if trial_type == 'transition':
             tot_bounds = np.max(TDWUtils.get_bounds_extents(get_record_with_name(self.objects[0]).bounds))/2 
             tot_bounds += np.max(TDWUtils.get_bounds_extents(get_record_with_name(self.objects[1]).bounds))/2 
@@ -117,8 +125,22 @@ class Collision(Runner):
                     resp = self.communicate([])
                     if (get_distance(resp, self.o_ids[0], self.o_ids[1]) - tot_bounds) < random.uniform(.5,.6):
                         transition_compl = True
+                        self.branch(resp)
             
-            if trial_type == 'agent':
+            if trial_type == 'agent' and self.open_loop_agent:
+                agent.correct(i, resp)
+                commands, acted = agent.get_commands(i)
+                if i == agent.reached_frame:
+                    # Target almost reached, apply force in its direction to enable collision
+                    commands.extend([{"$type": "object_look_at", "other_object_id": self.o_ids[-1], "id": self.o_ids[-2]},
+                                     {"$type": "apply_force_magnitude_to_object",
+                                      "magnitude": force,
+                                      "id": self.o_ids[-2]}])
+                if acted:
+                    transition_frames.append(i)
+                resp = self.communicate(commands)
+
+            elif trial_type == 'agent':
                 success = True #TODO maybe remove
                 commands = []
                 if i == 0:
@@ -170,7 +192,7 @@ class Collision(Runner):
                             "id": o_id})
         destroy_commands.append({"$type": "send_rigidbodies",
                             "frequency": "never"})
-        self.communicate(destroy_commands)
+        self.communicate_unrendered(destroy_commands)
 
         # Check if collision happened
         if trial_type == 'object':
@@ -252,6 +274,7 @@ class Collision(Runner):
 
         # Bring slightly closer to the middle so target is often in sight
         commands, self.target_rec = add_target_commands(target_id, target_pos, commands)
+        self.target_pos = target_pos
         return commands
 
     def set_camera(self):
@@ -259,12 +282,29 @@ class Collision(Runner):
         '''
         # Add camera
         position, look_at = {"x": -3.2, "y": 3, "z": -3.2}, {"x": 0, "y": 0, "z": 0}
+        if self.occupancy is not None and not self.occupancy.line_of_sight(position, look_at):
+            # Somewhere else around the objects at the same distance
+            def sample():
+                angle = random.uniform(0, 2*np.pi)
+                return {"x": 4.5*np.cos(angle), "y": 3, "z": 4.5*np.sin(angle)}
+            position = self.sample_camera(sample, look_at)
         self.camera = ThirdPersonCamera(position=position,
                                         look_at=look_at,
                                         avatar_id='frames_temp')
         self.add_ons.append(self.camera)
         return position, look_at
         
+    def accept_visibility(self, visibility):
+        '''The target should be visible at the end of agent trials, both colliding objects at the end of the other trials'''
+        targets = [len(self.o_ids)-1] if self.trial_type == 'agent' else [0, 1]
+        for k in targets:
+            if not visible_at_end(visibility, k):
+                return f'object {k} is not visible at the end'
+        return True
+
+    def coverage_cells(self):
+        return [(name, partner) for name in self.objects for partner in self.objects if name != partner]
+
     def trial_initialization_commands(self):
         # Could be extended to multiple objects one day
         self.num_objects = 2 if self.trial_type != 'agent' else random.randint(3,4)
@@ -277,7 +317,11 @@ class Collision(Runner):
         coll_type = random.choice(['fall', 'force']) if self.trial_type != 'agent' else 'agent'
 
         # Get positions based on collision type
-        self.positions = self.set_force_positions() if coll_type != 'fall' else self.set_fall_postions()
+        # In other rooms than the empty room the objects (and the path of the moving object) should be on free floor
+        if coll_type != 'fall':
+            self.positions = self.sample_free(self.set_force_positions, accept=lambda positions: self.occupancy.path_free(positions[1], positions[0], .3))
+        else:
+            self.positions = self.sample_free(self.set_fall_postions)
 
         # Get point non-moving object or more or less middle point from the two non-moving non-target objects
         cam_turn = deepcopy(self.positions[0])
@@ -302,6 +346,11 @@ class Collision(Runner):
         
         # To choose random object without putting back
         random.shuffle(self.objects)
+        if self.steer_coverage:
+            # The least covered pair becomes the first two objects
+            for name in reversed(self.choose_cell(self.coverage_cells())):
+                self.objects.insert(0, self.objects.pop(self.objects.index(name)))
+        self.coverage_cell = (self.objects[0], self.objects[1])
 
         # Set rotation for falling objects
         rotation = {"x": uniform(0, 360) if random.choice([True, False]) else 0, 
@@ -311,7 +360,7 @@ class Collision(Runner):
         commands = self.add_objects(commands=[], rotation=rotation)
         if coll_type == 'force':
             # Get suitable magnitude
-            magnitude = random.uniform(20,40)
+            magnitude = self.get_param('collision_force', lambda: random.uniform(20,40))
 
             commands.extend([{"$type": "object_look_at",
                     "other_object_id": coll_id,
@@ -338,12 +387,13 @@ class Collision(Runner):
                       {"$type": "send_static_rigidbodies",
                        "frequency": "once"}])
         
-        # Request collisions data.
+        # Request collisions data, also with the environment like the CollisionManager and the TrajectoryRecorder,
+        # since the last send_collisions overrides the settings of the others
         commands.append({"$type": "send_collisions",
                         "enter": True, 
                         "stay": False,
                         "exit": False, 
-                        "collision_types": ["obj"]})
+                        "collision_types": ["obj", "env"]})
         return commands
     
 if __name__ == "__main__":
@@ -357,5 +407,14 @@ if __name__ == "__main__":
         print(message('_category is added to pass_masks', 'warning'))
     success = c.run(num=args.num, pass_masks=args.pass_masks, room=args.room, tot_frames=150,
                     add_object_to_scene=False, trial_type=args.trial_type,
-                    png=args.png, save_frames=args.save_frames, save_mp4=args.save_mp4)
+                    png=args.png, save_frames=args.save_frames, save_mp4=args.save_mp4,
+                    resume=args.resume, save_delta=args.save_delta, save_roi=args.save_roi, roi_size=args.roi_size,
+                    open_loop_agent=args.open_loop_agent, correction_every=args.correction_every,
+                    pipeline=args.pipeline, save_raw=args.save_raw, check_visibility=args.check_visibility,
+                    save_trajectory=args.save_trajectory, timeout=args.timeout,
+                    coverage=args.coverage, quota=args.quota, render_profile=args.render_profile,
+                    video_format=args.video_format, img_codec=args.img_codec, twins=args.twins,
+                    occupancy=args.occupancy, assets=args.assets, skip_settle=args.skip_settle,
+                    stream=args.stream, stream_mode=args.stream_mode, stream_hwm=args.stream_hwm,
+                    stream_timeout=args.stream_timeout, stream_only=args.stream_only)
     print(success)
\ No newline at end of file
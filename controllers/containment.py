@@ -22,6 +22,7 @@ import random
 from helpers.runner_main import Runner
 from helpers.objects import CONTAINERS, CONTAINED
 from helpers.helpers import *
+from helpers.planner import OpenLoopAgent
 
 import numpy as np
 
@@ -30,6 +31,9 @@ class Containment(Runner):
     Create a set of "Containment" trials, where a container object holds a smaller target
     object and is shaken violently, causing the target object to move around and possibly fall out.
     """
+    # The transition and agent checks can be one frame late, see Runner.step
+    frame_latency = 1
+
     def __init__(self, port: int = 1071):
         self.controller_name = 'containment'
 
@@ -88,6 +92,8 @@ class Containment(Runner):
                             activate_transition = (o_relative_position<max_distance).all()
 
                             if activate_transition:
+                                self.branch(resp)
+
                                 #The transition should happen at this frame
                                 transition_frames.append(i+1)
 
@@ -98,7 +104,7 @@ class Containment(Runner):
                                 #                 "id": self.o_ids[1]})
 
                                 # Get suitable random force
-                                force = get_magnitude(self.o_record)*.25
+                                force = get_magnitude(self.o_record, randomness=self.get_param('magnitude_randomness', 5), floor=self.loaded_scene)*self.get_param('transition_force_factor', .25)
 
                                 # Apply a force to the object
                                 commands.append({"$type": "apply_force_at_position", 
@@ -119,14 +125,45 @@ class Containment(Runner):
 
                         # Make room for the next frame
                         rotations, positions = rotations[1:], positions[1:]
-                    resp = self.communicate(commands)
+                    resp = self.step(commands)
         
-        # Let the trial settle for a couple of frames
+        # Let the trial settle for a couple of frames, agent trials can settle without rendering (see skip_settle of Runner.run)
         settle_frames = random.randint(20, 40)
+        unrendered = settle_frames if trial_type == 'agent' and self.skip_settle else 0
 
         for i in range(tot_frames):
-            if trial_type == 'object' or i < settle_frames:
-                resp = self.communicate([])
+            if trial_type == 'agent' and self.open_loop_agent:
+                if i < settle_frames:
+                    # Only request the positions at the end of settling, the agent path is planned from there
+                    commands = [{"$type": "send_transforms", "frequency": "never"},
+                                {"$type": "send_rigidbodies", "frequency": "never"}] if i == 0 else []
+                    if i == settle_frames - 1:
+                        commands.append({"$type": "send_transforms", "frequency": "once", "ids": self.o_ids[1:]})
+                    resp = self.communicate_unrendered(commands) if unrendered else self.communicate(commands)
+                    continue
+                if i == settle_frames:
+                    # Same up speeds as the closed-loop agent
+                    up_speeds = []
+                    for _ in range(tot_frames):
+                        up_speed -= .005 if up_speed > 0 else 0
+                        up_speeds.append(up_speed)
+                    start, target = [{axis: float(value) for axis, value in zip(['x', 'y', 'z'], get_transforms(resp, o_id)[1])} 
+                                     for o_id in self.o_ids[1:]]
+                    agent = OpenLoopAgent(self.o_ids[1], self.o_ids[2], start, target, speed, bounds+.06, tot_frames-settle_frames,
+                                          up_speeds=up_speeds, correction_every=self.correction_every)
+                    resp = None
+                agent.correct(i-settle_frames, resp)
+                commands, acted = agent.get_commands(i-settle_frames)
+                if acted:
+                    # Append frame-numbers where the agent is 'walking'
+                    transition_frames.append(i-unrendered)
+                resp = self.communicate(commands)
+
+            elif i < unrendered:
+                resp = self.communicate_unrendered([])
+
+            elif trial_type == 'object' or i < settle_frames:
+                resp = self.step([])
 
             elif trial_type == 'agent':
                 up_speed -= .005 if up_speed > 0 else 0
@@ -143,13 +180,13 @@ class Containment(Runner):
                                                "id": self.o_ids[1]},]
                 
                 if (get_distance(resp, self.o_ids[1], self.o_ids[2])- bounds) <.06  or agent_success:
-                    resp = self.communicate([])
+                    resp = self.step([])
                     agent_success = True
                 else:
-                    resp = self.communicate(commands)
+                    resp = self.step(commands)
 
                     # Append frame-numbers where the agent is 'walking'
-                    transition_frames.append(i)
+                    transition_frames.append(i-unrendered)
 
             
                             
@@ -160,7 +197,7 @@ class Containment(Runner):
                             "id": o_id})
         destroy_commands.append({"$type": "send_rigidbodies",
                             "frequency": "never"})
-        self.communicate(destroy_commands)
+        self.communicate_unrendered(destroy_commands)
 
         return transition_frames if transition_frames != [] else -1, True
 
@@ -185,7 +222,7 @@ class Containment(Runner):
     def add_object_to_scene(self, commands):
         '''This method will add a fixed object to the scene that the container has something to balance/shake on,
         since the object will not change during trials and is fixed in place, it will be added to the background shot'''
-        balancer_name = random.choice([record.name for record in ModelLibrarian('models_flex.json').records])
+        balancer_name = random.choice([record.name for record in get_librarian('models_flex.json').records])
 
         # Get good scale for balancer, compared to most of the containers
         balancer_scale = .45
@@ -195,6 +232,7 @@ class Containment(Runner):
         self.balancer_height = TDWUtils.get_bounds_extents(balancer_rec.bounds)[1] * balancer_scale
 
         object_id = self.get_unique_id()
+        self.scene_o_ids = [object_id]
 
         # Add the balancer object
         commands.extend(self.get_add_physics_object(model_name=balancer_name,
@@ -219,25 +257,39 @@ class Containment(Runner):
     
     def set_camera(self):
         ''' The avatar_id of the camera should be 'frames_temp' '''
+        if self.occupancy is not None:
+            # The balancer, the container and the agent need free floor around them
+            center = self.sample_free(lambda: {"x": random.uniform(-3, 3), "z": random.uniform(-3, 3)}, radius=1.2)
+            self.o_x, self.o_z = center['x'], center['z']
+
         # Add camera
-        position, look_at = {"x": self.o_x+uniform(-1, 1), "y": uniform(3.2, 3.4), "z": self.o_z+uniform(-1, 1)}, {"x": self.o_x, "y": 1.0, "z": self.o_z}
+        look_at = {"x": self.o_x, "y": 1.0, "z": self.o_z}
+        position = self.sample_camera(lambda: {"x": self.o_x+uniform(-1, 1), "y": uniform(3.2, 3.4), "z": self.o_z+uniform(-1, 1)}, look_at)
         camera = ThirdPersonCamera(position=position,
                            look_at=look_at,
                            avatar_id='frames_temp')
         self.add_ons.append(camera)
         return position, look_at
 
+    def coverage_cells(self):
+        return get_valid_pairs(tuple(CONTAINED), tuple(CONTAINERS))
+
     def trial_initialization_commands(self):
         commands = []
         
-        # Select a random container and contained object
-        records, self.bounds = get_two_random_records(smaller_list=CONTAINED, larger_list=CONTAINERS)
+        # Select a random (or the least covered) container and contained object
+        if self.steer_coverage:
+            records, self.bounds = get_records_of_pair(self.choose_cell(self.coverage_cells()))
+        else:
+            records, self.bounds = get_two_random_records(smaller_list=CONTAINED, larger_list=CONTAINERS)
+        self.coverage_cell = (records[0].name, records[1].name)
         
         # Get balancer height to see how hight container should be placed
         height = self.balancer_height
-        y = height + random.uniform(.1, .2)
+        y = height + self.get_param('shake_height', lambda: random.uniform(.1, .2))
 
-        # Select a container.
+        # Select a container, tilted at most tilt degrees
+        tilt = self.get_param('shake_tilt', 10)
         container_id = self.get_unique_id()
         commands.extend(self.get_add_physics_object(model_name=records[1].name,
                                                     library="models_core.json",
@@ -245,9 +297,9 @@ class Containment(Runner):
                                                     position={"x": self.o_x,
                                                               "y": y,
                                                               "z": self.o_z},
-                                                    rotation={"x": uniform(-10, 10),
-                                                              "y": uniform(-10, 10),
-                                                              "z": uniform(-10, 10)}))
+                                                    rotation={"x": uniform(-tilt, tilt),
+                                                              "y": uniform(-tilt, tilt),
+                                                              "z": uniform(-tilt, tilt)}))
         
         # Add the random moving object (can be agent, in that case also add target)
         self.o_record = records[0]
@@ -285,5 +337,14 @@ if __name__ == "__main__":
     print(message('tot_frames is set to 200 for this trial, and add_object_to_scene is True', 'warning'))
     success = c.run(num=args.num, pass_masks=args.pass_masks, room=args.room, tot_frames=200,
                     add_object_to_scene=True, trial_type=args.trial_type,
-                    png=args.png, save_frames=args.save_frames, save_mp4=args.save_mp4)
+                    png=args.png, save_frames=args.save_frames, save_mp4=args.save_mp4,
+                    resume=args.resume, save_delta=args.save_delta, save_roi=args.save_roi, roi_size=args.roi_size,
+                    open_loop_agent=args.open_loop_agent, correction_every=args.correction_every,
+                    pipeline=args.pipeline, save_raw=args.save_raw, check_visibility=args.check_visibility,
+                    save_trajectory=args.save_trajectory, timeout=args.timeout,
+                    coverage=args.coverage, quota=args.quota, render_profile=args.render_profile,
+                    video_format=args.video_format, img_codec=args.img_codec, twins=args.twins,
+                    occupancy=args.occupancy, assets=args.assets, skip_settle=args.skip_settle,
+                    stream=args.stream, stream_mode=args.stream_mode, stream_hwm=args.stream_hwm,
+                    stream_timeout=args.stream_timeout, stream_only=args.stream_only)
     print(success)
\ No newline at end of file
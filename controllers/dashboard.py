@@ -0,0 +1,119 @@
+'''
+Readme:
+Example usage: python controllers/dashboard.py --http 8765
+
+Live status of all running controllers and builds, instead of tailing the logs of every worker.
+Every Runner writes its status to data/batch2/status/ (see helpers/status.py), this script shows all of them in one table,
+refreshed every --refresh seconds, with the totals and the ETA to the target number of trials.
+Workers that did not update for a while are marked STALE (slow or stuck).
+With --http the aggregated status is also served as json on http://localhost:{port}/status
+'''
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import os
+import threading
+import time
+
+from helpers.helpers import message
+from helpers.status import get_status_dir, load_statuses
+
+
+def aggregate(statuses):
+    '''Totals over all workers'''
+    accepted = sum(status['accepted'] for status in statuses)
+    attempted = sum(status['attempted'] for status in statuses)
+    failures = {}
+    for status in statuses:
+        for reason, count in status['failures'].items():
+            failures[reason] = failures.get(reason, 0) + count
+    running = [status for status in statuses if status['state'] == 'running']
+    etas = [status['eta_seconds'] for status in running if status['eta_seconds'] is not None]
+    return {'workers': len(statuses), 'running': len(running), 'stale': sum(status['stale'] for status in statuses),
+            'accepted': accepted, 'attempted': attempted, 'acceptance_rate': accepted / attempted if attempted else None,
+            'failure_rates': {reason: count / attempted for reason, count in failures.items()} if attempted else {},
+            'fps': sum(status['fps'] for status in running), 'eta_seconds': max(etas) if etas else None}
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    return time.strftime('%H:%M:%S', time.gmtime(seconds)) if seconds < 86400 else f'{seconds/86400:.1f}d'
+
+
+def format_number(value, fmt='.1f'):
+    return '-' if value is None else format(value, fmt)
+
+
+def render(statuses):
+    '''The status table as text'''
+    header = f"{'worker':<32}{'state':<9}{'trials':>9}{'accept':>8}{'fps':>7}{'p50 ms':>8}{'p99 ms':>8}{'queue':>7}{'MB/s':>7}{'ETA':>10}"
+    lines = [header, '-' * len(header)]
+    for status in statuses:
+        worker = f"{status['controller_name']}/{status['trial_type']}:{status['port']}"
+        state = 'STALE' if status['stale'] else status['state']
+        rate = status['accepted'] / status['attempted'] if status['attempted'] else None
+        lines.append(f"{worker:<32}{state:<9}{status['committed']:>4}/{status['num']:<4}{format_number(rate, '.0%'):>8}"
+                     f"{format_number(status['fps']):>7}{format_number(status['latency_ms']['p50']):>8}"
+                     f"{format_number(status['latency_ms']['p99']):>8}{status['queue_depth']:>7}"
+                     f"{format_number(status['write_mb_s']):>7}{format_seconds(status['eta_seconds']):>10}")
+        if status['stale']:
+            lines[-1] = message(lines[-1], 'warning').rstrip('\r')
+
+    total = aggregate(statuses)
+    lines.append('-' * len(header))
+    lines.append(f"{total['running']}/{total['workers']} workers running, {total['stale']} stale, "
+                 f"{total['accepted']}/{total['attempted']} trials accepted ({format_number(total['acceptance_rate'], '.0%')}), "
+                 f"{format_number(total['fps'])} frames/s, ETA {format_seconds(total['eta_seconds'])}")
+    if total['failure_rates']:
+        lines.append('Rejected: ' + ', '.join(f'{reason} {rate:.0%}' for reason, rate in
+                                               sorted(total['failure_rates'].items(), key=lambda item: -item[1])))
+    return '\n'.join(lines)
+
+
+def serve(status_dir, port):
+    '''Serve the status of all workers and the totals as json, in a daemon thread'''
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip('/') not in ['', '/status']:
+                self.send_error(404)
+                return
+            statuses = load_statuses(status_dir)
+            body = json.dumps({'total': aggregate(statuses), 'workers': statuses}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('localhost', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    # The same base path as Runner
+    default_path = '../data/batch2' if os.getcwd().endswith('controllers') else 'data/batch2'
+
+    parser = argparse.ArgumentParser(description="Live status of all running controllers")
+    parser.add_argument("--path_main", type=str, default=default_path, help="Folder with info.csv")
+    parser.add_argument("--refresh", type=float, default=2., help="Seconds between two refreshes")
+    parser.add_argument("--http", type=int, default=None, help="Also serve the status as json on this port")
+    parser.add_argument("--once", action='store_true', help="Print the status once and stop")
+    args = parser.parse_args()
+
+    status_dir = get_status_dir(args.path_main)
+    if args.http is not None:
+        serve(status_dir, args.http)
+        print(f'Serving the status on http://localhost:{args.http}/status')
+    while True:
+        text = render(load_statuses(status_dir))
+        if args.once:
+            print(text)
+            break
+        # Clear the terminal and draw the table again
+        print('\033[2J\033[H' + text, flush=True)
+        time.sleep(args.refresh)
@@ -0,0 +1,157 @@
+'''
+Local cache of the asset bundles of the scenes and models, so trials can be created without network (e.g. on compute nodes)
+prefetch() downloads the bundles once into {cache_dir}/{platform}/{library}/{name} and pins them in {cache_dir}/assets.json,
+with the url, sha256 and size of every bundle and the tdw version they were downloaded for.
+use_local_assets() points the records of the librarians (also the ones of Controller.get_add_object/get_add_scene) at the cached files,
+records that are not in the cache keep their url. A pinned bundle is used even if the library has a newer url for it,
+prefetch again (or with --verify) to update the cache.
+'''
+import hashlib
+import os
+import platform
+import shutil
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from tdw.controller import Controller
+from tdw.version import __version__
+
+from . import objects
+from .helpers import get_librarian, message
+from .manifest import load_manifest, save_manifest
+
+# Models that are not in the lists of objects.py, e.g. rolled down the slope of rolling_down.py
+EXTRA_MODELS = ['golf']
+
+# Tries per download
+TRIES = 3
+
+
+def get_lock_path(cache_dir):
+    return f'{cache_dir}/assets.json'
+
+
+def get_assets(all_models=False):
+    '''(library, name) of every scene and of every model the controllers use:
+    the object lists and TARGET_OBJECTS of objects.py in models_core.json (or models_flex.json), and all of models_flex.json (e.g. the balancers)
+    param all_models: all of models_core.json instead of only the object lists'''
+    assets = [('scenes.json', record.name) for record in get_librarian('scenes.json').records]
+    core = {record.name for record in get_librarian('models_core.json').records}
+    flex = {record.name for record in get_librarian('models_flex.json').records}
+    names = set(EXTRA_MODELS)
+    for value in vars(objects).values():
+        if isinstance(value, list) and all(isinstance(name, str) for name in value):
+            names.update(value)
+    if all_models:
+        names.update(core)
+    assets.extend(('models_core.json', name) for name in sorted(names) if name in core)
+    assets.extend(('models_flex.json', name) for name in sorted(flex))
+    missing = sorted(name for name in names if name not in core and name not in flex)
+    if missing:
+        print(message(f'{len(missing)} objects are not in models_core.json or models_flex.json: {missing}', 'warning'))
+    return assets
+
+
+def get_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def download(url, path):
+    '''Download to path atomically, retries TRIES times'''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    for attempt in range(TRIES):
+        try:
+            with urllib.request.urlopen(url, timeout=60) as response, open(path + '.tmp', 'wb') as f:
+                shutil.copyfileobj(response, f, 1 << 20)
+            os.replace(path + '.tmp', path)
+            return
+        except OSError:
+            if attempt == TRIES - 1:
+                raise
+            time.sleep(2 ** attempt)
+
+
+def prefetch(cache_dir, assets, system=None, workers=8, verify=False):
+    '''Download the asset bundles that are not in the cache yet and pin them in assets.json
+    param system: platform of the bundles (Linux, Windows or Darwin), by default this platform
+    param verify: check the sha256 of the cached bundles, mismatches are downloaded again
+    Returns: the number of downloaded bundles and the (library, name) of the bundles that failed'''
+    system = system or platform.system()
+    path_lock = get_lock_path(cache_dir)
+    lock = load_manifest(path_lock) or {'assets': {}}
+    if lock.get('tdw', __version__) != __version__:
+        print(message(f"The cache has bundles of tdw {lock['tdw']}, bundles of tdw {__version__} are added", 'warning'))
+
+    def fetch(asset):
+        library, name = asset
+        key = f'{system}/{library}/{name}'
+        url = get_librarian(library).get_record(name).urls[system]
+        path = f'{cache_dir}/{key}'
+        pinned = lock['assets'].get(key)
+        if pinned is not None and os.path.exists(path) and os.path.getsize(path) == pinned['size']:
+            if not verify or get_sha256(path) == pinned['sha256']:
+                return key, pinned, False
+        if url.startswith('file:///'):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copyfile(url[len('file://'):], path + '.tmp')
+            os.replace(path + '.tmp', path)
+        else:
+            download(url, path)
+        return key, {'library': library, 'name': name, 'url': url, 'sha256': get_sha256(path), 'size': os.path.getsize(path)}, True
+
+    downloaded, failed = 0, []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch, asset): asset for asset in assets}
+        for i, (future, asset) in enumerate(futures.items()):
+            try:
+                key, pinned, new = future.result()
+            except OSError as e:
+                print(message(f'{asset[0]} {asset[1]} could not be downloaded: {e}', 'error'))
+                failed.append(asset)
+                continue
+            lock['assets'][key] = pinned
+            downloaded += new
+            if new:
+                print(f'{i+1}/{len(assets)} {key} ({pinned["size"]/1e6:.1f}MB)')
+                # Save now and then, so an interrupted prefetch keeps its downloads
+                if downloaded % 20 == 0:
+                    save_manifest(path_lock, dict(lock, tdw=__version__))
+    save_manifest(path_lock, dict(lock, tdw=__version__))
+    return downloaded, failed
+
+
+def use_local_assets(cache_dir, verify=False):
+    '''Point the records of the cached bundles at the local files, for the librarians of get_librarian() and of the Controller
+    param verify: check the sha256 of every bundle, bundles that do not match keep their url
+    Returns: the number of local records and of the assets of get_assets() that are not cached'''
+    lock = load_manifest(get_lock_path(cache_dir))
+    if lock is None:
+        print(message(f'No asset cache in {cache_dir}, run prefetch_assets.py first, the bundles are downloaded', 'warning'))
+        return 0, None
+    if lock['tdw'] != __version__:
+        print(message(f"The asset bundles were prefetched for tdw {lock['tdw']}, not for tdw {__version__}", 'warning'))
+
+    system = platform.system()
+    local = set()
+    for library in sorted({pinned['library'] for pinned in lock['assets'].values()}):
+        librarian = get_librarian(library)
+        for record in librarian.records:
+            pinned = lock['assets'].get(f'{system}/{library}/{record.name}')
+            path = Path(f'{cache_dir}/{system}/{library}/{record.name}').resolve()
+            if pinned is None or not path.exists() or path.stat().st_size != pinned['size'] or (verify and get_sha256(path) != pinned['sha256']):
+                continue
+            record.urls[system] = path.as_uri()
+            local.add((library, record.name))
+
+        # Controller.get_add_object and get_add_scene use their own librarians
+        librarians = Controller.SCENE_LIBRARIANS if library.startswith('scenes') else Controller.MODEL_LIBRARIANS
+        librarians[library] = librarian
+
+    # Only the assets the controllers use count as missing, not every record of the libraries
+    missing = [asset for asset in get_assets() if asset not in local and not get_librarian(asset[0]).get_record(asset[1]).urls[system].startswith('file:///')]
+    return len(local), len(missing)
@@ -0,0 +1,145 @@
+'''
+Runtime to drive several builds from one Python process, with one thread per build and one shared asyncio event loop for the sockets
+This is not a coroutine based trial loop: the Runner subclasses are used as they are, every controller runs its (blocking) trial loop
+in its own worker thread, and only the ZMQ socket calls are handed to the event loop, which owns the sockets of all builds.
+A process with N builds therefore has N worker threads plus the thread of the event loop. The gain over separate processes
+(multiple_runner.py) is one copy of pandas/scipy/skimage and of the librarians (see get_librarian), not fewer threads.
+While a worker thread waits on its build the others run (zmq and the image writes release the GIL), the python work of the
+controllers is still serialized by the GIL. acommunicate() also wraps the blocking communicate in a thread.
+info.csv is written by the shared writer in metadata.py, the frames of every build are kept in their own temp folder.
+
+NOTE: the runners share the random module, so resuming (--resume) continues the trials but not the exact same random choices
+NOTE: every build should run another controller or trial_type, because the manifests are per controller and trial_type
+
+Example usage:
+runtime = BuildRuntime()
+results = runtime.run([(Collision, {'num': 5, 'trial_type': 'object'}),
+                       (Containment, {'num': 5, 'trial_type': 'agent'})], port_start=1071, builds=2)
+'''
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import zmq
+import zmq.asyncio
+
+from .helpers import message
+
+
+class LoopSocket:
+    '''Blocking socket interface on top of a zmq.asyncio socket that lives in the event loop of the runtime,
+    the controller thread waits while the event loop serves the other builds'''
+    def __init__(self, socket, loop):
+        self._loop = loop
+
+        # The receive timeout of the socket (see watchdog.py) is applied while waiting on the event loop
+        timeout = socket.getsockopt(zmq.RCVTIMEO)
+        self._timeout = None if timeout < 0 else timeout / 1000
+
+        # The asyncio socket is bound to the event loop it is created in
+        self._socket = self._run(self._shadow(socket))
+
+    def _run(self, coroutine, timeout=None):
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise zmq.Again()
+
+    def set_timeout(self, seconds):
+        '''Receive timeout while waiting on the event loop, None waits forever'''
+        self._timeout = seconds
+
+    def rewrap(self, socket):
+        '''LoopSocket of a new socket on the same event loop, e.g. for a relaunched build'''
+        return LoopSocket(socket, self._loop)
+
+    @staticmethod
+    async def _shadow(socket):
+        return zmq.asyncio.Socket.from_socket(socket)
+
+    @staticmethod
+    async def _call(method, *args, **kwargs):
+        # The future of the asyncio socket is created in the event loop as well
+        return await method(*args, **kwargs)
+
+    def send_multipart(self, msg_parts, *args, **kwargs):
+        return self._run(self._call(self._socket.send_multipart, msg_parts, *args, **kwargs))
+
+    def recv_multipart(self, *args, **kwargs):
+        return self._run(self._call(self._socket.recv_multipart, *args, **kwargs), self._timeout)
+
+    def send(self, data, *args, **kwargs):
+        return self._run(self._call(self._socket.send, data, *args, **kwargs))
+
+    def recv(self, *args, **kwargs):
+        return self._run(self._call(self._socket.recv, *args, **kwargs), self._timeout)
+
+    def __getattr__(self, name):
+        return getattr(self._socket, name)
+
+
+class BuildRuntime:
+    def __init__(self):
+        # The event loop runs in its own thread, the (blocking) controller code in the worker threads
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        self.controllers = []
+
+    def attach(self, controller, port):
+        '''Move the socket of a (connected) controller to the event loop, the frames of the build are saved in their own folder'''
+        controller.socket = LoopSocket(controller.socket, self.loop)
+        controller.temp_dir = f'temp_{port}'
+        self.controllers.append(controller)
+        return controller
+
+    def start(self, builds):
+        '''Worker threads for the blocking controller code, one per build'''
+        self._executor = ThreadPoolExecutor(max_workers=builds)
+
+    async def call(self, function, *args, **kwargs):
+        '''Run blocking controller code (e.g. controller.run) in a worker thread, without blocking the other builds'''
+        return await asyncio.get_running_loop().run_in_executor(self._executor, lambda: function(*args, **kwargs))
+
+    async def create(self, controller_class, port):
+        '''Launch a build on port and connect a controller to it, without blocking the other builds'''
+        controller = await self.call(controller_class, port=port)
+        return self.attach(controller, port)
+
+    async def run_controller(self, controller_class, run_kwargs, ports):
+        '''Coroutine that waits for a free port, creates a controller on it and runs its set of trials'''
+        port = await ports.get()
+        try:
+            controller = await self.create(controller_class, port)
+            result = await self.call(controller.run, **run_kwargs)
+
+            # The build is terminated at the end of run, free the port for the next job
+            controller.socket.close()
+            return result
+        except Exception as e:
+            return message(f'Build at port {port} ({controller_class.__name__}) stopped: {e}', 'error')
+        finally:
+            ports.put_nowait(port)
+
+    async def gather(self, jobs, port_start=1071, builds=None):
+        '''Run all jobs, a list of (controller class, run kwargs), on at most builds builds at the same time
+        Returns: the messages of all jobs'''
+        builds = len(jobs) if builds is None else min(builds, len(jobs))
+        self.start(builds)
+        ports = asyncio.Queue()
+        for port in range(port_start, port_start + builds):
+            ports.put_nowait(port)
+        return await asyncio.gather(*[self.run_controller(controller_class, run_kwargs, ports)
+                                      for controller_class, run_kwargs in jobs])
+
+    def run(self, jobs, port_start=1071, builds=None):
+        '''Blocking version of gather()'''
+        return asyncio.run_coroutine_threadsafe(self.gather(jobs, port_start, builds), self.loop).result()
+
+
+async def acommunicate(controller, commands):
+    '''Awaitable controller.communicate, for controller logic written as coroutines
+    It is not a native coroutine: the blocking communicate runs in a thread of the default executor, 
+    the event loop keeps serving the other builds meanwhile'''
+    return await asyncio.get_running_loop().run_in_executor(None, controller.communicate, commands)
@@ -0,0 +1,100 @@
+'''
+Coverage of the dataset over runs, to sample a balanced dataset with fewer trials
+The number of committed trials is counted per cell (controller, trial_type, object, partner, room) in {path_main}/coverage.json.
+A controller lists the cells it can create (Runner.coverage_cells), with steering the least covered cell is chosen
+instead of a random one, and with a quota the set of trials stops as soon as every cell has quota trials.
+The partner is the second object of a trial (e.g. the container), None for trials with one object.
+Controllers in other processes or on other nodes (multiple_runner.py, lease_worker.py) count in the same file,
+every update holds the lock file {path}.lock, which is created exclusively (O_EXCL) like the leases of lease_queue.py.
+'''
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from .lease_queue import get_node_name
+
+# All controllers of one process (see async_runtime.py) count in the same file
+_lock = threading.Lock()
+
+# Seconds after which a lock file is left by a process that stopped while it held it
+LOCK_STALE = 30
+
+
+def get_coverage_path(path_main):
+    return f'{path_main}/coverage.json'
+
+
+def get_key(controller_name, trial_type, room, cell):
+    obj, partner = cell
+    return '|'.join([controller_name, trial_type, str(obj), str(partner), room])
+
+
+def load_coverage(path):
+    '''Returns dict with key:count, empty dict if nothing is counted yet'''
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+@contextmanager
+def file_lock(path, stale=LOCK_STALE):
+    '''Hold {path}.lock, waits while another process holds it, a lock older than stale seconds is removed'''
+    path_lock = path + '.lock'
+    while True:
+        try:
+            os.close(os.open(path_lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path_lock) > stale:
+                    os.remove(path_lock)
+            except FileNotFoundError:
+                pass
+            time.sleep(.05)
+    try:
+        yield
+    finally:
+        os.remove(path_lock)
+
+
+class CoverageTracker:
+    def __init__(self, path, controller_name, trial_type, room):
+        self.path = path
+        self.controller_name, self.trial_type, self.room = controller_name, trial_type, room
+        self.counts = load_coverage(path)
+
+    def refresh(self):
+        '''Read the counts of all controllers again, they are added by other processes and nodes as well'''
+        with _lock, file_lock(self.path):
+            self.counts = load_coverage(self.path)
+
+    def count(self, cell):
+        return self.counts.get(get_key(self.controller_name, self.trial_type, self.room, cell), 0)
+
+    def choose(self, cells):
+        '''One of the least covered cells over all controllers, ties are broken randomly'''
+        self.refresh()
+        counts = [self.count(cell) for cell in cells]
+        least = min(counts)
+        return random.choice([cell for cell, count in zip(cells, counts) if count == least])
+
+    def add(self, cell):
+        '''Count a committed trial, the file is read again first so other controllers' counts are kept'''
+        key = get_key(self.controller_name, self.trial_type, self.room, cell)
+        path_tmp = f'{self.path}.{get_node_name()}.tmp'
+        with _lock, file_lock(self.path):
+            self.counts = load_coverage(self.path)
+            self.counts[key] = self.counts.get(key, 0) + 1
+            with open(path_tmp, 'w') as f:
+                json.dump(self.counts, f, indent=1, sort_keys=True)
+            os.replace(path_tmp, self.path)
+
+    def missing(self, cells, quota):
+        '''Number of trials that are still needed to give every cell quota trials, also counting the trials of other controllers'''
+        self.refresh()
+        return sum(max(quota - self.count(cell), 0) for cell in cells)
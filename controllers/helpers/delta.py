@@ -0,0 +1,72 @@
+'''
+Sparse storage of frames as a delta against the background image of a set of trials
+The frames are split into tiles, only the tiles that differ from the background are stored.
+Decoding gives back exactly the same frames (as they were decoded from the png/jpg files).
+This only makes sense for controllers with a static camera, e.g. Containment and rolling_down,
+for moving cameras it still works but most tiles will differ.
+
+Example usage:
+mask, values = encode_delta(frames, background)
+frames = decode_delta(mask, values, background)
+'''
+import numpy as np
+from PIL import Image
+
+
+def _to_tiles(images, tile):
+    '''Pad images (..., H, W, C) to a multiple of tile and return a view of shape (..., H/tile, W/tile, tile, tile, C)'''
+    h, w, c = images.shape[-3:]
+    pad_h, pad_w = -h % tile, -w % tile
+    if pad_h or pad_w:
+        pad = [(0, 0)] * (images.ndim - 3) + [(0, pad_h), (0, pad_w), (0, 0)]
+        images = np.pad(images, pad, mode='edge')
+    th, tw = images.shape[-3] // tile, images.shape[-2] // tile
+    tiles = images.reshape(images.shape[:-3] + (th, tile, tw, tile, c))
+    return np.moveaxis(tiles, -4, -3)
+
+
+def encode_delta(frames, background, tile=16):
+    '''Encode frames as the tiles that differ from the background
+    param frames: uint8 array of shape (frames, H, W, C)
+    param background: uint8 array of shape (H, W, C)
+    param tile: size of the tiles in pixels, 16 lines up with the blocks of jpg compression
+    Returns: mask of changed tiles (frames, H/tile, W/tile) and the values of those tiles (n_changed, tile, tile, C)'''
+    frames, background = np.asarray(frames), np.asarray(background)
+    if frames.shape[1:] != background.shape:
+        raise ValueError(f'frames of shape {frames.shape[1:]} do not match the background of shape {background.shape}')
+    frame_tiles = _to_tiles(frames, tile)
+    background_tiles = _to_tiles(background, tile)
+    mask = (frame_tiles != background_tiles[np.newaxis]).any(axis=(-3, -2, -1))
+    return mask, frame_tiles[mask]
+
+
+def decode_delta(mask, values, background):
+    '''Decode the output of encode_delta back to frames
+    Returns: uint8 array of shape (frames, H, W, C)'''
+    background = np.asarray(background)
+    h, w, c = background.shape
+    tile = values.shape[1]
+    background_tiles = _to_tiles(background, tile)
+    frame_tiles = np.repeat(background_tiles[np.newaxis], mask.shape[0], axis=0)
+    frame_tiles[mask] = values
+
+    # Back to (frames, H, W, C) and remove padding
+    frames = np.moveaxis(frame_tiles, -3, -4).reshape(mask.shape[0], mask.shape[1]*tile, mask.shape[2]*tile, c)
+    return frames[:, :h, :w]
+
+
+def save_delta(path, frames, background, background_path, tile=16):
+    '''Encode frames and save them compressed as npz, including the path of the background image
+    Returns: fraction of tiles that is stored'''
+    mask, values = encode_delta(frames, background, tile)
+    np.savez_compressed(path, mask=mask, values=values, tile=tile, background_path=background_path)
+    return mask.mean() if mask.size else 0.
+
+
+def load_delta(path, background=None):
+    '''Load frames saved with save_delta,
+    the background image is loaded from the stored path if it is not given'''
+    data = np.load(path)
+    if background is None:
+        background = np.asarray(Image.open(str(data['background_path'])).convert('RGB'))
+    return decode_delta(data['mask'], data['values'], background)
@@ -0,0 +1,72 @@
+'''
+Cached per-model force magnitudes, calibrated offline with calibrate_force.py
+For every model, physics settings (see PHYSICS) and floor (the scene name, 'empty' for the empty room) the table has the swept magnitudes,
+the measured displacement, peak speed and rise, and the range of magnitudes that reached the target displacement, e.g.:
+{"apple": {"library_version": "1.12.7", "physics": {"mass_1": {"empty": {"range": [12.1, 30.5], "magnitudes": [...], ...}}}}}
+get_magnitude samples from the calibrated range, models without a range keep the heuristic
+'''
+import json
+import os
+from functools import lru_cache
+
+# The table is stored next to the data folder, independent of the working directory
+CALIBRATION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'calibration')
+
+
+# Physics settings with which the controllers spawn the objects that get a force, passed to get_add_physics_object
+# library: the mass and friction of the library (containment, rolling_down, warming_up)
+# mass_1: collision and occlusion, occlusion also scales the objects (and their mass), the calibration is at scale 1
+PHYSICS = {'library': {},
+           'mass_1': {'default_physics_values': False, 'mass': 1, 'scale_mass': False}}
+
+
+def get_table_path():
+    return os.path.join(CALIBRATION_PATH, 'forces.json')
+
+
+@lru_cache(maxsize=4)
+def _load_table(path, mtime):
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_force_table():
+    '''Returns the calibrated table, empty dict if nothing is calibrated yet
+    The table is only read again when the file changed, get_magnitude is called every trial'''
+    path = get_table_path()
+    try:
+        return _load_table(path, os.path.getmtime(path))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_force_table(table):
+    '''Write the table atomically, so an interrupted run never leaves a half written file'''
+    path = get_table_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(table, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def is_calibrated(table, name, floor, physics, library_version):
+    '''True if model name is already calibrated on floor with the physics settings for this version of the library'''
+    entry = table.get(name, {})
+    return entry.get('library_version') == library_version and floor in entry.get('physics', {}).get(physics, {})
+
+
+def get_calibrated_range(name, floor=None, physics='library'):
+    '''Range [low, high] of magnitudes that move model name, spawned with the physics settings, to the target displacement on floor,
+    falls back to the empty room if floor is not calibrated, None if the model has no range'''
+    floors = load_force_table().get(name, {}).get('physics', {}).get(physics, {})
+    for key in [floor, 'empty']:
+        if floors.get(key, {}).get('range') is not None:
+            return floors[key]['range']
+    return None
+
+
+def fit_range(magnitudes, displacements, rises, min_displacement, max_displacement, max_rise):
+    '''Range of the swept magnitudes that reached the target displacement without flying off, None if no magnitude did'''
+    accepted = [magnitude for magnitude, displacement, rise in zip(magnitudes, displacements, rises)
+                if min_displacement <= displacement <= max_displacement and rise <= max_rise]
+    return [min(accepted), max(accepted)] if accepted else None
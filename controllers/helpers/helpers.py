@@ -5,11 +5,12 @@ import ffmpeg
 import sys
 
 # For get_two_random_records()
-from tdw.librarian import ModelLibrarian
+from tdw.librarian import ModelLibrarian, SceneLibrarian
+from functools import lru_cache
 from tdw.tdw_utils import TDWUtils
 
 # For get_sleeping() and get_transforms()
-from tdw.output_data import OutputData, Transforms, Rigidbodies
+from tdw.output_data import OutputData, Transforms, Rigidbodies, SegmentationColors
 
 # For rotation in degrees (get_transforms)
 from scipy.spatial.transform import Rotation
@@ -19,11 +20,15 @@ from tdw.output_data import StaticRigidbodies
 
 import shutil
 import os
+from PIL import Image
 
 import argparse
 
 # For adding target object
 from .objects import TARGET_OBJECTS
+
+# For get_magnitude()
+from .force_table import get_calibrated_range
 from tdw.controller import Controller
 
 class ObjectInfo:
@@ -68,9 +73,52 @@ def get_random_avatar_position(radius_min: float, radius_max: float, y_min: floa
 
         return {"x": a_x, "y": a_y, "z": a_z}
 
-def images_to_video(image_folder, video_name, fps, pass_masks, png, save_frames, save_mp4):
-    '''From https://github.com/kkroening/ffmpeg-python/blob/master/examples/README.md#assemble-video-from-sequence-of-frames'''
-    if save_mp4:
+def images_to_mkv(image_folder, video_name, fps, pass_masks, png, img_codec='libx264'):
+    '''Encode all passes of a trial into one Matroska file with one ffmpeg process, one video stream per pass mask
+    _img is encoded with img_codec (lossy), the other passes (_id, _category, _mask, ...) with the lossless FFV1, so the colors stay exact
+    Every first frame is skipped by starting the image sequence at the second frame, without a filter
+    Returns: path of the mkv file, the streams are in the order of pass_masks and have the pass mask as title'''
+    path_video = video_name + '.mkv'
+    streams, options = [], {}
+    for i, mask_type in enumerate(pass_masks):
+        file_ex = '.jpg' if not png and mask_type == '_img' else '.png'
+        # The frame numbers of the capture continue over trials
+        paths = get_frame_paths(image_folder, mask_type, png)
+        if not paths:
+            raise FileNotFoundError(f'No {mask_type} frames in {image_folder} to encode in {path_video}')
+        first_frame = min(int(os.path.basename(path)[len(mask_type):-len(file_ex)]) for path in paths)
+        streams.append(ffmpeg.input(f'{image_folder}/{mask_type.replace("_", "", 1)}_%04d{file_ex}', framerate=fps, 
+                                    start_number=first_frame+1))
+        if mask_type == '_img':
+            options.update({f'c:v:{i}': img_codec, f'pix_fmt:v:{i}': 'yuv420p'})
+        else:
+            options.update({f'c:v:{i}': 'ffv1', f'pix_fmt:v:{i}': 'bgr0'})
+        options[f'metadata:s:v:{i}'] = f'title={mask_type}'
+
+    ffmpeg.output(*streams, path_video, loglevel="quiet", **options).run(overwrite_output=True)
+    return path_video
+
+def load_mkv(path_video):
+    '''Load all streams of a trial saved by images_to_mkv
+    Returns: dict with pass mask:frames of shape (frames, H, W, 3), without the first frame of the trial'''
+    frames = {}
+    for i, stream in enumerate(ffmpeg.probe(path_video)['streams']):
+        out, _ = (
+            ffmpeg
+            .input(path_video)
+            .output('pipe:', format='rawvideo', pix_fmt='rgb24', map=f'0:{i}', loglevel="quiet")
+            .run(capture_stdout=True)
+        )
+        mask_type = stream.get('tags', {}).get('title', stream.get('tags', {}).get('TITLE', str(i)))
+        frames[mask_type] = np.frombuffer(out, np.uint8).reshape(-1, stream['height'], stream['width'], 3)
+    return frames
+
+def images_to_video(image_folder, video_name, fps, pass_masks, png, save_frames, save_mp4, video_format='mp4', img_codec='libx264'):
+    '''From https://github.com/kkroening/ffmpeg-python/blob/master/examples/README.md#assemble-video-from-sequence-of-frames
+    param video_format: mp4 for one video per pass mask, mkv for one file per trial with lossless label passes (see images_to_mkv)'''
+    if save_mp4 and video_format == 'mkv':
+        path_videos = [images_to_mkv(image_folder, video_name, fps, pass_masks, png, img_codec)]
+    elif save_mp4:
         path_videos = []
 
         # Create mp4 file
@@ -109,6 +157,25 @@ def images_to_video(image_folder, video_name, fps, pass_masks, png, save_frames,
 
     return path_videos, path_frames
 
+def get_frame_paths(image_folder, mask_type, png):
+    '''Returns the sorted paths of all frames of one pass mask in image_folder
+    param mask_type: pass mask, e.g. _img or _depth_simple
+    param png: if False _img frames are jpg files'''
+    file_ex = '.jpg' if not png and mask_type == '_img' else '.png'
+    prefix = f'{mask_type.replace("_", "", 1)}_'
+    file_names = [fn for fn in os.listdir(image_folder) if fn.startswith(prefix) and fn.endswith(file_ex) 
+                  and fn[len(prefix):-len(file_ex)].isdigit()]
+    # Sorted by frame number, the frame numbers of the capture continue over trials and get more digits after 9999
+    file_names.sort(key=lambda fn: int(fn[len(prefix):-len(file_ex)]))
+    return [f'{image_folder}/{fn}' for fn in file_names]
+
+def load_frames(image_folder, mask_type, png):
+    '''Load all frames of one pass mask as a numpy array of shape (frames, H, W, 3)'''
+    paths = get_frame_paths(image_folder, mask_type, png)
+    if not paths:
+        return np.zeros((0, 0, 0, 3), dtype=np.uint8)
+    return np.stack([np.asarray(Image.open(path).convert('RGB')) for path in paths])
+
 def message(message, message_type, progress=None):
     '''
     Example usage:
@@ -147,11 +214,19 @@ def message(message, message_type, progress=None):
         
     return formatted_message+"\r"
 
+@lru_cache(maxsize=None)
+def get_librarian(library):
+    '''Returns the librarian of library (e.g. models_core.json or scenes.json), 
+    every library is only loaded once per process, also when several builds are driven from one process'''
+    if library.startswith('scenes'):
+        return SceneLibrarian(library=library)
+    return ModelLibrarian(library)
+
 def get_record_with_name(name, json='models_full.json'):
     '''Get record of object by name
     param name: type str, should be in models_full.json
     '''
-    return ModelLibrarian(json).get_record(name)
+    return get_librarian(json).get_record(name)
         
 def get_two_random_records(smaller_list, larger_list, axis = [0, 1, 2]):
         '''This method gets two objects, where one is smaller then the other
@@ -191,6 +266,19 @@ def get_two_random_records(smaller_list, larger_list, axis = [0, 1, 2]):
                 if axis_met == axis:
                     return [o_smaller_rec, o_larger_rec], [bounds_extents_small, bounds_extents_large]
                 
+@lru_cache(maxsize=None)
+def get_valid_pairs(smaller_list, larger_list, axis=(0, 1, 2)):
+    '''All (smaller, larger) name pairs where the larger object is larger for all axis, the pairs get_two_random_records can return
+    param smaller_list, larger_list: tuples of names'''
+    extents = {name: TDWUtils.get_bounds_extents(get_record_with_name(name).bounds) for name in set(smaller_list + larger_list)}
+    return [(small, large) for small in smaller_list for large in larger_list
+            if all(extents[large][i] > extents[small][i] for i in axis)]
+
+def get_records_of_pair(pair):
+    '''The records and bounds extents of a (smaller, larger) pair, in the same format as get_two_random_records'''
+    records = [get_record_with_name(name) for name in pair]
+    return records, [TDWUtils.get_bounds_extents(record.bounds) for record in records]
+
 def get_sleeping(resp, o_id):
     ''' This function finds out if an object is sleeping or not
     param resp: responce of the last communicate
@@ -235,11 +323,35 @@ def get_transforms(resp, o_id):
 
     return o_rotation_deg, o_position, o_mass
 
-def get_magnitude(record, randomness=5):
-    ''' Returns a suitable magnitude for the object'''
+def get_segmentation_colors(resp, o_ids):
+    ''' Get the segmentation color (color in the _id pass) and model name of the objects with o_ids
+    #NOTE send_segmentation_colors should be sent 
+    Returns: dict with o_id:(color, name)'''
+    colors = {}
+    for i in range(len(resp) - 1):
+        r_id = OutputData.get_data_type_id(resp[i])
+        if r_id == "segm":
+            segm = SegmentationColors(resp[i])
+            for j in range(segm.get_num()):
+                if segm.get_object_id(j) in o_ids:
+                    colors[segm.get_object_id(j)] = (segm.get_object_color(j).tolist(), segm.get_object_name(j))
+    return colors
+
+def get_heuristic_magnitude(record):
+    ''' Returns the hand-tuned magnitude for the object, without noise'''
+    return (-TDWUtils.get_unit_scale(record)*2+55)/2 + (np.prod(TDWUtils.get_bounds_extents(record.bounds))*10+15)/2 - 5
+
+def get_magnitude(record, randomness=5, floor=None, physics='library'):
+    ''' Returns a suitable magnitude for the object
+    The magnitude is sampled from the calibrated range of the model (see calibrate_force.py),
+    models that are not calibrated get the heuristic with +-randomness noise
+    param floor: the name of the scene, the range of the empty room is used if the scene is not calibrated
+    param physics: the physics settings the object is spawned with, see PHYSICS in helpers/force_table.py'''
+    calibrated_range = get_calibrated_range(record.name, floor, physics)
+    if calibrated_range is not None:
+        return random.uniform(*calibrated_range)
     #NOTE: might have a bias random.uniform(-random_ness, random_ness)
-    magnitude = (-TDWUtils.get_unit_scale(record)*2+55)/2 + (np.prod(TDWUtils.get_bounds_extents(record.bounds))*10+15)/2 - 5 + random.uniform(-randomness, randomness)
-    return magnitude
+    return get_heuristic_magnitude(record) + random.uniform(-randomness, randomness)
 
 def get_distance(resp, o_id1, o_id2):
     '''Returns the distance between two objects, returns infinitely big number if resp is empty list'''
@@ -291,6 +403,33 @@ def create_arg_parser(process_pass_masks=True):
     parser.add_argument("--add_object_to_scene", default=False, type=bool, help="Add objects to the scene and background")
     parser.add_argument("--save_frames", default=True, type=bool, help="Save the frames")
     parser.add_argument("--save_mp4", default=False, type=bool, help="Save frames as MP4")
+    parser.add_argument("--video_format", type=str, default='mp4', choices=['mp4', 'mkv'], help="With save_mp4: one mp4 per pass mask, or one mkv per trial with lossless label passes")
+    parser.add_argument("--img_codec", type=str, default='libx264', help="ffmpeg codec of the _img stream of the mkv, e.g. libx264, libx265 or libvpx-vp9")
+    parser.add_argument("--save_delta", default=False, type=bool, help="Save _img frames as sparse delta against the background, for static cameras")
+    parser.add_argument("--save_roi", default=False, type=bool, help="Save crops around every object and their box tracks, needs _id pass")
+    parser.add_argument("--roi_size", type=int, default=64, help="Size in pixels of the crops around every object")
+    parser.add_argument("--open_loop_agent", default=False, type=bool, help="Agents plan their whole path up front instead of steering every frame")
+    parser.add_argument("--correction_every", type=int, default=0, help="Correct the path of open-loop agents every n frames, 0 is never")
+    parser.add_argument("--save_raw", default=False, type=bool, help="Save all frames of all passes of a trial in one memory-mapped numpy file")
+    parser.add_argument("--check_visibility", default=False, type=bool, help="Only accept trials where the objects are visible as the controller expects, needs _id pass")
+    parser.add_argument("--save_trajectory", default=False, type=bool, help="Save positions, rotations, velocities and collisions of every frame")
+    parser.add_argument("--pipeline", default=False, type=bool, help="Write images on worker threads and compute the next frame while the build renders")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds the build can take to respond before it is relaunched")
+    parser.add_argument("--coverage", default=False, type=bool, help="Choose the least covered objects over all runs instead of random ones")
+    parser.add_argument("--quota", type=int, default=None, help="Stop as soon as every object (pair) has this many trials, --num is the maximum")
+    parser.add_argument("--render_profile", type=str, default=None, choices=['draft', 'train', 'showcase'], help="Render settings, see helpers/render_profiles.py")
+    parser.add_argument("--twins", default=False, type=bool, help="Create an object twin of every transition trial that shares the frames before the transition")
+    parser.add_argument("--occupancy", default=False, type=bool, help="Place objects and cameras on free floor in other rooms than the empty room")
+    parser.add_argument("--assets", type=str, default=None, help="Folder of the local asset cache, see prefetch_assets.py")
+    parser.add_argument("--skip_settle", default=False, type=bool, help="Step the frames in which objects settle before a trial starts without rendering")
+    parser.add_argument("--stream", type=str, default=None, help="Address of a zmq socket that sends every accepted trial to training clients, e.g. tcp://127.0.0.1:5600")
+    parser.add_argument("--stream_mode", type=str, default='push', choices=['push', 'pub'], help="push: every trial to one client, waits for slow clients, pub: every trial to every client")
+    parser.add_argument("--stream_hwm", type=int, default=8, help="Number of trials that are queued for the stream clients")
+    parser.add_argument("--stream_timeout", type=float, default=60, help="Seconds a trial waits for a stream client when the queue is full, afterwards it is dropped")
+    parser.add_argument("--stream_only", default=False, type=bool, help="Only stream the trials, without writing their frames and videos to disk")
+    parser.add_argument("--port", type=int, default=1071, help="Port of the (first) build")
+    parser.add_argument("--builds", type=int, default=4, help="Number of builds driven from one process by async_runner.py")
+    parser.add_argument("--resume", action='store_true', help="Continue the last unfinished set of trials of this controller and trial_type")
     
     args = parser.parse_args()
     if not '_img' in args.pass_masks:
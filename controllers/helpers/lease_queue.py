@@ -0,0 +1,175 @@
+'''
+Work queue on a shared filesystem, to spread the generation of trials over several nodes without a scheduler service
+A queue spec (json) is split in work units of at most unit trials of one controller and trial_type:
+{"name": "batch3", "unit": 10, "targets": [{"controller": "occlusion", "trial_type": "object", "num": 200}, ...]}
+Every unit has its own trial_id and random seed, so the trial ids of all nodes are unique and a unit is reproducible.
+The queue folder has the units (units/), the leases (leases/) and the finished units (done/):
+- a node claims a unit by creating its lease file exclusively (O_EXCL), only one node can create it
+- the node renews the lease (its modification time) every couple of seconds while it works on the unit
+- a lease that is not renewed for ttl seconds is expired, another node takes it over by renaming it first (only one rename succeeds)
+- a finished unit gets a done file with the node that created it
+Every node writes to its own shard ({path_main}/shards/{node}), merge_shards() combines the info.csv of all shards,
+with only the trials of finished units of the node that finished them, so half-done units of crashed nodes are left out.
+NOTE: the clocks of the nodes should be roughly in sync, the ttl should be much larger than the clock difference
+'''
+import json
+import os
+import socket
+import threading
+import time
+import zlib
+import pandas as pd
+
+from .manifest import load_manifest, save_manifest
+from .metadata import load_info, write_info
+
+# Seconds after the last renewal after which a lease is expired
+LEASE_TTL = 120
+
+
+def get_node_name():
+    '''Name of this worker, unique over nodes and processes'''
+    return f'{socket.gethostname()}_{os.getpid()}'
+
+
+def get_shard_path(path_main, node):
+    return f'{path_main}/shards/{node}'
+
+
+def get_unit_trial_id(name, index):
+    '''17 digit trial id of a unit, the same on every node and different for every unit of the queue'''
+    return 10**16 + zlib.crc32(name.encode()) % 10**6 * 10**10 + index
+
+
+def create_units(queue_dir, spec):
+    '''Split the spec in units, units that already exist (e.g. created by another node) are kept
+    Returns: the names of all units'''
+    os.makedirs(f'{queue_dir}/units', exist_ok=True)
+    names = []
+    for target in spec['targets']:
+        for start in range(0, target['num'], spec.get('unit', 10)):
+            index = len(names)
+            unit = {'name': f"{spec['name']}_unit{index:05d}", 'controller': target['controller'], 'trial_type': target['trial_type'],
+                    'num': min(spec.get('unit', 10), target['num'] - start), 'trial_id': get_unit_trial_id(spec['name'], index),
+                    'seed': spec.get('seed', 0) + index, 'run': target.get('run', {})}
+            path = f"{queue_dir}/units/{unit['name']}.json"
+            if not os.path.exists(path):
+                save_manifest(path, unit)
+            names.append(unit['name'])
+    return names
+
+
+class LeaseQueue:
+    def __init__(self, queue_dir, node=None, ttl=LEASE_TTL):
+        self.queue_dir, self.ttl = queue_dir, ttl
+        self.node = node or get_node_name()
+        for folder in ['units', 'leases', 'done']:
+            os.makedirs(f'{queue_dir}/{folder}', exist_ok=True)
+
+    def _lease_path(self, name):
+        return f'{self.queue_dir}/leases/{name}.lease'
+
+    def units(self):
+        return sorted(fn[:-len('.json')] for fn in os.listdir(f'{self.queue_dir}/units') if fn.endswith('.json'))
+
+    def done(self):
+        '''dict with unit name:done record of all finished units'''
+        return {fn[:-len('.json')]: load_manifest(f'{self.queue_dir}/done/{fn}')
+                for fn in os.listdir(f'{self.queue_dir}/done') if fn.endswith('.json')}
+
+    def _create_lease(self, name):
+        try:
+            fd = os.open(self._lease_path(name), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'node': self.node, 'claimed': time.time()}, f)
+        return True
+
+    def _take_over(self, name):
+        '''Take over an expired lease, only one of the nodes that try this at the same time succeeds'''
+        path = self._lease_path(name)
+        try:
+            if time.time() - os.path.getmtime(path) < self.ttl:
+                return False
+            os.rename(path, f'{path}.expired_{self.node}')
+        except FileNotFoundError:
+            return False
+        os.remove(f'{path}.expired_{self.node}')
+        return self._create_lease(name)
+
+    def owner(self, name):
+        '''Node that holds the lease of a unit, None if there is no lease'''
+        try:
+            with open(self._lease_path(name)) as f:
+                return json.load(f)['node']
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def claim(self, skip=()):
+        '''Claim the next unit that is not done and not leased (or of which the lease expired)
+        param skip: names of units that should not be claimed, e.g. units that failed on this node
+        Returns: the unit, None if every unit is done or leased'''
+        done = set(self.done())
+        for name in self.units():
+            if name in done or name in skip:
+                continue
+            if self.owner(name) == self.node or self._create_lease(name) or self._take_over(name):
+                # The unit might be finished between listing and claiming
+                if os.path.exists(f'{self.queue_dir}/done/{name}.json'):
+                    self.release(name)
+                    continue
+                return load_manifest(f'{self.queue_dir}/units/{name}.json')
+        return None
+
+    def renew(self, name):
+        '''Renew the lease, returns False if the lease was taken over by another node'''
+        if self.owner(name) != self.node:
+            return False
+        os.utime(self._lease_path(name))
+        return True
+
+    def release(self, name):
+        if self.owner(name) == self.node:
+            os.remove(self._lease_path(name))
+
+    def complete(self, name, shard, stats=None):
+        '''Mark a unit as done by this node, returns False if the lease was lost meanwhile (the other node redoes the unit)'''
+        if self.owner(name) != self.node:
+            return False
+        save_manifest(f'{self.queue_dir}/done/{name}.json', {'node': self.node, 'shard': shard, 'finished': time.time(),
+                                                              'stats': stats or {}})
+        self.release(name)
+        return True
+
+    def keep_alive(self, name):
+        '''Renew the lease on a daemon thread until the returned event is set'''
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(self.ttl / 4):
+                if not self.renew(name):
+                    break
+        threading.Thread(target=renew, daemon=True).start()
+        return stop
+
+
+def merge_shards(queue_dir, path_main, columns):
+    '''Combine the info.csv of all shards into {path_main}/info.csv, only with the trials of finished units
+    of the node that finished them, trials that are already in info.csv are not added again
+    Returns: the number of added rows'''
+    units = {name: load_manifest(f'{queue_dir}/units/{name}.json') for name in LeaseQueue(queue_dir).units()}
+    finished = {(int(units[name]['trial_id']), record['shard']) for name, record in LeaseQueue(queue_dir).done().items() if name in units}
+    path_info = f'{path_main}/info.csv'
+    df = load_info(path_info, columns)
+    known = set(zip(df['trial_id'].astype(str), df['trial_num'].astype(str), df['trial_type'].astype(str)))
+    added = []
+    for shard in sorted({shard for _, shard in finished}):
+        shard_df = load_info(f'{shard}/info.csv', columns)
+        keep = [(int(trial_id), shard) in finished and (str(trial_id), str(trial_num), str(trial_type)) not in known
+                for trial_id, trial_num, trial_type in zip(shard_df['trial_id'], shard_df['trial_num'], shard_df['trial_type'])]
+        added.append(shard_df[keep])
+    if added:
+        df = pd.concat([df] + added, ignore_index=True)
+        write_info(path_info, df)
+    return sum(len(part) for part in added)
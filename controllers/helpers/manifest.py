@@ -0,0 +1,76 @@
+'''
+Run manifests, so a set of trials can be resumed after a crash or preemption
+A manifest is a json file per controller/trial_type with the target count, progress, RNG state and the committed trials.
+The manifest is the commit point of a trial: a trial is only committed once the manifest is updated,
+everything of a trial_num >= manifest['trial_num'] is partial and is removed when resuming
+'''
+import json
+import os
+import random
+import shutil
+import glob
+
+
+def get_manifest_path(path_main, controller_name, trial_type, name=None):
+    '''Returns the path of the manifest of a controller and trial_type, 
+    name separates sets of trials of the same controller and trial_type, e.g. the points of a sweep'''
+    if name is not None:
+        return f'{path_main}/manifests/{controller_name}_{trial_type}_{name}.json'
+    return f'{path_main}/manifests/{controller_name}_{trial_type}.json'
+
+
+def load_manifest(path):
+    '''Returns the manifest as dict, None if it doesn't exist'''
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_manifest(path, manifest):
+    '''Write manifest atomically, a crash during writing keeps the previous manifest'''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def get_rng_state():
+    '''Returns the state of the random module in a json serializable format'''
+    version, internal_state, gauss_next = random.getstate()
+    return [version, list(internal_state), gauss_next]
+
+
+def set_rng_state(state):
+    '''Restore the state of the random module from get_rng_state()'''
+    version, internal_state, gauss_next = state
+    random.setstate((version, tuple(internal_state), gauss_next))
+
+
+def remove_partial_trials(manifest, path_videos, df):
+    '''Remove the videos, frames and csv rows of trials that were not committed (yet)
+    param manifest: the loaded manifest
+    param path_videos: folder of the videos of this controller and trial_type, the other outputs are in the same folder structure
+    param df: info.csv as pandas DataFrame
+    Returns: df without the rows of the partial trials'''
+    trial_id, committed = manifest['trial_id'], manifest['trial_num']
+    paths = []
+    folders = [path_videos] + [path_videos.replace('videos', name, 1) for name in ['frames', 'raw', 'deltas', 'rois', 'visibility', 'trajectories']]
+    for folder in folders:
+        paths.extend(glob.glob(f'{folder}/{trial_id}_trial_*'))
+    for path in paths:
+        # e.g. 12345_trial_7_img.mp4 -> 7
+        trial_num = int(os.path.basename(path).split('_trial_')[1].split('_')[0].split('.')[0])
+        if trial_num >= committed:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    if len(df):
+        partial = (df['trial_id'].astype(str) == str(trial_id)) & (df['trial_num'].astype(int) >= committed)
+        df = df[~partial].reset_index(drop=True)
+    return df
@@ -0,0 +1,44 @@
+'''
+Shared writer of info.csv
+Several runners can write to the same info.csv, e.g. when several builds are driven from one process (see async_runtime.py).
+Every write re-reads the csv under a lock, so the rows of the other runners are kept.
+'''
+import os
+import threading
+import pandas as pd
+
+_lock = threading.Lock()
+
+
+def load_info(path, columns):
+    '''Load info.csv as DataFrame, an empty DataFrame if it doesn't exist
+    Older csv files might miss the newer columns, these are added as empty columns'''
+    try:
+        df = pd.read_csv(path, index_col=False)
+    except FileNotFoundError:
+        df = pd.DataFrame(index=None, columns=columns)
+    df = df.drop(columns='Unnamed: 0', errors='ignore')
+    for column in columns:
+        if column not in df.columns:
+            df[column] = None
+    return df
+
+
+def write_info(path, df):
+    '''Write csv atomically, a crash while writing would otherwise corrupt all previous rows'''
+    df.to_csv(path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def append_info_row(path, columns, params):
+    '''Add one row (one accepted trial) to info.csv'''
+    with _lock:
+        df = load_info(path, columns)
+        df.loc[len(df)] = pd.Series(dict(zip(columns, params)))
+        write_info(path, df)
+
+
+def update_info(path, columns, function):
+    '''Apply function to the DataFrame of info.csv and write the result, e.g. to remove rows'''
+    with _lock:
+        write_info(path, function(load_info(path, columns)))
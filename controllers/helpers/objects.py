@@ -1,3 +1,5 @@
+from .vetting import filter_vetted as _filter_vetted
+
 CONTAINERS = [
     '41.b03_696615_object001',
     '46.b03_basket',
@@ -256,6 +258,14 @@ OCCLUDED = [item.split('.')[1] for item in OCCLUDED]
 ROLLING_FLIPPED = [item.split('.')[1] for item in ROLLING_FLIPPED] 
 FAULTY = [item.split('.')[1] for item in FAULTY] 
 
+# Remove the objects that failed the automated vetting (see object_vetting.py), if there are cached verdicts
+CONTAINERS = _filter_vetted(CONTAINERS)
+CONTAINED = _filter_vetted(CONTAINED)
+OCCLUDERS = _filter_vetted(OCCLUDERS)
+OCCLUDERS_SEE_THROUGH = _filter_vetted(OCCLUDERS_SEE_THROUGH)
+OCCLUDED = _filter_vetted(OCCLUDED)
+ROLLING_FLIPPED = _filter_vetted(ROLLING_FLIPPED)
+
 # Objects to add to scene
 SCENE_OBJECTS = ["bowl", "cone", "cube", "cylinder", "dumbbell", "octahedron", "pentagon", "pipe", "platonic", "pyramid", "sphere", "torus", "triangular_prism"]
 
@@ -0,0 +1,130 @@
+'''
+Occupancy grid of the free floor of a scene, to spawn objects and cameras in free space in other rooms than the empty room
+The scene is analyzed once: rays are cast straight down on a grid over the scene regions, a cell is free if the ray hits the floor,
+and occupied if it hits furniture, a wall or nothing. The grid (heights, free cells and the clearance to the nearest occupied cell)
+is cached per scene in {path_main}/occupancy/{scene_name}.npz, see occupancy_index.py to analyze all scenes up front.
+Runner.sample_free and Runner.sample_camera resample the positions of the controllers until they are free.
+'''
+import os
+import numpy as np
+from scipy.ndimage import distance_transform_edt
+from tdw.output_data import OutputData, Raycast, SceneRegions
+
+# Size in meters of a cell of the grid
+CELL = .1
+
+# Height difference in meters with the floor that still counts as floor, e.g. for a carpet
+FLOOR_TOLERANCE = .05
+
+# Number of raycasts per communicate
+RAYS_PER_FRAME = 2000
+
+
+def get_occupancy_path(path_main, scene_name):
+    return f'{path_main}/occupancy/{scene_name}.npz'
+
+
+class OccupancyGrid:
+    def __init__(self, origin, cell, heights, floor, ceiling):
+        '''
+        param origin: (x, z) of the corner of cell (0, 0)
+        param heights: height of the first hit of every cell (rows are z, columns are x), nan outside the scene or without hit
+        param floor: height of the floor
+        param ceiling: height of the lowest ceiling of the scene regions
+        '''
+        self.origin, self.cell, self.heights = np.asarray(origin, dtype=float), cell, heights
+        self.floor, self.ceiling = floor, ceiling
+        self.free = np.abs(np.nan_to_num(heights, nan=np.inf) - floor) < FLOOR_TOLERANCE
+
+        # Distance in meters of every cell to the nearest occupied cell
+        self.clearance = distance_transform_edt(self.free) * cell
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez_compressed(path + '.tmp.npz', origin=self.origin, cell=self.cell, heights=self.heights, floor=self.floor,
+                            ceiling=self.ceiling)
+        os.replace(path + '.tmp.npz', path)
+
+    @classmethod
+    def load(cls, path):
+        '''The cached grid of a scene, None if the scene is not analyzed yet'''
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return cls(data['origin'], float(data['cell']), data['heights'], float(data['floor']), float(data['ceiling']))
+
+    def get_cell(self, position):
+        '''(row, column) of the cell of a position (dict with x and z), None outside the grid'''
+        column, row = ((np.array([position['x'], position['z']]) - self.origin) // self.cell).astype(int)
+        if 0 <= row < self.heights.shape[0] and 0 <= column < self.heights.shape[1]:
+            return row, column
+        return None
+
+    def is_free(self, position, radius=0.):
+        '''True if the floor within radius meters of position is free'''
+        cell = self.get_cell(position)
+        return cell is not None and self.clearance[cell] > radius
+
+    def path_free(self, start, end, radius=0.):
+        '''True if the floor along the straight path from start to end is free, e.g. for a rolling object'''
+        steps = max(int(np.hypot(end['x'] - start['x'], end['z'] - start['z']) / self.cell * 2), 1)
+        return all(self.is_free({'x': start['x'] + (end['x'] - start['x']) * t, 'z': start['z'] + (end['z'] - start['z']) * t}, radius)
+                   for t in np.linspace(0, 1, steps + 1))
+
+    def line_of_sight(self, start, end):
+        '''True if nothing of the scene is between the (3D) positions start and end, e.g. the camera and what it looks at'''
+        a, b = [np.array([p['x'], p['y'], p['z']], dtype=float) for p in [start, end]]
+        steps = max(int(np.linalg.norm(b - a) / self.cell * 2), 1)
+        for t in np.linspace(0, 1, steps + 1):
+            x, y, z = a + (b - a) * t
+            cell = self.get_cell({'x': x, 'z': z})
+            # The floor itself does not block, also not when the target is on the floor
+            if cell is None or np.isnan(self.heights[cell]) or (not self.free[cell] and self.heights[cell] > y) or y > self.ceiling:
+                return False
+        return True
+
+
+def get_scene_bounds(resp):
+    '''x_min, x_max, z_min, z_max and the lowest ceiling of the scene regions'''
+    for i in range(len(resp) - 1):
+        if OutputData.get_data_type_id(resp[i]) == "sreg":
+            regions = SceneRegions(resp[i])
+            centers = np.array([regions.get_center(j) for j in range(regions.get_num())])
+            bounds = np.array([regions.get_bounds(j) for j in range(regions.get_num())])
+            low, high = centers - bounds / 2, centers + bounds / 2
+            return low[:, 0].min(), high[:, 0].max(), low[:, 2].min(), high[:, 2].max(), high[:, 1].min()
+    raise ValueError('the scene has no scene regions')
+
+
+def analyze_scene(controller, scene_name, cell=CELL):
+    '''Load the scene and cast a ray down for every cell, returns the OccupancyGrid
+    NOTE: the scene is loaded without camera and objects, the controller should load it again afterwards'''
+    resp = controller.communicate([controller.get_add_scene(scene_name), {"$type": "send_scene_regions"}])
+    x_min, x_max, z_min, z_max, ceiling = get_scene_bounds(resp)
+    xs, zs = np.arange(x_min, x_max, cell) + cell / 2, np.arange(z_min, z_max, cell) + cell / 2
+    heights = np.full((len(zs), len(xs)), np.nan)
+
+    # Rays start just below the ceiling, the raycast id is the index of the cell
+    commands = [{"$type": "send_raycast", "id": int(k), "origin": {"x": float(xs[k % len(xs)]), "y": float(ceiling - .05), "z": float(zs[k // len(xs)])},
+                 "destination": {"x": float(xs[k % len(xs)]), "y": -1., "z": float(zs[k // len(xs)])}} for k in range(heights.size)]
+    for start in range(0, len(commands), RAYS_PER_FRAME):
+        resp = controller.communicate(commands[start:start+RAYS_PER_FRAME])
+        for i in range(len(resp) - 1):
+            if OutputData.get_data_type_id(resp[i]) == "rayc":
+                raycast = Raycast(resp[i])
+                if raycast.get_hit():
+                    heights.flat[raycast.get_raycast_id()] = raycast.get_point()[1]
+
+    # Most of the floor of a room is free
+    floor = float(np.nanmedian(heights))
+    return OccupancyGrid((x_min, z_min), cell, heights, floor, ceiling)
+
+
+def get_occupancy(controller, path_main, scene_name):
+    '''The cached grid of the scene, the scene is analyzed (and cached) the first time'''
+    path = get_occupancy_path(path_main, scene_name)
+    grid = OccupancyGrid.load(path)
+    if grid is None:
+        grid = analyze_scene(controller, scene_name)
+        grid.save(path)
+    return grid
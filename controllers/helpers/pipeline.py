@@ -0,0 +1,54 @@
+'''
+Image capture for the pipelined frame driver of Runner (see Runner.step)
+AsyncImageCapture does the same as ImageCapture, but the images are written to disk on worker threads,
+so saving the images of frame i overlaps with the build rendering frame i+1.
+Call flush() before reading or moving the frames on disk.
+'''
+from concurrent.futures import ThreadPoolExecutor
+from tdw.add_ons.image_capture import ImageCapture
+from tdw.output_data import OutputData, Images
+from tdw.tdw_utils import TDWUtils
+
+
+class AsyncImageCapture(ImageCapture):
+    def __init__(self, path, avatar_ids=None, png=False, pass_masks=None, max_workers=2):
+        super().__init__(path=path, avatar_ids=avatar_ids, png=png, pass_masks=pass_masks)
+        self._writer = ThreadPoolExecutor(max_workers=max_workers)
+        self._pending = []
+
+    def on_send(self, resp):
+        '''The same as ImageCapture.on_send, but TDWUtils.save_images runs on a worker thread'''
+        got_images = False
+        self.images.clear()
+        for i in range(len(resp) - 1):
+            r_id = OutputData.get_data_type_id(resp[i])
+            if r_id == "imag":
+                images = Images(resp[i])
+                a = images.get_avatar_id()
+                self.images[a] = images
+                if self._save and (len(self.avatar_ids) == 0 or a in self.avatar_ids):
+                    output_dir = self.path.joinpath(a)
+                    output_dir.mkdir(parents=True, exist_ok=True)
+                    self._pending.append(self._writer.submit(TDWUtils.save_images, images=images,
+                                                             output_directory=str(output_dir.resolve()),
+                                                             filename=TDWUtils.zero_padding(self.frame, 4)))
+                    got_images = True
+        if got_images:
+            self.frame += 1
+
+        # Forget about the writes that are done already
+        self._pending = [future for future in self._pending if not future.done()]
+        if self._frequency == "always":
+            self.commands.append({"$type": "send_images",
+                                  "frequency": "once",
+                                  "ids": self.avatar_ids})
+
+    def queue_depth(self):
+        '''Number of images that still have to be written'''
+        return sum(not future.done() for future in self._pending)
+
+    def flush(self):
+        '''Wait until all images are written, raises the errors of the writers'''
+        for future in self._pending:
+            future.result()
+        self._pending = []
@@ -0,0 +1,98 @@
+'''
+Open-loop agents: the whole path of a teleport-driven agent is computed up front,
+from the spawn positions and bounds, instead of deciding every frame from the transforms of the previous frame.
+The frame loop only streams the precomputed teleports, so no output data has to be requested per frame.
+Optionally the plan is corrected every correction_every frames with the observed positions (low-rate closed loop).
+
+NOTE: gravity is not simulated, the extra height of jumps (obstacle hops, up speeds) is not kept in the planned path,
+the physics is assumed to bring the agent back down; use correction_every if this drifts too much
+
+Example usage:
+agent = OpenLoopAgent(agent_id, target_id, start, target, speed=.06, reach_distance=.1, num_frames=200)
+for i in range(200):
+    agent.correct(i, resp)
+    commands, acted = agent.get_commands(i)
+    resp = self.communicate(commands)
+'''
+import numpy as np
+
+from .helpers import get_transforms
+
+
+class OpenLoopAgent:
+    def __init__(self, agent_id, target_id, start, target, speed, reach_distance, num_frames,
+                 obstacles=(), up_speeds=None, correction_every=0):
+        '''
+        param agent_id, target_id: object ids of the agent and target
+        param start, target: position dicts of the agent and target, e.g. the spawn positions
+        param speed: distance the agent teleports towards the target every frame
+        param reach_distance: the agent stops when the distance between the centers is smaller
+        param num_frames: number of frames the agent can act
+        param obstacles: list of (position, radius, height) of obstacles the agent hops over,
+                         radius should include the bounds of the agent
+        param up_speeds: optional extra upward teleport per frame, e.g. to jump out of a container
+        param correction_every: if > 0, re-plan every n frames from the observed positions
+        '''
+        self.agent_id, self.target_id = agent_id, target_id
+        self.speed, self.reach_distance, self.num_frames = speed, reach_distance, num_frames
+        self.obstacles = [(np.array([pos['x'], pos['y'], pos['z']], dtype=float), radius, height) for pos, radius, height in obstacles]
+        self.up_speeds = up_speeds if up_speeds is not None else []
+        self.correction_every = correction_every
+        self.plan(start, target, first_frame=0)
+
+    def plan(self, start, target, first_frame):
+        '''Compute the teleport of every frame from first_frame until the target is reached
+        The agent looks at the target every frame and moves speed towards it, like the closed-loop agents'''
+        self.steps = {}
+        self.reached_frame = None
+        self.target = target
+        position = np.array([start['x'], start['y'], start['z']], dtype=float)
+        target = np.array([target['x'], target['y'], target['z']], dtype=float)
+        last_hor_distance = [np.inf] * len(self.obstacles)
+        for frame in range(first_frame, self.num_frames):
+            offset = target - position
+            distance = np.linalg.norm(offset)
+            if distance < self.reach_distance:
+                self.reached_frame = frame
+                break
+            step = offset / distance * self.speed
+            position += step
+
+            # Jump if an obstacle is close and coming closer
+            extra_y = self.up_speeds[frame] if frame < len(self.up_speeds) else 0
+            for j, (obstacle, radius, height) in enumerate(self.obstacles):
+                #NOTE: the same formula as the closed-loop agent of collision.py
+                if np.linalg.norm(obstacle - position) - radius < height/self.speed + self.speed*3:
+                    hor_distance = np.linalg.norm((obstacle - position)[[0, 2]])
+                    if hor_distance < last_hor_distance[j]:
+                        extra_y += self.speed*2
+                    last_hor_distance[j] = hor_distance
+            self.steps[frame] = {"x": float(step[0]), "y": float(step[1] + extra_y), "z": float(step[2])}
+
+    def get_commands(self, frame):
+        '''Returns the commands of this frame and if the agent acted (teleported) in this frame'''
+        commands = []
+        if frame == 0:
+            # No output data per frame is needed anymore
+            commands.extend([{"$type": "send_transforms", "frequency": "never"},
+                             {"$type": "send_rigidbodies", "frequency": "never"}])
+        if self.correction_every and frame % self.correction_every == self.correction_every - 1:
+            # Request the positions once, the plan gets corrected in the next frame
+            commands.append({"$type": "send_transforms", "frequency": "once", "ids": [self.agent_id, self.target_id]})
+
+        acted = frame in self.steps
+        if acted:
+            commands.extend([{"$type": "object_look_at_position", "position": self.target, "id": self.agent_id},
+                             {"$type": "teleport_object_by", "position": self.steps[frame], "id": self.agent_id, "absolute": True}])
+        return commands, acted
+
+    def correct(self, frame, resp):
+        '''Re-plan from the observed positions in resp, only on the frames after the positions were requested'''
+        if not self.correction_every or frame == 0 or frame % self.correction_every != 0 or not resp:
+            return
+        agent_position, target_position = get_transforms(resp, self.agent_id)[1], get_transforms(resp, self.target_id)[1]
+        if agent_position is None or target_position is None:
+            return
+        self.plan({axis: float(value) for axis, value in zip(['x', 'y', 'z'], agent_position)},
+                  {axis: float(value) for axis, value in zip(['x', 'y', 'z'], target_position)},
+                  first_frame=frame)
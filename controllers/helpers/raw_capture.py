@@ -0,0 +1,180 @@
+'''
+Raw capture of trials as one memory-mapped numpy file per trial
+Instead of writing a png/jpg per pass per frame, the decoded frames of all passes are written into one preallocated file.
+Every frame is one record with all passes, so the file can grow while frames arrive,
+and every pass is a zero-copy view of shape (frames, H, W, C).
+The file starts with a small json header with the passes, resolution and the frame mapping (frame numbers of the ImageCapture).
+A trial is written as .partial and finalized (renamed) when it is accepted, a rejected trial is discarded by unlinking one file.
+
+NOTE: the build still encodes the images (png, or jpg for _img), they are decoded once here, consumers don't decode anymore
+
+Example usage:
+header, frames = load_raw(path)
+frames['_img'][10]  # (H, W, 3) uint8, read from disk when used
+'''
+import json
+import os
+import numpy as np
+
+from tdw.add_ons.image_capture import ImageCapture
+from tdw.output_data import OutputData, Images
+from tdw.tdw_utils import TDWUtils
+
+# Bytes reserved for the json header, the records start after it
+HEADER_SIZE = 65536
+RAW_VERSION = 1
+
+
+def get_record_dtype(shapes):
+    '''Structured dtype of one frame with all passes, shapes is a dict with pass mask:(H, W, C)'''
+    return np.dtype([(mask_type, np.uint8, shape) for mask_type, shape in shapes.items()])
+
+
+def write_header(f, header):
+    data = json.dumps(header).encode('utf-8')
+    if len(data) > HEADER_SIZE:
+        raise ValueError(f'The header of {len(data)} bytes does not fit in {HEADER_SIZE} bytes')
+    f.seek(0)
+    f.write(data.ljust(HEADER_SIZE, b' '))
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        return json.loads(f.read(HEADER_SIZE).decode('utf-8'))
+
+
+def load_raw(path, mode='r'):
+    '''Open a raw trial file
+    Returns: the header and a dict with pass mask:zero-copy view of shape (frames, H, W, C)'''
+    header = read_header(path)
+    shapes = {mask_type: tuple(shape) for mask_type, shape in header['shapes'].items()}
+    records = np.memmap(path, dtype=get_record_dtype(shapes), mode=mode, offset=HEADER_SIZE, shape=(header['num_frames'],))
+    return header, {mask_type: records[mask_type] for mask_type in shapes}
+
+
+class RawTrialWriter:
+    '''Writes the frames of one trial incrementally into a preallocated memmap'''
+    def __init__(self, path, max_frames=256):
+        self.path = path
+        self.max_frames = max_frames
+        self.shapes = None
+        self.records = None
+        self.frame_numbers = []
+
+    def _open(self, shapes):
+        self.shapes = shapes
+        self.dtype = get_record_dtype(shapes)
+        with open(self.path, 'wb') as f:
+            write_header(f, self._header(finalized=False))
+            f.truncate(HEADER_SIZE + self.dtype.itemsize * self.max_frames)
+        self.records = np.memmap(self.path, dtype=self.dtype, mode='r+', offset=HEADER_SIZE, shape=(self.max_frames,))
+
+    def _grow(self):
+        '''Double the preallocated number of frames, the file is sparse so this is cheap'''
+        self.records.flush()
+        del self.records
+        self.max_frames *= 2
+        with open(self.path, 'r+b') as f:
+            f.truncate(HEADER_SIZE + self.dtype.itemsize * self.max_frames)
+        self.records = np.memmap(self.path, dtype=self.dtype, mode='r+', offset=HEADER_SIZE, shape=(self.max_frames,))
+
+    def _header(self, finalized):
+        return {'version': RAW_VERSION, 'finalized': finalized, 'num_frames': len(self.frame_numbers),
+                'passes': list(self.shapes), 'shapes': {mask_type: list(shape) for mask_type, shape in self.shapes.items()},
+                'resolution': list(next(iter(self.shapes.values()))[1::-1]), 'frame_numbers': self.frame_numbers}
+
+    def write(self, frame_number, frames):
+        '''Write one frame, frames is a dict with pass mask:array (H, W, C)'''
+        if self.records is None:
+            self._open({mask_type: frame.shape for mask_type, frame in frames.items()})
+        if len(self.frame_numbers) == self.max_frames:
+            self._grow()
+        record = self.records[len(self.frame_numbers)]
+        for mask_type, frame in frames.items():
+            record[mask_type] = frame
+        self.frame_numbers.append(frame_number)
+
+    def get_frames(self, mask_type):
+        '''Zero-copy view of the frames of one pass that are written so far'''
+        return self.records[:len(self.frame_numbers)][mask_type]
+
+    def finalize(self, path):
+        '''Write the final header, cut the unused frames and move the file to path
+        Returns: path, None if no frame was written'''
+        if self.records is None:
+            self.discard()
+            return None
+        self.records.flush()
+        del self.records
+        with open(self.path, 'r+b') as f:
+            write_header(f, self._header(finalized=True))
+            f.truncate(HEADER_SIZE + self.dtype.itemsize * len(self.frame_numbers))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path, path)
+        return path
+
+    def discard(self):
+        self.records = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class RawImageCapture(ImageCapture):
+    '''ImageCapture that writes the frames of a trial into a RawTrialWriter instead of image files
+    Outside a trial (e.g. the background) and for the first frame of a trial, image files are still written,
+    since those are used to check the trial (e.g. occlusion) and as background'''
+    def __init__(self, path, avatar_ids=None, png=False, pass_masks=None):
+        super().__init__(path=path, avatar_ids=avatar_ids, png=png, pass_masks=pass_masks)
+        self.writer = None
+
+    def start_trial(self, path, max_frames=256):
+        '''Write the next frames to path, which should end with .partial'''
+        self.writer = RawTrialWriter(path, max_frames)
+
+    def finish_trial(self, path):
+        '''Finalize the raw file of the accepted trial at path, returns the path'''
+        writer, self.writer = self.writer, None
+        return writer.finalize(path) if writer is not None else None
+
+    def discard_trial(self):
+        '''Remove the raw file of a rejected trial'''
+        if self.writer is not None:
+            self.writer.discard()
+        self.writer = None
+
+    def on_send(self, resp):
+        if self.writer is None or not self.writer.frame_numbers:
+            # Image files, the same as ImageCapture
+            frame = self.frame
+            super().on_send(resp)
+            if self.writer is not None and self.frame != frame:
+                self._write_raw(frame)
+            return
+
+        self.images.clear()
+        for i in range(len(resp) - 1):
+            if OutputData.get_data_type_id(resp[i]) == "imag":
+                images = Images(resp[i])
+                self.images[images.get_avatar_id()] = images
+        if self._write_raw(self.frame):
+            self.frame += 1
+        if self._frequency == "always":
+            self.commands.append({"$type": "send_images",
+                                  "frequency": "once",
+                                  "ids": self.avatar_ids})
+
+    def _write_raw(self, frame_number):
+        '''Decode the images of this frame into the writer, returns if there were images'''
+        got_images = False
+        for a, images in self.images.items():
+            if self._save and (len(self.avatar_ids) == 0 or a in self.avatar_ids):
+                frames = {}
+                for j in range(images.get_num_passes()):
+                    frame = np.asarray(TDWUtils.get_pil_image(images, j))
+                    frames[images.get_pass_mask(j)] = frame.reshape(frame.shape[:2] + (-1,))
+                self.writer.write(frame_number, frames)
+                got_images = True
+        return got_images
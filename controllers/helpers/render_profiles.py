@@ -0,0 +1,28 @@
+'''
+Named render profiles, applied by Runner.run after the room is created (see Runner.create_scene)
+Without a profile the build renders at its defaults. Use benchmark_render.py to measure the frames/sec
+and bytes/frame of every profile, and choose the cheapest profile that is good enough, e.g. draft for physics-only studies
+that only need the _id pass.
+
+NOTE: the build renders all passes at the same screen size, so a profile sets one resolution for all pass masks
+'''
+
+PROFILES = {
+    # Label passes and debugging, as fast as possible
+    'draft': {'width': 128, 'height': 128, 'render_quality': 0, 'post_process': False, 'shadow_strength': 0.},
+    # Training data, the resolution of the build defaults without the expensive effects
+    'train': {'width': 256, 'height': 256, 'render_quality': 2, 'post_process': False, 'shadow_strength': .5},
+    # Videos to show
+    'showcase': {'width': 512, 'height': 512, 'render_quality': 5, 'post_process': True, 'shadow_strength': 1.},
+}
+
+
+def get_profile_commands(name):
+    '''The commands that apply render profile name, no commands if name is None'''
+    if name is None:
+        return []
+    profile = PROFILES[name]
+    return [{"$type": "set_screen_size", "width": profile['width'], "height": profile['height']},
+            {"$type": "set_render_quality", "render_quality": profile['render_quality']},
+            {"$type": "set_post_process", "value": profile['post_process']},
+            {"$type": "set_shadow_strength", "strength": profile['shadow_strength']}]
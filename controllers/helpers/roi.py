@@ -0,0 +1,87 @@
+'''
+Object-centric regions of interest (ROI) driven by the _id pass
+For every frame the bounding box of every trial object is computed from the _id pass,
+and fixed-size crops of the passes around every object (and every pair of objects) are exported.
+The box tracks are saved together with the crops and can be used as tracking ground truth.
+
+The segmentation color of every object comes from the send_segmentation_colors output, see get_segmentation_colors in helpers.helpers
+'''
+import numpy as np
+from itertools import combinations
+
+
+def pack_colors(images):
+    '''Pack rgb images (..., 3) of uint8 into one int32 per pixel, so colors can be compared at once'''
+    images = np.asarray(images, dtype=np.int32)
+    return (images[..., 0] << 16) | (images[..., 1] << 8) | images[..., 2]
+
+
+def get_boxes(id_frames, colors):
+    '''Bounding boxes of every object in every frame
+    param id_frames: _id pass of shape (frames, H, W, 3)
+    param colors: list of rgb segmentation colors, one per object
+    Returns: int array (frames, objects, 4) with [x_min, y_min, x_max, y_max], -1 if the object is not visible'''
+    ids = pack_colors(id_frames)
+    num_frames, height, width = ids.shape
+    boxes = np.full((num_frames, len(colors), 4), -1, dtype=np.int32)
+    for k, color in enumerate(pack_colors(np.asarray(colors).reshape(-1, 3))):
+        mask = ids == color
+        rows, cols = mask.any(axis=2), mask.any(axis=1)
+        visible = rows.any(axis=1)
+        boxes[visible, k, 0] = cols[visible].argmax(axis=1)
+        boxes[visible, k, 1] = rows[visible].argmax(axis=1)
+        boxes[visible, k, 2] = width - 1 - cols[visible, ::-1].argmax(axis=1)
+        boxes[visible, k, 3] = height - 1 - rows[visible, ::-1].argmax(axis=1)
+    return boxes
+
+
+def union_boxes(boxes_a, boxes_b):
+    '''Union of two box tracks (frames, 4), a frame where only one object is visible gets the box of that object'''
+    union = np.concatenate([np.minimum(boxes_a[:, :2], boxes_b[:, :2]), np.maximum(boxes_a[:, 2:], boxes_b[:, 2:])], axis=1)
+    union[boxes_a[:, 0] < 0] = boxes_b[boxes_a[:, 0] < 0]
+    union[boxes_b[:, 0] < 0] = boxes_a[boxes_b[:, 0] < 0]
+    return union
+
+
+def crop_frames(frames, boxes, size=64, margin=.1):
+    '''Square crops of a fixed size around the boxes, boxes larger than size are downsampled (nearest),
+    so label passes (e.g. _id) keep their exact values
+    param frames: array of shape (frames, H, W, C)
+    param boxes: box track (frames, 4), frames with -1 give empty (zero) crops
+    param margin: fraction of the box size that is added on every side
+    Returns: array of shape (frames, size, size, C)'''
+    num_frames, height, width = frames.shape[:3]
+    visible = boxes[:, 0] >= 0
+    center = np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2], axis=1)
+    side = np.maximum((boxes[:, 2:] - boxes[:, :2] + 1).max(axis=1) * (1 + 2*margin), size)
+
+    # Sample grid per frame, clipped to the frame
+    steps = (np.arange(size) + .5) / size - .5
+    xs = np.clip(np.round(center[:, :1] + steps[np.newaxis] * side[:, np.newaxis]), 0, width - 1).astype(np.int64)
+    ys = np.clip(np.round(center[:, 1:] + steps[np.newaxis] * side[:, np.newaxis]), 0, height - 1).astype(np.int64)
+    crops = frames[np.arange(num_frames)[:, None, None], ys[:, :, None], xs[:, None, :]]
+    crops[~visible] = 0
+    return crops
+
+
+def export_rois(path, frames, colors, labels, size=64, margin=.1):
+    '''Compute the box tracks and save the crops of all passes as compressed npz
+    param path: output file
+    param frames: dict with pass mask:frames (frames, H, W, 3), should contain _id
+    param colors: segmentation colors of the objects
+    param labels: names of the objects, e.g. '0_apple', used as keys in the file
+    Returns: the box tracks (frames, objects, 4)'''
+    boxes = get_boxes(frames['_id'], colors)
+    tracks = {label: boxes[:, k] for k, label in enumerate(labels)}
+
+    # Union box of every pair of objects
+    for (k1, label1), (k2, label2) in combinations(enumerate(labels), 2):
+        tracks[f'{label1}+{label2}'] = union_boxes(boxes[:, k1], boxes[:, k2])
+
+    output = {'boxes': boxes, 'labels': np.array(labels)}
+    for label, track in tracks.items():
+        output[f'box/{label}'] = track
+        for mask_type, pass_frames in frames.items():
+            output[f'crop{mask_type}/{label}'] = crop_frames(pass_frames, track, size, margin)
+    np.savez_compressed(path, **output)
+    return boxes
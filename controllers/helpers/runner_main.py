@@ -3,22 +3,310 @@ from tdw.controller import Controller
 from tdw.tdw_utils import TDWUtils
 from tdw.add_ons.third_person_camera import ThirdPersonCamera
 from tdw.add_ons.image_capture import ImageCapture
-from tdw.librarian import SceneLibrarian
 import shutil
 import random   
 import os
-from helpers.helpers import images_to_video, message, get_transforms
+from helpers.helpers import images_to_video, message, get_transforms, load_frames, get_frame_paths, get_segmentation_colors
+from helpers.delta import save_delta
+from helpers.roi import export_rois
+from helpers.pipeline import AsyncImageCapture
+from helpers.raw_capture import RawImageCapture
+from helpers.visibility import get_visibility, save_visibility
+from helpers.trajectory import TrajectoryRecorder
+from concurrent.futures import ThreadPoolExecutor
+from helpers.manifest import get_manifest_path, load_manifest, save_manifest, get_rng_state, set_rng_state, remove_partial_trials
+from helpers.metadata import append_info_row, update_info
+from helpers.status import StatusReporter, get_status_dir
+from helpers.coverage import CoverageTracker, get_coverage_path
+from helpers.render_profiles import PROFILES, get_profile_commands
+from helpers.twins import get_object_states, get_restore_commands
+from helpers.occupancy import get_occupancy, get_occupancy_path
+from helpers.asset_cache import use_local_assets
+from helpers.stream import FrameTap, StreamCapture, TrialPublisher
+from helpers.stream_client import decode_image
+from helpers.watchdog import TIMEOUTS, BuildTimeout, Deadline, set_timeout, relaunch_build
+from collections import Counter
+import traceback
+import zmq
+from helpers.helpers import get_librarian
 import time
-from tdw.librarian import ModelLibrarian
-import pandas as pd
+import numpy as np
+from PIL import Image
+from pathlib import Path
+
+# Columns of info.csv, every accepted trial is one row
+INFO_COLUMNS = ('trial_id', 'trial_num', 'path_videos', 'path_frames', 'num', 'trial_type', 'objects_name',
+                'png', 'pass_masks', 'framerate', 'room', 'tot_frames', 'add_object_to_scene', 
+                'save_frames', 'save_mp4', 'transition_or_agent_frames', 'cam_position', 'cam_look_at',
+                'background', 'path_delta', 'segmentation_colors', 'path_roi', 'path_raw', 'path_visibility', 'path_trajectory', 'params', 'render_profile', 'twin')
 
 class Runner(Controller):
+    # Number of frames of latency the per frame decisions of a controller tolerate, see step()
+    frame_latency = 0
+
+    # Deadlines in seconds of a communicate, loading a scene and initializing a trial, see helpers/watchdog.py
+    timeouts = TIMEOUTS
+
+    # Number of failed trials in a row after which run stops, e.g. for a bug that fails every trial
+    max_consecutive_failures = 10
+
     def __init__(self, port=1071):
         # Important to use the models_core, since the index from is based on the helpers.objects
-        lib = ModelLibrarian('models_core.json')
-        self.records = lib.records
+        self.records = get_librarian('models_core.json').records
+
+        # Folder of the temporary frames in path_main, builds that share path_main need their own folder (see async_runtime.py)
+        self.temp_dir = ''
+
+        # Named controller parameters with a fixed value, see get_param(), and the scene that is loaded (see reuse_scene of run())
+        self.params = {}
+        self.loaded_scene = None
+        self.scene_o_ids = []
+        self.trial_stats = {}
+
+        # Pipelined frame driver, see step()
+        self.pipeline = False
+        self.capture = None
+        self.recorder = None
+        self.skip_settle = False
+        self._pending_step = None
+        self._last_resp = None
+        self._step_executor = ThreadPoolExecutor(max_workers=1)
+        self.port = port
+        self.status = None
+
+        # Coverage of the objects, see coverage_cells()
+        self.coverage = None
+        self.steer_coverage = False
+        self.coverage_cell = None
+        self.render_profile = None
+
+        # Counterfactual twins, see branch()
+        self.twins = False
+        self.snapshot = None
+
+        # Free floor of the loaded scene, see sample_free()
+        self.occupancy = None
+
+        # Live stream of the accepted trials, see helpers/stream.py
+        self.stream = None
+        self.stream_only = False
+        self.publisher = None
         super().__init__(port=port) 
+        set_timeout(self.socket, self.timeouts['communicate'])
+
+    def communicate(self, commands):
+        '''Blocking communicate, waits for a pipelined frame that is still running first to keep the order of frames'''
+        self._wait_step()
+        return self._communicate(commands)
+
+    def _communicate(self, commands):
+        start = time.perf_counter()
+        try:
+            self._last_resp = super().communicate(commands)
+        except zmq.Again:
+            raise BuildTimeout(f"the build did not respond within {self.timeouts['communicate']}s")
+        if self.status is not None:
+            self.status.frame(time.perf_counter() - start)
+        return self._last_resp
+
+    def communicate_unrendered(self, commands):
+        '''Communicate a bookkeeping frame without rendering and without images (and not in the trajectory), 
+        e.g. adding or destroying the objects of a trial or letting them settle, the next frame is rendered again'''
+        if self.capture is None:
+            return self.communicate(commands)
+        self._wait_step()
+
+        # The capture requested the images of this frame after the previous frame
+        self.capture.commands[:] = [command for command in self.capture.commands if command['$type'] not in ['send_images', 'enable_image_sensor']]
+        if self.recorder is not None:
+            self.recorder.skip = True
+        try:
+            resp = self.communicate([{"$type": "enable_image_sensor", "enable": False, "avatar_id": "frames_temp"}] + 
+                                    ([commands] if isinstance(commands, dict) else list(commands)))
+        finally:
+            if self.recorder is not None:
+                self.recorder.skip = False
+        self.capture.commands.append({"$type": "enable_image_sensor", "enable": True, "avatar_id": "frames_temp"})
+        return resp
+
+    def step(self, commands):
+        '''Communicate for per frame loops that tolerate one frame of latency (frame_latency >= 1):
+        the commands are sent on a worker thread and the response of the previous frame is returned immediately,
+        so the next commands can be computed while the build renders. 
+        Without pipeline (or frame_latency 0) this is the same as communicate
+        Returns: the response of the previous frame'''
+        if not self.pipeline or self.frame_latency < 1:
+            return self.communicate(commands)
+        resp = self._wait_step()
+        self._pending_step = self._step_executor.submit(self._communicate, commands)
+        return resp
+
+    def _wait_step(self):
+        '''Wait for the pipelined frame that is still running, returns the last response'''
+        if self._pending_step is not None:
+            pending, self._pending_step = self._pending_step, None
+            pending.result()
+        return self._last_resp
+
+    def flush(self):
+        '''Wait until all pipelined frames are done and their images are written'''
+        resp = self._wait_step()
+        if isinstance(self.capture, AsyncImageCapture):
+            self.capture.flush()
+        return resp
+        
+    def coverage_cells(self):
+        '''The (object, partner) cells this controller can create, used for coverage steering and quotas (see helpers/coverage.py),
+        controllers that support coverage override this, partner is None for trials with one object'''
+        return None
+
+    def choose_cell(self, cells):
+        '''Choose the (object, partner) cell of the next trial, the least covered cell with coverage steering, otherwise random'''
+        if self.steer_coverage and self.coverage is not None:
+            return self.coverage.choose(cells)
+        return random.choice(cells)
+
+    def get_param(self, name, sample):
+        '''Value of a named controller parameter, e.g. slope_angle
+        The value is fixed if it is set in self.params (e.g. by a sweep, see helpers/sweep.py), otherwise it is sampled as before
+        param sample: function that samples the value, or the default value'''
+        if name in self.params:
+            return self.params[name]
+        return sample() if callable(sample) else sample
+
+    def create_scene(self, scene_name, framerate, add_object_to_scene, reuse_scene, path_frames, path_background, ext):
+        '''Load the scene (or reuse the loaded scene), add the objects of the scene and save the background
+        Raises BuildTimeout if the scene is not loaded in time'''
+        if reuse_scene and scene_name == self.loaded_scene:
+            # Only remove the camera and the objects of the previous background, they are added again
+            commands = [{"$type": "destroy_avatar", "id": "frames_temp"}]
+            commands.extend([{"$type": "destroy_object", "id": o_id} for o_id in self.scene_o_ids])
+        elif scene_name == 'empty':
+            commands = [TDWUtils.create_empty_room(12, 12)]
+        else:
+            commands = [self.get_add_scene(scene_name=scene_name)]
+        self.loaded_scene = scene_name
+        self.scene_o_ids = []
+
+        # Set target framerate and the render settings
+        commands.append({"$type": "set_target_framerate",
+                        "framerate": framerate})
+        commands.extend(get_profile_commands(self.render_profile))
+        
+        # Add slope to the background, if param add_object_to_scene is true
+        if add_object_to_scene:
+            commands = self.add_object_to_scene(commands)
         
+        # Save scene/background separately, the background is the first frame of the capture
+        self.capture.frame = 0
+        deadline = Deadline(self.timeouts['scene'], f'loading scene {scene_name}')
+
+        # Downloading the scene and the objects can take longer than a communicate, the frames of loading have the scene deadline
+        set_timeout(self.socket, self.timeouts['scene'])
+        try:
+            self.communicate(commands)
+            moved = False
+            while not moved:
+                self.flush()
+                try:
+                    shutil.move(f'{path_frames}/img_0000{ext}', path_background) 
+                    moved = True
+                except FileNotFoundError:
+                    # Scene is still loading
+                    deadline.check()
+                    print(message("Loading scene is taking a long time", 'warning'))
+                    time.sleep(5)
+
+                    #NOTE: this might create unneccesary extra frames
+                    self.communicate([])
+        finally:
+            set_timeout(self.socket, self.timeouts['communicate'])
+
+        # Remove any intial frames that might've been created
+        shutil.rmtree(path_frames)
+        os.makedirs(path_frames)
+
+    def recover(self, scene_name, framerate, add_object_to_scene, path_frames, path_background, ext):
+        '''Relaunch a hung build on the same port and restore the scene, the background is saved again at path_background'''
+        self._pending_step = None
+        relaunch_build(self, self.port, self.timeouts['communicate'])
+        self.create_scene(scene_name, framerate, add_object_to_scene, False, path_frames, path_background, ext)
+
+    def record_failure(self, reason):
+        '''Count the reason of a failed trial, the counts are saved in the manifest'''
+        self.trial_stats['failures'][reason] += 1
+
+    def accept_visibility(self, visibility):
+        '''Acceptance criteria on the per frame visibility of the objects of a trial (see helpers/visibility.py),
+        only used with check_visibility, controllers can override this
+        param visibility: dict with o_ids, fraction (frames, objects) and truncated (frames, objects), in the order of self.o_ids
+        Returns: True if the trial is accepted, or a message why not'''
+        return True
+
+    def branch(self, resp):
+        '''Called by the controllers right before the first transition command is sent, resp is the response of the last frame without it
+        With twins, the state of the trial objects is snapshotted here and the object twin continues from it (see run_twin)'''
+        if self.twins and self.snapshot is None:
+            self.snapshot = {'frames': self.capture.frame - self.trial_first_frame, 'capture_frame': self.capture.frame,
+                             'states': get_object_states(resp, self.o_ids)}
+
+    def run_twin(self, path_capture):
+        '''Create the object twin of the transition trial that just ran: the frames before the transition are copied,
+        the objects are added again with the snapshotted state and the trial continues without the transition, 
+        for as many frames as the transition trial
+        Returns: folder with the frames of the object twin and its segmentation colors, (None, None) if there is no snapshot'''
+        snapshot, self.snapshot = self.snapshot, None
+        if snapshot is None or snapshot['states'] is None:
+            return None, None
+        self.flush()
+        if self.stream is not None:
+            self.stream.start_trial(prefix=snapshot['frames'])
+        # With stream_only the frames of the transition trial are not on disk, only counted
+        num_frames = self.capture.frame - self.trial_first_frame if self.stream_only else len(get_frame_paths(self.path_frames, '_img', self.png))
+        path_twin = f'{path_capture}/twin_temp/frames_temp'
+        shutil.rmtree(path_twin, ignore_errors=True)
+        os.makedirs(path_twin)
+
+        # The frames before the transition are the same for both twins
+        for mask_type in self.pass_masks:
+            for path in get_frame_paths(self.path_frames, mask_type, self.png)[:snapshot['frames']]:
+                shutil.copy(path, path_twin)
+
+        # Continue the frame numbers after the copied frames, in the folder of the twin
+        path_capture_before, self.capture.path = self.capture.path, Path(f'{path_capture}/twin_temp')
+        self.capture.frame = snapshot['capture_frame']
+        if self.stream_only:
+            self.capture.start_trial(write_first=False)
+        try:
+            commands = get_restore_commands(self.trial_commands, snapshot['states'])
+            resp = self.communicate(commands)
+            segmentation_colors = get_segmentation_colors(resp, self.o_ids)
+
+            # The restored frame counts as frame as well
+            for _ in range(num_frames - snapshot['frames'] - 1):
+                self.communicate([])
+            self.communicate_unrendered([{"$type": "destroy_object", "id": o_id} for o_id in self.o_ids] +
+                                        [{"$type": "send_rigidbodies", "frequency": "never"}])
+        finally:
+            self.capture.path = path_capture_before
+            if self.stream_only:
+                self.capture.end_trial()
+        return path_twin, segmentation_colors
+
+    def load_trial_frames(self, mask_type):
+        '''The frames of one pass of the current trial as array (frames, H, W, C), from the raw file, the stream or the image files'''
+        if self.save_raw:
+            return self.capture.writer.get_frames(mask_type)
+        if self.stream_only:
+            return self.decode_stream_frames(self.stream.last, mask_type)
+        return load_frames(self.path_frames, mask_type, self.png)
+
+    def decode_stream_frames(self, frames, mask_type):
+        '''The frames of one pass kept by the FrameTap as array (frames, H, W, C), empty if there are no frames'''
+        if not frames:
+            return np.zeros((0, 0, 0, 3), dtype=np.uint8)
+        return np.stack([decode_image(*frame[mask_type], self.stream.shape) for frame in frames])
+
     def trial_initialization_commands(self):
         '''In this function the objects should be added, 
         and initial forces etc. can be applied. Should return commands'''
@@ -39,21 +327,16 @@ class Runner(Controller):
                             "id": o_id})
         destroy_commands.append({"$type": "send_rigidbodies",
                             "frequency": "never"})
-        self.communicate(destroy_commands)
+        self.communicate_unrendered(destroy_commands)
         return None, True
     
     def get_transforms_by_run(self, o_id, commands):
         '''Extension on get_transforms from helpers.helpers;
-        here frame actually gets created and removed to get output
+        here frame actually gets created, without rendering, to get output
         Returns: commands, (rot, pos, mass)'''
         # Run frame and get transforms
-        resp = self.communicate(commands)
+        resp = self.communicate_unrendered(commands)
         transforms = get_transforms(resp, o_id)
-
-        # Delete frame that was created
-        path_frames = f'{self.path_main}/frames_temp'
-        shutil.rmtree(path_frames)
-        os.makedirs(path_frames, exist_ok=True)
         
         # Update commands, since they're already executed
         commands = []
@@ -65,6 +348,27 @@ class Runner(Controller):
         See containment.py and rolling_down.py for examples'''
         return commands
     
+    def sample_free(self, sample, radius=.3, accept=None, tries=200):
+        '''Sample positions until they are on free floor of the scene (see helpers/occupancy.py), without occupancy grid the first sample is used
+        param sample: function that returns a position (dict with x and z) or a list of positions, e.g. the random positions of a trial
+        param radius: free floor in meters around every position
+        param accept: optional function of the sample with further conditions, e.g. a free path
+        '''
+        positions = sample()
+        if self.occupancy is None:
+            return positions
+        for _ in range(tries):
+            free = all(self.occupancy.is_free(position, radius) for position in (positions if isinstance(positions, list) else [positions]))
+            if free and (accept is None or accept(positions)):
+                return positions
+            positions = sample()
+        print(message(f'No free positions found in {tries} tries in {self.loaded_scene}, objects might intersect the scene', 'warning'))
+        return positions
+
+    def sample_camera(self, sample, look_at, tries=200):
+        '''Sample camera positions until nothing of the scene is between the camera and look_at'''
+        return self.sample_free(sample, radius=0, accept=lambda position: self.occupancy.line_of_sight(position, look_at), tries=tries)
+
     def set_camera(self):
         ''' Here a custom camera can be added. 
         The avatar_id of the camera should be 'frames_temp'
@@ -75,8 +379,58 @@ class Runner(Controller):
                            avatar_id='frames_temp')
         self.add_ons.append(self.camera)
     
+    def save_trial(self, output_video, o_ids, segmentation_colors):
+        '''Save the frames of an accepted trial in self.path_frames as frames, videos, deltas and/or crops
+        param output_video: path of the video without extension, the other outputs are saved in the same folder structure
+        param o_ids: the object ids of this trial
+        param segmentation_colors: dict with o_id:(color, name) of this trial
+        Returns: path_videos_saved, path_frames_saved, path_delta, path_roi, path_raw'''
+        path_frames, png = self.path_frames, self.png
+
+        # Finalize the raw file with all frames of all passes
+        path_raw = None
+        if self.save_raw:
+            path_raw = self.capture.finish_trial(output_video.replace('videos', 'raw', 1) + '.raw')
+
+        # Save crops around every object, with the box tracks
+        path_roi = None
+        if self.save_roi:
+            path_roi = output_video.replace('videos', 'rois', 1) + '_roi.npz'
+            os.makedirs(os.path.dirname(path_roi), exist_ok=True)
+            o_ids = [o_id for o_id in o_ids if o_id in segmentation_colors]
+            export_rois(path_roi, {mask_type: load_frames(path_frames, mask_type, png) for mask_type in self.pass_masks},
+                        colors=[segmentation_colors[o_id][0] for o_id in o_ids],
+                        labels=[f'{k}_{segmentation_colors[o_id][1]}' for k, o_id in enumerate(o_ids)],
+                        size=self.roi_size)
+
+        # Store the _img frames as sparse delta against the background
+        path_delta = None
+        if self.save_delta:
+            path_delta = output_video.replace('videos', 'deltas', 1) + '_img.npz'
+            os.makedirs(os.path.dirname(path_delta), exist_ok=True)
+            save_delta(path_delta, load_frames(path_frames, '_img', png), self.background, self.path_background)
+
+            # The full _img frames are only needed for the mp4
+            if not self.save_mp4:
+                for path in get_frame_paths(path_frames, '_img', png):
+                    os.remove(path)
+
+        # Convert images to videos
+        path_videos_saved, path_frames_saved = images_to_video(path_frames, output_video, self.framerate, self.pass_masks, png, 
+                                                               self.save_frames, self.save_mp4, self.video_format, self.img_codec)
+
+        if self.save_delta and self.save_mp4 and path_frames_saved is not None:
+            for path in get_frame_paths(f'{path_frames_saved}/frames_temp', '_img', png):
+                os.remove(path)
+        return path_videos_saved, path_frames_saved, path_delta, path_roi, path_raw
+
     def run(self, num=5, trial_type='object', png=False, pass_masks=["_img", "_mask"], framerate = 30, room='random', 
-            tot_frames=200, add_object_to_scene=False, save_frames=True, save_mp4=False):
+            tot_frames=200, add_object_to_scene=False, save_frames=True, save_mp4=False, resume=False, save_delta=False,
+            save_roi=False, roi_size=64, open_loop_agent=False, correction_every=0, pipeline=False, save_raw=False,
+            check_visibility=False, save_trajectory=False, params=None, reuse_scene=False, terminate=True, manifest_name=None,
+            timeout=None, coverage=False, quota=None, render_profile=None, video_format='mp4', img_codec='libx264', twins=False,
+            path_main=None, trial_id=None, occupancy=False, assets=None, skip_settle=False,
+            stream=None, stream_mode='push', stream_hwm=8, stream_timeout=60, stream_only=False):
         '''
         param num: the number of trials
         param trial_type: you can choose if you would like to run an trial object, agent or transition based
@@ -89,6 +443,52 @@ class Runner(Controller):
         param add_object_to_scene: add objects to the scene (and background), add slope to the background, for rolling down trials
         param save_frames: if True the frames will (also) be saved
         param save_mp4: if True the frames will (also) be saved as mp4
+        param video_format: with save_mp4, 'mp4' saves one video per pass mask, 'mkv' saves one Matroska file per trial
+                            with all pass masks, the label passes lossless (see images_to_mkv)
+        param img_codec: ffmpeg codec of the _img stream of the mkv
+        param twins: if True, every transition trial gets an object twin that shares the frames before the transition 
+                     and continues from the same object state without it (see helpers/twins.py), only for trial_type transition
+        param path_main: folder of all output, by default data/batch2, e.g. a shard of one node (see helpers/lease_queue.py)
+        param trial_id: id of this set of trials instead of a random id, a resumed set of trials keeps its id
+        param occupancy: if True, objects and cameras are placed on free floor of scenes other than the empty room,
+                         the scene is analyzed once and cached in {path_main}/occupancy (see helpers/occupancy.py)
+        param assets: folder of the local asset cache (see prefetch_assets.py), the cached scenes and models are loaded from there
+                      instead of downloaded, e.g. on nodes without network
+        param skip_settle: if True, the frames in which the objects settle before the trial starts (e.g. containment agent trials
+                           before the agent moves) step the physics without rendering, the videos start after settling
+        param stream: address of a zmq socket (e.g. tcp://127.0.0.1:5600) to which every accepted trial is sent with its frames and 
+                      info.csv row, for training while generating (see helpers/stream_client.py for the client)
+        param stream_mode: 'push' sends every trial to one client and waits for the clients (backpressure),
+                           'pub' sends every trial to every client and drops trials for slow clients
+        param stream_hwm: number of trials that are queued for the clients
+        param stream_timeout: seconds a trial waits for a client when the queue is full, afterwards it is dropped, None waits forever
+        param stream_only: if True, the trials are only streamed, the frames are not written to disk and frames/mp4/delta/roi/raw are not saved
+        param resume: if True, continue the last unfinished set of trials of this controller and trial_type from its manifest
+        param save_delta: if True the _img frames are stored as the tiles that differ from the background image (see helpers/delta.py),
+                          instead of full frames, only useful for controllers with a static camera
+        param save_roi: if True, crops of all passes around every trial object are saved with the box tracks (see helpers/roi.py), needs _id pass
+        param roi_size: size in pixels of the (square) crops
+        param open_loop_agent: if True, agents plan their whole path up front and only stream teleports (see helpers/planner.py),
+                               no output data is requested per frame, for collision, containment and rolling_down
+        param correction_every: if > 0, open-loop agents correct their path every n frames with the observed positions
+        param pipeline: if True, images are written on worker threads, controllers that declare frame_latency decide on the response
+                        of the previous frame while the build renders (see step()), and the next trial is prepared while the current one is saved
+        param save_raw: if True, all frames of all passes of a trial are saved in one memory-mapped file (see helpers/raw_capture.py),
+                        instead of image files, frames/mp4/delta/roi are not saved then
+        param check_visibility: if True, trials are only accepted if accept_visibility() of the controller accepts the visibility of the objects,
+                                the visibility is always saved if '_id' is in pass_masks
+        param save_trajectory: if True, the position, rotation, velocities and sleeping of every object in every frame, 
+                               and the collisions are saved (see helpers/trajectory.py)
+        param params: dict with fixed values of named controller parameters (see get_param()), saved with every trial
+        param reuse_scene: if True and the same scene is still loaded from the previous run, the scene is not loaded again
+        param terminate: if False, the build keeps running after the trials, so run can be called again
+        param manifest_name: separates the manifest of this set of trials from other sets of the same controller and trial_type
+        param timeout: seconds the build can take to respond to a communicate, a hung build is relaunched (see helpers/watchdog.py)
+        param coverage: if True, the objects of every trial are the least covered ones over all runs (see helpers/coverage.py)
+        param quota: if set, the set of trials stops as soon as every object (pair) has quota trials in this room, num is the maximum,
+                     turns on coverage
+        param render_profile: name of the render settings (resolution, quality, post-processing, shadows), see helpers/render_profiles.py,
+                              None keeps the defaults of the build
         '''
         # Check if input Camera params are valid
         if not isinstance(pass_masks, list):
@@ -103,7 +503,35 @@ class Runner(Controller):
             return message(f"include '_mask' to pass_masks for occlusion trials, this is used to select the right trials")
         if len(set(pass_masks)) != len(pass_masks):
             return message('pass_mask cannot contain any double masks', 'error')
+        if save_roi and '_id' not in pass_masks:
+            return message("include '_id' to pass_masks to save the regions of interest", 'error')
+        if check_visibility and '_id' not in pass_masks:
+            return message("include '_id' to pass_masks to check the visibility of the objects", 'error')
         
+        if save_raw and (save_frames or save_mp4 or save_delta or save_roi):
+            print(message('save_raw saves all frames in one file per trial, save_frames, save_mp4, save_delta and save_roi are turned off', 'warning'))
+            save_frames, save_mp4, save_delta, save_roi = False, False, False, False
+        
+        if twins and (trial_type != 'transition' or pipeline or save_raw or save_trajectory):
+            return message('twins are only created for transition trials, without pipeline, save_raw and save_trajectory', 'error')
+        self.twins = twins
+
+        if video_format not in ['mp4', 'mkv']:
+            return message("video_format should be 'mp4' or 'mkv'", 'error')
+
+        if stream_mode not in ['push', 'pub']:
+            return message("stream_mode should be 'push' or 'pub'", 'error')
+        if stream_only and stream is None:
+            return message('stream_only needs the address of a stream', 'error')
+        if stream_only and (save_frames or save_mp4 or save_delta or save_roi or save_raw):
+            print(message('stream_only only streams the frames, save_frames, save_mp4, save_delta, save_roi and save_raw are turned off', 'warning'))
+            save_frames, save_mp4, save_delta, save_roi, save_raw = False, False, False, False, False
+        self.stream_only = stream_only
+
+        if render_profile is not None and render_profile not in PROFILES:
+            return message(f'render_profile should be None or any of {list(PROFILES)}', 'error')
+        self.render_profile = render_profile
+
         if trial_type not in ['transition', 'agent', 'object']:
             return message("trial_type should be set to transition', 'agent' or 'object'", 'error')
         
@@ -114,26 +542,39 @@ class Runner(Controller):
         
         #TODO check input for all params
         self.framerate = framerate
-        
-        # Clear the list of add-ons.
-        self.add_ons.clear()
+        self.open_loop_agent = open_loop_agent
+        self.correction_every = correction_every
+        self.pipeline = pipeline
+        self.skip_settle = skip_settle
+        self.params = dict(params or {})
+        self.trial_stats = {'accepted': 0, 'attempted': 0, 'seconds': 0., 'failures': Counter()}
+        if timeout is not None:
+            self.timeouts = dict(self.timeouts, communicate=timeout)
+            set_timeout(self.socket, timeout)
+        start_time = time.time()
 
-        # Set camera
-        cam_position, cam_look_at = self.set_camera()
+        # Settings needed to save a trial, see save_trial()
+        self.png, self.pass_masks, self.save_frames, self.save_mp4 = png, pass_masks, save_frames, save_mp4
+        self.video_format, self.img_codec = video_format, img_codec
+        self.save_delta, self.save_roi, self.roi_size, self.save_raw = save_delta, save_roi, roi_size, save_raw
+        
         controller_name = self.controller_name
         
         # Determine the base path for data storage
         # depending on if the python script is called from "controllers" directory or not
         current_directory = os.getcwd()
-        if current_directory.endswith("controllers"):
+        if path_main is not None:
+            self.path_main = path_main
+        elif current_directory.endswith("controllers"):
             self.path_main  = '../data/batch2'
         else:
             self.path_main  = 'data/batch2'
 
         path_main = self.path_main
-        paths = [f'{path_main}/{name}/{controller_name}/{trial_type}' for name in ['backgrounds', 'videos']]
-        path_backgr, path_videos = paths
-        path_frames = f'{path_main}/frames_temp'
+        paths = [f'{path_main}/{name}/{controller_name}/{trial_type}' for name in ['backgrounds', 'videos', 'raw']]
+        path_backgr, path_videos, _ = paths
+        path_capture = f'{path_main}/{self.temp_dir}' if self.temp_dir else path_main
+        path_frames = f'{path_capture}/frames_temp'
         self.path_frames = path_frames
         paths.append(path_frames)
 
@@ -148,116 +589,339 @@ class Runner(Controller):
         for path in paths:
             os.makedirs(path, exist_ok=True)
 
-        # Generate random id for this set of trials, and output for user
-        #NOTE: in theory two trials could have the same random id 
-        trial_id = random.randint(10**16, 10**17-1) 
-        print(f'The random id of this set of trials will be {trial_id}')
-        
-        # Save 'normal' output images/frames_temp for video
-        self.add_ons.append(ImageCapture(path=path_main+'/', avatar_ids=['frames_temp'], png=png, pass_masks=pass_masks))
+        # Continue from the manifest if there is an unfinished set of trials
+        path_manifest = get_manifest_path(path_main, controller_name, trial_type, manifest_name)
+        manifest = load_manifest(path_manifest) if resume else None
+        if manifest is not None and manifest['trial_num'] < manifest['num']:
+            trial_id, num = manifest['trial_id'], manifest['num']
+            print(f'Resuming the set of trials with random id {trial_id} at trial {manifest["trial_num"]}/{num}')
+        else:
+            if resume:
+                print(message('No unfinished set of trials to resume, starting a new one', 'warning'))
+            manifest = None
+
+            # Generate random id for this set of trials, and output for user
+            #NOTE: in theory two trials could have the same random id, use trial_id for ids that are unique over nodes
+            if trial_id is None:
+                trial_id = random.randint(10**16, 10**17-1) 
+            print(f'The random id of this set of trials will be {trial_id}')
         
+        # Asset bundles from the local cache, before any scene or object is added
+        if assets is not None:
+            local, missing = use_local_assets(assets)
+            if missing:
+                print(message(f'{local} asset bundles are loaded from {assets}, {missing} asset bundles of the controllers are not cached and are downloaded', 'warning'))
+
         # Create room
-        lib = SceneLibrarian(library="scenes.json")
+        lib = get_librarian("scenes.json")
         scene_names = [record.name for record in lib.records]
         if room == 'empty':
+            scene_name = 'empty'
             commands = [TDWUtils.create_empty_room(12, 12)]
         elif room in scene_names or room == 'random':
-            scene_name = random.choice(scene_names) if room == 'random' else room
+            # A resumed set of trials should be in the same scene, a reused scene is kept
+            if manifest is not None:
+                scene_name = manifest['scene_name']
+            elif reuse_scene and room == 'random' and self.loaded_scene is not None:
+                scene_name = self.loaded_scene
+            else:
+                scene_name = random.choice(scene_names) if room == 'random' else room
             print('The name of the selected scene is:', scene_name)
-            commands = [self.get_add_scene(scene_name=scene_name)]
         else:
             return message(f"param room should be 'empty', 'random' or any of the following names: \n {scene_names}", 'error')
 
-        # Set target framerate
-        commands.append({"$type": "set_target_framerate",
-                        "framerate": framerate})
-        
-        # Add slope to the background, if param add_object_to_scene is true
-        if isinstance(add_object_to_scene, bool):
-            if add_object_to_scene:
-                commands = self.add_object_to_scene(commands)
-            if not add_object_to_scene and self.controller_name == 'rolling_down':
-                return message('Rolling down trials should have slope: set add_object_to_scene to True', 'error')
+        # Clear the list of add-ons.
+        self.add_ons.clear()
 
-        else:
+        # Free floor of the scene to place the objects and the camera, the empty room is free anyway
+        self.occupancy = None
+        if occupancy and scene_name != 'empty':
+            if not os.path.exists(get_occupancy_path(path_main, scene_name)):
+                # Analyzing loads the scene without camera and objects, it is loaded again
+                self.loaded_scene = None
+            self.occupancy = get_occupancy(self, path_main, scene_name)
+
+        # Set camera
+        cam_position, cam_look_at = self.set_camera()
+
+        # Save 'normal' output images/frames_temp for video
+        capture = RawImageCapture if save_raw else StreamCapture if stream_only else AsyncImageCapture if pipeline else ImageCapture
+        self.capture = capture(path=path_capture+'/', avatar_ids=['frames_temp'], png=png, pass_masks=pass_masks)
+        self.add_ons.append(self.capture)
+
+        # The same publisher is kept over runs, since the clients are connected to it
+        settings = (stream, stream_mode, stream_hwm, stream_timeout)
+        if self.publisher is not None and (stream is None or (self.publisher.address, self.publisher.mode, self.publisher.hwm, self.publisher.timeout) != settings):
+            self.publisher.close()
+            self.publisher = None
+        if stream is not None and self.publisher is None:
+            self.publisher = TrialPublisher(stream, stream_mode, stream_hwm, stream_timeout)
+        self.stream = FrameTap() if stream is not None else None
+        if stream is not None:
+            self.add_ons.append(self.stream)
+
+        # Physical ground truth of every frame
+        self.recorder = TrajectoryRecorder(max_frames=tot_frames+8) if save_trajectory else None
+        if save_trajectory:
+            self.add_ons.append(self.recorder)
+        
+        if not isinstance(add_object_to_scene, bool):
             return message('Parameter add_object_to_scene should be of type bool', 'error')
+        if not add_object_to_scene and self.controller_name == 'rolling_down':
+            return message('Rolling down trials should have slope: set add_object_to_scene to True', 'error')
         
         # Save scene/background separately
-        self.communicate(commands)
         ext = '.png' if png else '.jpg'
-        moved = False
-        while not moved:
-            try:
-                shutil.move(f'{path_frames}/img_0000{ext}', f'{path_backgr}/background_{controller_name}{trial_id}{ext}') 
-                moved = True
-            except FileNotFoundError:
-                # Scene is still loading
-                print(message("Loading scene is taking a long time", 'warning'))
-                time.sleep(5)
-
-                #NOTE: this might create unneccesary extra frames
-                self.communicate([])
+        path_background = f'{path_backgr}/background_{controller_name}{trial_id}{ext}'
+        self.path_background = path_background
+        try:
+            self.create_scene(scene_name, framerate, add_object_to_scene, reuse_scene, path_frames, path_background, ext)
+        except BuildTimeout as e:
+            return message(f'{e}, the build is not recovered before the first trial', 'error')
 
-        # Remove any intial frames that might've been created
-        shutil.rmtree(path_frames)
-        os.makedirs(path_frames)
+        if manifest is not None:
+            # Remove everything of trials that were not committed, and continue with the same random state
+            update_info(f'{path_main}/info.csv', INFO_COLUMNS, lambda df: remove_partial_trials(manifest, path_videos, df))
+            trial_num = manifest['trial_num']
+            set_rng_state(manifest['rng_state'])
+        else:
+            trial_num = 0
+            manifest = {'controller_name': controller_name, 'trial_type': trial_type, 'trial_id': trial_id, 'num': num,
+                        'room': room, 'scene_name': scene_name, 'trial_num': 0, 'committed_trials': [], 'rng_state': get_rng_state()}
+            save_manifest(path_manifest, manifest)
 
-        # Load csv, make if it doesn't exist
-        try:
-            df = pd.read_csv(f'{path_main}/info.csv', index_col=False)
-        except FileNotFoundError:
-            df = pd.DataFrame(index=None, columns=('trial_id', 'trial_num', 'path_videos', 'path_frames', 'num', 'trial_type', 'objects_name',
-                                                   'png', 'pass_masks', 'framerate', 'room', 'tot_frames', 'add_object_to_scene', 
-                                                   'save_frames', 'save_mp4', 'transition_or_agent_frames', 'cam_position', 'cam_look_at'))
+        if save_delta:
+            # Frames are compared with the background as it will be decoded
+            self.background = np.asarray(Image.open(path_background).convert('RGB'))
+
+        # Trials per object (pair) over all runs
+        self.steer_coverage = coverage or quota is not None
+        self.coverage = CoverageTracker(get_coverage_path(path_main), controller_name, trial_type, scene_name)
+        if quota is not None and self.coverage_cells() is None:
+            return message(f'{controller_name} does not support coverage quotas', 'error')
+
+        # Live status for dashboard.py
+        self.status = StatusReporter(get_status_dir(path_main), controller_name, trial_type, self.port, num, trial_num, self.trial_stats,
+                                     queue_depth=self.capture.queue_depth if isinstance(self.capture, AsyncImageCapture) else None)
 
         print(f"Video of trial n will be saved at {path_videos}/{trial_type}/{trial_id}_trial_n.mp4")
-        trial_num = 0
+        next_trial_commands = None
+        failures_before, failures_in_row, restarts = Counter(manifest.get('failures', {})), 0, 0
         while trial_num != num:
-            # Initialize trial and return errors if something is wrong
-            trial_commands = self.trial_initialization_commands()
-            if not isinstance(trial_commands, list):
-                return trial_commands
-            
-            #TODO see if this is necessary #NOTE First frame gets removed
-            self.communicate(trial_commands)
+            if quota is not None and not self.coverage.missing(self.coverage_cells(), quota):
+                print(message(f'Every object (pair) has {quota} trials, stopping after {trial_num} trials', 'success'))
+                manifest['num'] = num = trial_num
+                save_manifest(path_manifest, manifest)
+                break
 
-            # Remove previous frames (if possible), this is needed to make sure that frame 0 is really frame 0
             try:
-                shutil.rmtree(path_frames)
-            except FileNotFoundError:
-                pass
-            os.makedirs(path_frames, exist_ok=True)
+                # Initialize trial and return errors if something is wrong
+                deadline = Deadline(self.timeouts['trial_init'], f'initializing trial {trial_num}')
+                # The commands might already be prepared while the previous trial was saved
+                trial_commands = next_trial_commands if next_trial_commands is not None else self.trial_initialization_commands()
+                next_trial_commands = None
+                if not isinstance(trial_commands, list):
+                    self.status.finish('error')
+                    return trial_commands
+            
+                self.trial_stats['attempted'] += 1
+
+                # The segmentation colors are needed to find the objects in the _id pass
+                if '_id' in pass_masks:
+                    trial_commands.append({"$type": "send_segmentation_colors"})
+
+                # The objects are added in a frame that is not rendered
+                self.trial_commands = list(trial_commands)
+                resp = self.communicate_unrendered(trial_commands)
+                deadline.check()
+                self.segmentation_colors = get_segmentation_colors(resp, self.o_ids)
+
+                # Remove the frames of a rejected previous trial (if possible), this is needed to make sure that frame 0 is really frame 0
+                self.flush()
+                try:
+                    shutil.rmtree(path_frames)
+                except FileNotFoundError:
+                    pass
+                os.makedirs(path_frames, exist_ok=True)
+                if save_raw:
+                    self.capture.start_trial(f"{path_videos.replace('videos', 'raw', 1)}/{trial_id}_trial_{trial_num}.raw.partial", 
+                                             max_frames=tot_frames+8)
+                if save_trajectory:
+                    self.recorder.start_trial(self.o_ids)
+                if stream is not None:
+                    self.stream.start_trial()
+                if stream_only:
+                    self.capture.start_trial()
+                self.snapshot, self.trial_first_frame = None, self.capture.frame
+
+                try:
+                    transition_start_frames, success = self.run_per_frame_commands(trial_type=trial_type, tot_frames=tot_frames)
+                    self.flush()
+                finally:
+                    # The background of a recovered build is written again
+                    if stream_only:
+                        self.capture.end_trial()
+                stream_frames = self.stream.take() if stream is not None else None
 
-            transition_start_frames, success = self.run_per_frame_commands(trial_type=trial_type, tot_frames=tot_frames)
+                # Visible fraction of every object in every frame, from the _id pass
+                visibility = None
+                if success and '_id' in pass_masks:
+                    visibility = get_visibility(self.load_trial_frames('_id'), 
+                                                [self.segmentation_colors[o_id][0] if o_id in self.segmentation_colors else None for o_id in self.o_ids],
+                                                self.o_ids)
+                    accepted = self.accept_visibility(visibility) if check_visibility else True
+                    if accepted is not True:
+                        print(message(f'Trial {trial_num} is not accepted: {accepted}', 'warning'))
+                        self.record_failure('visibility')
+                        success = False
+
+                # The object twin of the transition trial, both are rejected if the transition never started
+                path_twin = None
+                if success and twins:
+                    path_twin, twin_colors = self.run_twin(path_capture)
+                    twin_frames = self.stream.take() if stream is not None else None
+                    if path_twin is None:
+                        print(message(f'Trial {trial_num} is not accepted: no transition to branch the object twin from', 'warning'))
+                        self.record_failure('twin')
+                        success = False
             
+            except Exception as e:
+                # A hung build or a bug in a frame loop should not stall the whole set of trials
+                success, transition_start_frames = False, None
+                print(message(f'Trial {trial_num} failed with {type(e).__name__}: {e}', 'error'))
+                hung = isinstance(e, BuildTimeout)
+                if hung:
+                    self.record_failure('timeout')
+                else:
+                    self.record_failure(type(e).__name__)
+                    traceback.print_exc()
+
+                    # Reset the scene by destroying the objects of the failed trial, the build can hang here as well
+                    try:
+                        self.communicate_unrendered([{"$type": "destroy_object", "id": o_id} for o_id in getattr(self, 'o_ids', [])] +
+                                                    [{"$type": "send_transforms", "frequency": "never"},
+                                                     {"$type": "send_rigidbodies", "frequency": "never"}])
+                    except BuildTimeout as reset_error:
+                        print(message(f'Resetting the scene after trial {trial_num} failed: {reset_error}', 'error'))
+                        hung = True
+                if hung:
+                    restarts += 1
+                    self.path_background = f'{path_backgr}/background_{controller_name}{trial_id}_{restarts}{ext}'
+                    try:
+                        self.recover(scene_name, framerate, add_object_to_scene, path_frames, self.path_background, ext)
+                    except BuildTimeout as e:
+                        self.status.finish('error')
+                        return message(f'The build on port {self.port} could not be recovered: {e}', 'error')
+                    if save_delta:
+                        self.background = np.asarray(Image.open(self.path_background).convert('RGB'))
+            else:
+                if not success and visibility is None:
+                    self.record_failure('rejected')
+
             # If creation of frames was succesfull and (possible) tests were passed
             if success:
                 # Specify the output video file name
                 output_video = f"{path_videos}/{trial_id}_trial_{trial_num}"
+                names, segmentation_colors, rng_state, coverage_cell = self.names, self.segmentation_colors, get_rng_state(), self.coverage_cell
 
-                # Convert images to videos
-                path_videos_saved, path_frames_saved = images_to_video(path_frames, output_video, framerate, pass_masks, png, save_frames, save_mp4)
+                path_visibility = None
+                if visibility is not None:
+                    path_visibility = output_video.replace('videos', 'visibility', 1) + '_visibility.npz'
+                    os.makedirs(os.path.dirname(path_visibility), exist_ok=True)
+                    save_visibility(path_visibility, visibility)
+
+                path_trajectory = None
+                if save_trajectory:
+                    path_trajectory = output_video.replace('videos', 'trajectories', 1) + '_trajectory.npz'
+                    os.makedirs(os.path.dirname(path_trajectory), exist_ok=True)
+                    self.recorder.finish_trial(path_trajectory)
+
+                if pipeline:
+                    # Save the trial on a worker thread, and prepare the next trial meanwhile
+                    saving = self._step_executor.submit(self.save_trial, output_video, self.o_ids, segmentation_colors)
+                    if trial_num + 1 != num:
+                        next_trial_commands = self.trial_initialization_commands()
+                    path_videos_saved, path_frames_saved, path_delta, path_roi, path_raw = saving.result()
+                else:
+                    path_videos_saved, path_frames_saved, path_delta, path_roi, path_raw = self.save_trial(output_video, self.o_ids, segmentation_colors)
 
                 # Save progress in csv file #NOTE: not tested very well
-                params = (trial_id, trial_num, path_videos_saved, path_frames_saved, num, trial_type, self.names, png, pass_masks, framerate, room, 
-                tot_frames, add_object_to_scene, save_frames, save_mp4, transition_start_frames, cam_position, cam_look_at)
-                try:
-                    df = df.drop(columns='Unnamed: 0')
-                except KeyError:
-                    pass
-                df.loc[len(df)] = params
-                df.to_csv(f'{path_main}/info.csv')
+                params = (trial_id, trial_num, path_videos_saved, path_frames_saved, num, trial_type, names, png, pass_masks, framerate, room, 
+                tot_frames, add_object_to_scene, save_frames, save_mp4, transition_start_frames, cam_position, cam_look_at,
+                self.path_background, path_delta, segmentation_colors, path_roi, path_raw, path_visibility, path_trajectory, self.params, render_profile)
+                twin = f'{trial_id}_trial_{trial_num}' if path_twin is not None else None
+                append_info_row(f'{path_main}/info.csv', INFO_COLUMNS, params + (twin,))
+                stream_rows = [(dict(zip(INFO_COLUMNS, params + (twin,))), stream_frames)]
+
+                if path_twin is not None:
+                    # Saved next to the transition trial, so a resume removes both
+                    self.path_frames = path_twin
+                    try:
+                        twin_paths = self.save_trial(f'{output_video}_object', self.o_ids, twin_colors)
+                    finally:
+                        self.path_frames = path_frames
+                    path_twin_visibility = None
+                    if visibility is not None:
+                        # With stream_only the frames of the twin are not on disk, only in the FrameTap
+                        twin_id_frames = self.decode_stream_frames(twin_frames, '_id') if stream_only else load_frames(path_twin, '_id', png)
+                        if len(twin_id_frames):
+                            path_twin_visibility = f'{path_visibility[:-len("_visibility.npz")]}_object_visibility.npz'
+                            save_visibility(path_twin_visibility, get_visibility(twin_id_frames, 
+                                            [twin_colors[o_id][0] if o_id in twin_colors else None for o_id in self.o_ids], self.o_ids))
+                    row = dict(zip(INFO_COLUMNS, params + (twin,)))
+                    row.update(path_videos=twin_paths[0], path_frames=twin_paths[1], trial_type='object', transition_or_agent_frames=-1,
+                               path_delta=twin_paths[2], segmentation_colors=twin_colors, path_roi=twin_paths[3], 
+                               path_visibility=path_twin_visibility)
+                    append_info_row(f'{path_main}/info.csv', INFO_COLUMNS, tuple(row[column] for column in INFO_COLUMNS))
+                    stream_rows.append((row, twin_frames))
+
+                if coverage_cell is not None:
+                    self.coverage.add(coverage_cell)
+
+                # Commit the trial in the manifest, only committed trials survive a resume
+                manifest['trial_num'] = trial_num + 1
+                manifest['committed_trials'].append(trial_num)
+                manifest['rng_state'] = rng_state
+                manifest['failures'] = dict(failures_before + self.trial_stats['failures'])
+                save_manifest(path_manifest, manifest)
+
+                # Send the committed trial (and its twin) to the clients of the stream
+                if stream is not None:
+                    for row, frames in stream_rows:
+                        self.publisher.publish(row, frames, self.stream.shape)
 
                 # Show progress
                 print(message(f'Progress trials ({trial_num+1}/{num})', 'success', round((trial_num+1)/num*10)))
                 trial_num += 1
+                self.trial_stats['accepted'] += 1
+                self.status.commit(trial_num)
+                failures_in_row = 0
             else:
+                if save_raw:
+                    self.capture.discard_trial()
+                if save_trajectory:
+                    self.recorder.discard_trial()
+                manifest['failures'] = dict(failures_before + self.trial_stats['failures'])
+                save_manifest(path_manifest, manifest)
+                failures_in_row += 1
+                if failures_in_row == self.max_consecutive_failures:
+                    self.status.finish('error')
+                    return message(f'{failures_in_row} trials in a row failed, stopping: {dict(self.trial_stats["failures"])}', 'error')
                 print(message(f'Trial {trial_num} failed, but no need to panick: retrying...', 'error'))
             
-        self.communicate({"$type": "terminate"})
+        if terminate:
+            self.communicate({"$type": "terminate"})
+            self.loaded_scene = None
+            if self.publisher is not None:
+                self.publisher.close()
+                self.publisher = None
 
         # Remove temp files
+        self.flush()
         shutil.rmtree(path_frames)
+        shutil.rmtree(f'{path_capture}/twin_temp', ignore_errors=True)
+        self.trial_stats['seconds'] = time.time() - start_time
+        self.status.finish()
         
         # Let the user know where the trial videos are stored
         print(f'The random id of this set of trials was {trial_id}')
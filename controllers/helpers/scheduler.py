@@ -0,0 +1,150 @@
+'''
+Quota scheduler over controllers and trial types, so a balanced dataset finishes at about the same time for every combination
+A schedule spec (json) has a target number of trials per (controller, trial_type), optionally with a priority and a deadline:
+{"name": "balanced", "chunk": 5,
+ "targets": [{"controller": "occlusion", "trial_type": "object", "num": 100},
+             {"controller": "containment", "trial_type": "agent", "num": 100, "priority": 2, "deadline": "2026-11-01 08:00"}]}
+The work is handed out in chunks of at most chunk trials, every chunk is a set of trials with its own manifest.
+The seconds per accepted trial of every target are measured online (rejected trials and loading the scene included),
+an idle build takes a chunk of the target with the most remaining work per build working on it, weighted by the priority.
+Targets that would miss their deadline at that rate go first.
+The state is saved in {path_main}/schedules/{name}.json, unfinished chunks are resumed when the schedule is started again.
+'''
+from datetime import datetime
+import time
+import numpy as np
+import pandas as pd
+
+from .manifest import load_manifest, save_manifest
+
+# A target stops after this many chunks that did not finish, e.g. for a controller that fails every trial
+MAX_FAILED_CHUNKS = 3
+
+
+def get_schedule_path(path_main, name):
+    return f'{path_main}/schedules/{name}.json'
+
+
+def load_schedule(path, spec):
+    '''Returns the saved state of the schedule, or a new state without chunks'''
+    state = load_manifest(path)
+    if state is not None and state['spec'] == spec:
+        return state
+    return {'spec': spec, 'targets': [{'chunks': [], 'accepted': 0, 'attempted': 0, 'seconds': 0.} for _ in spec['targets']]}
+
+
+def save_schedule(path, state):
+    '''Write the state atomically, like the manifests'''
+    save_manifest(path, state)
+
+
+def get_chunk_name(spec, index, chunk):
+    '''Name of the manifest of a chunk'''
+    return f"{spec['name']}_target{index:02d}_chunk{chunk:03d}"
+
+
+def parse_deadline(deadline):
+    '''Deadline as unix time, from an ISO date (e.g. "2026-11-01 08:00") or a number, None without deadline'''
+    if deadline is None or isinstance(deadline, (int, float)):
+        return deadline
+    return datetime.fromisoformat(deadline).timestamp()
+
+
+class Scheduler:
+    def __init__(self, path, spec):
+        self.path, self.spec = path, spec
+        self.state = load_schedule(path, spec)
+        self.targets = spec['targets']
+        self.workers = [0] * len(self.targets)
+
+        # Trials that are being created per target, and per chunk
+        self.claimed = [0] * len(self.targets)
+        self.claims = {}
+
+        # Chunks that were running when the schedule stopped are resumed first
+        self.orphans = [[chunk for chunk in progress['chunks'] if chunk['status'] == 'running'] for progress in self.state['targets']]
+
+    def committed(self, index):
+        return sum(chunk['committed'] for chunk in self.state['targets'][index]['chunks'])
+
+    def left(self, index):
+        '''Trials of a target that are not committed and not being created'''
+        target = self.targets[index]
+        if self.failed(index):
+            return 0
+        return target['num'] - self.committed(index) - self.claimed[index]
+
+    def failed(self, index):
+        return sum(chunk['status'] == 'failed' for chunk in self.state['targets'][index]['chunks']) >= MAX_FAILED_CHUNKS
+
+    def seconds_per_trial(self, index):
+        '''Measured seconds per accepted trial, targets without measurements get the mean of the others'''
+        measured = [progress['seconds'] / max(progress['accepted'], 1) for progress in self.state['targets'] if progress['attempted']]
+        progress = self.state['targets'][index]
+        if progress['attempted']:
+            return progress['seconds'] / max(progress['accepted'], 1)
+        return float(np.mean(measured)) if measured else 1.
+
+    def get_score(self, index, now):
+        '''Priority of a target for an idle build, None if nothing is left'''
+        left = self.left(index)
+        if left <= 0:
+            return None
+        target = self.targets[index]
+        remaining = left * self.seconds_per_trial(index) / (self.workers[index] + 1)
+        deadline = parse_deadline(target.get('deadline'))
+        late = deadline is not None and now + remaining > deadline
+        return late, remaining * target.get('priority', 1)
+
+    def next_chunk(self):
+        '''Claim the next chunk for an idle build
+        Returns: index of the target, the chunk and if the chunk should be resumed, None if there is no work left to claim'''
+        now = time.time()
+        scores = [(self.get_score(index, now), index) for index in range(len(self.targets))]
+        scores = [(score, index) for score, index in scores if score is not None]
+        if not scores:
+            return None
+        index = max(scores)[1]
+        self.workers[index] += 1
+        if self.orphans[index]:
+            chunk, resume = self.orphans[index].pop(0), True
+        else:
+            progress = self.state['targets'][index]
+            chunk, resume = {'name': get_chunk_name(self.spec, index, len(progress['chunks'])), 'status': 'running', 'committed': 0,
+                             'size': min(self.spec.get('chunk', 5), self.left(index))}, False
+            progress['chunks'].append(chunk)
+            save_schedule(self.path, self.state)
+        self.claims[chunk['name']] = chunk['size'] - chunk['committed']
+        self.claimed[index] += self.claims[chunk['name']]
+        return index, chunk, resume
+
+    def finish_chunk(self, index, chunk, stats, committed):
+        '''Count the trials of a chunk, stats is the trial_stats of the controller, committed the trial_num of the chunk manifest'''
+        progress = self.state['targets'][index]
+        for key in ['accepted', 'attempted', 'seconds']:
+            progress[key] += stats.get(key, 0)
+        chunk['committed'] = committed
+        chunk['status'] = 'done' if committed >= chunk['size'] else 'failed'
+        self.workers[index] -= 1
+        self.claimed[index] -= self.claims.pop(chunk['name'])
+        save_schedule(self.path, self.state)
+
+    def busy(self):
+        '''True while a build still works on a chunk, its trials might have to be handed out again'''
+        return any(self.workers)
+
+
+def summarize(scheduler, path=None):
+    '''Progress and timing per target, saved as csv if path is given'''
+    rows = []
+    for index, target in enumerate(scheduler.targets):
+        progress = scheduler.state['targets'][index]
+        rows.append({'controller': target['controller'], 'trial_type': target['trial_type'], 'num': target['num'],
+                     'committed': scheduler.committed(index), 'priority': target.get('priority', 1), 'deadline': target.get('deadline'),
+                     'stopped': scheduler.failed(index), 'chunks': len(progress['chunks']),
+                     'acceptance_rate': progress['accepted'] / progress['attempted'] if progress['attempted'] else np.nan,
+                     'seconds_per_accepted': progress['seconds'] / progress['accepted'] if progress['accepted'] else np.nan})
+    df = pd.DataFrame(rows)
+    if path is not None:
+        df.to_csv(path, index=False)
+    return df
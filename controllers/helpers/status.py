@@ -0,0 +1,102 @@
+'''
+Live status of running controllers, read by dashboard.py
+Every Runner writes a small json status file to {path_main}/status/ at most every interval seconds:
+accepted/attempted trials, failure reasons, frames/sec, communicate latency percentiles, queue depth of the image writers,
+disk write rate and the ETA to the target number of trials.
+Status files of workers that stopped updating are shown as stale by the dashboard.
+'''
+from collections import deque
+import json
+import os
+import time
+import numpy as np
+import psutil
+
+# A worker without an update for this many seconds is stale (slow or stuck)
+STALE_SECONDS = 60
+
+
+def get_status_dir(path_main):
+    return f'{path_main}/status'
+
+
+def write_status(path, status):
+    '''Write the status atomically, the dashboard never reads a half written file'''
+    with open(path + '.tmp', 'w') as f:
+        json.dump(status, f)
+    os.replace(path + '.tmp', path)
+
+
+def load_statuses(status_dir):
+    '''Returns the statuses of all workers, with 'stale' set for workers without a recent update'''
+    statuses = []
+    for fn in sorted(os.listdir(status_dir)) if os.path.isdir(status_dir) else []:
+        if not fn.endswith('.json'):
+            continue
+        try:
+            with open(f'{status_dir}/{fn}') as f:
+                status = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue
+        status['stale'] = status['state'] == 'running' and time.time() - status['updated'] > STALE_SECONDS
+        statuses.append(status)
+    return statuses
+
+
+class StatusReporter:
+    def __init__(self, status_dir, controller_name, trial_type, port, num, trial_num, stats, queue_depth=None, interval=2.):
+        '''
+        param stats: the trial_stats dict of the Runner, it is read when the status is written
+        param trial_num: the number of trials that are already committed (e.g. when resuming)
+        param queue_depth: function that returns the number of images that still have to be written
+        param interval: seconds between two writes of the status file
+        '''
+        os.makedirs(status_dir, exist_ok=True)
+        self.path = f'{status_dir}/{controller_name}_{trial_type}_{port}.json'
+        self.status = {'controller_name': controller_name, 'trial_type': trial_type, 'port': port, 'pid': os.getpid(),
+                       'num': num, 'committed': trial_num, 'state': 'running', 'started': time.time()}
+        self.stats, self.queue_depth, self.interval = stats, queue_depth, interval
+        self.latencies = deque(maxlen=1000)
+        self.frames, self.last_frames = 0, 0
+        self.last_write, self.last_bytes = time.time(), self._written_bytes()
+        self.write()
+
+    @staticmethod
+    def _written_bytes():
+        '''Bytes written to disk by this process, None if the platform does not count them'''
+        try:
+            return psutil.Process().io_counters().write_bytes
+        except (AttributeError, psutil.Error):
+            return None
+
+    def frame(self, latency):
+        '''Count one communicate that took latency seconds'''
+        self.frames += 1
+        self.latencies.append(latency)
+        if time.time() - self.last_write > self.interval:
+            self.write()
+
+    def commit(self, trial_num):
+        '''A trial is committed, trial_num trials are done'''
+        self.status['committed'] = trial_num
+        self.write()
+
+    def write(self, state=None):
+        now = time.time()
+        elapsed, interval = now - self.status['started'], max(now - self.last_write, 1e-6)
+        written = self._written_bytes()
+        accepted, attempted = self.stats.get('accepted', 0), self.stats.get('attempted', 0)
+        remaining = self.status['num'] - self.status['committed']
+        self.status.update({
+            'state': state or self.status['state'], 'updated': now,
+            'accepted': accepted, 'attempted': attempted, 'failures': dict(self.stats.get('failures', {})),
+            'frames': self.frames, 'fps': (self.frames - self.last_frames) / interval,
+            'latency_ms': {f'p{q}': float(np.percentile(self.latencies, q) * 1000) if self.latencies else None for q in [50, 90, 99]},
+            'queue_depth': self.queue_depth() if self.queue_depth is not None else 0,
+            'write_mb_s': (written - self.last_bytes) / interval / 2**20 if written is not None and self.last_bytes is not None else None,
+            'eta_seconds': remaining / (accepted / elapsed) if accepted else None})
+        self.last_write, self.last_frames, self.last_bytes = now, self.frames, written
+        write_status(self.path, self.status)
+
+    def finish(self, state='done'):
+        self.write(state)
@@ -0,0 +1,125 @@
+'''
+Live stream of the accepted trials of Runner over a local zmq socket, to train on trials while they are generated
+FrameTap is an add-on that keeps the encoded images of the frames of a trial in memory (the same frames as the saved frames),
+TrialPublisher sends every accepted trial with its info.csv row as one message (see helpers/stream_client.py for the framing and the client).
+With stream_only, StreamCapture replaces the ImageCapture of Runner, so the frames of a trial are only streamed and not written to disk.
+The high-water mark is the number of trials that are queued for the clients:
+- push: every trial goes to one client, generating waits while the queue is full (backpressure), 
+  after the send timeout the trial is dropped, e.g. when no client is connected
+- pub: every client gets every trial, trials are dropped for clients that are too slow
+'''
+import zmq
+from tdw.add_ons.add_on import AddOn
+from tdw.add_ons.image_capture import ImageCapture
+from tdw.output_data import OutputData, Images
+from tdw.tdw_utils import TDWUtils
+
+from .helpers import message
+from .stream_client import pack_trial
+
+# Milliseconds a closed publisher keeps trying to send the queued trials
+LINGER = 10000
+
+
+class FrameTap(AddOn):
+    def __init__(self, avatar_id='frames_temp'):
+        super().__init__()
+        self.avatar_id = avatar_id
+        self.frames, self.last = None, []
+        self.shape = None
+
+    def get_initialization_commands(self):
+        return []
+
+    def start_trial(self, prefix=0):
+        '''Keep the images of the next frames, starting with the first prefix frames of the last trial (e.g. for an object twin)'''
+        self.frames = list(self.last[:prefix])
+
+    def take(self):
+        '''Stop keeping images, returns the frames of the trial'''
+        self.last, self.frames = self.frames or [], None
+        return self.last
+
+    def on_send(self, resp):
+        if self.frames is None:
+            return
+        for i in range(len(resp) - 1):
+            if OutputData.get_data_type_id(resp[i]) == "imag":
+                images = Images(resp[i])
+                if images.get_avatar_id() != self.avatar_id:
+                    continue
+                frame = {}
+                for j in range(images.get_num_passes()):
+                    mask_type = images.get_pass_mask(j)
+                    # The depth passes are no png files, see TDWUtils.save_images
+                    if mask_type in ["_depth", "_depth_simple"]:
+                        frame[mask_type] = ('raw', TDWUtils.get_shaped_depth_pass(images=images, index=j).tobytes())
+                    else:
+                        frame[mask_type] = (images.get_extension(j), images.get_image(j).tobytes())
+                self.frames.append(frame)
+                self.shape = (images.get_height(), images.get_width())
+
+
+class StreamCapture(ImageCapture):
+    '''ImageCapture that only counts the frames of a trial, their images are kept by the FrameTap and not written (stream_only of Runner)
+    Outside a trial (e.g. the background) and for the first frame of a trial, image files are still written,
+    since those are used to check the trial (e.g. occlusion) and as background'''
+    def __init__(self, path, avatar_ids=None, png=False, pass_masks=None):
+        super().__init__(path=path, avatar_ids=avatar_ids, png=png, pass_masks=pass_masks)
+        self.first_unwritten = None
+
+    def start_trial(self, write_first=True):
+        '''Stop writing image files after the first frame of the trial (or right away)'''
+        self.first_unwritten = self.frame + 1 if write_first else self.frame
+
+    def end_trial(self):
+        self.first_unwritten = None
+
+    def on_send(self, resp):
+        if self.first_unwritten is None or self.frame < self.first_unwritten:
+            super().on_send(resp)
+            return
+
+        self.images.clear()
+        for i in range(len(resp) - 1):
+            if OutputData.get_data_type_id(resp[i]) == "imag":
+                images = Images(resp[i])
+                self.images[images.get_avatar_id()] = images
+        if any(self._save and (len(self.avatar_ids) == 0 or a in self.avatar_ids) for a in self.images):
+            self.frame += 1
+        if self._frequency == "always":
+            self.commands.append({"$type": "send_images",
+                                  "frequency": "once",
+                                  "ids": self.avatar_ids})
+
+
+class TrialPublisher:
+    def __init__(self, address, mode='push', hwm=8, timeout=60):
+        '''
+        param address: e.g. tcp://127.0.0.1:5600 or ipc:///tmp/tdw_trials
+        param mode: 'push' or 'pub'
+        param hwm: number of trials that are queued for the clients
+        param timeout: seconds a trial waits for room in the queue before it is dropped, None waits forever
+        '''
+        self.address, self.mode, self.hwm, self.timeout = address, mode, hwm, timeout
+        self.socket = zmq.Context.instance().socket(zmq.PUSH if mode == 'push' else zmq.PUB)
+        self.socket.setsockopt(zmq.SNDHWM, hwm)
+        self.socket.setsockopt(zmq.SNDTIMEO, -1 if timeout is None else int(timeout * 1000))
+        self.socket.setsockopt(zmq.LINGER, LINGER)
+        self.socket.bind(address)
+        self.sent, self.dropped = 0, 0
+
+    def publish(self, row, frames, shape):
+        '''Send one trial, with push this blocks while the clients are hwm trials behind, at most timeout seconds
+        Returns: True if the trial is sent, False if it is dropped'''
+        try:
+            self.socket.send(pack_trial(row, frames, shape), copy=False)
+        except zmq.Again:
+            self.dropped += 1
+            print(message(f'No stream client took a trial within {self.timeout}s, {self.dropped} trials dropped', 'warning'))
+            return False
+        self.sent += 1
+        return True
+
+    def close(self):
+        self.socket.close()
@@ -0,0 +1,103 @@
+'''
+Client of the live trial stream of Runner (run with stream=address, see helpers/stream.py), to train on trials while they are generated
+Every accepted trial is one zmq message with all frames of all passes and the info.csv row of the trial:
+- 4 bytes magic, 4 bytes length of the header (little endian)
+- the header as json: the row, the passes, their encoding (png, jpg or raw rgb), the resolution and the size of every image
+- the encoded images, frame by frame, in the order of the passes
+This module only needs zmq, numpy and PIL, so a training process does not need tdw.
+
+Example:
+for row, frames in TrialSubscriber('tcp://127.0.0.1:5600'):
+    frames['_img']  # (frames, H, W, 3) uint8
+'''
+import io
+import json
+import struct
+import numpy as np
+import zmq
+from PIL import Image
+
+MAGIC = b'TDWT'
+STREAM_VERSION = 1
+
+
+def pack_trial(row, frames, shape):
+    '''One message of a trial
+    param row: dict with the info.csv row of the trial
+    param frames: list with a dict per frame with pass mask:(encoding, bytes), encoding is png, jpg or raw (H, W, 3) uint8
+    param shape: (H, W) of the frames
+    '''
+    passes = list(frames[0]) if frames else []
+    header = {'version': STREAM_VERSION, 'row': row, 'passes': passes, 'shape': shape,
+              'encodings': {mask_type: frames[0][mask_type][0] for mask_type in passes},
+              'sizes': [[len(frame[mask_type][1]) for mask_type in passes] for frame in frames]}
+    header = json.dumps(header, default=str).encode()
+    return b''.join([MAGIC, struct.pack('<I', len(header)), header] + [frame[mask_type][1] for frame in frames for mask_type in passes])
+
+
+def get_stream_address(address, offset):
+    '''Address of one of several streams, e.g. of the jobs of async_runner.py: the port + offset for tcp, with the suffix _offset otherwise'''
+    if address.startswith('tcp://'):
+        host, port = address.rsplit(':', 1)
+        return f'{host}:{int(port) + offset}'
+    return f'{address}_{offset}'
+
+
+def decode_image(data, encoding, shape):
+    if encoding == 'raw':
+        return np.frombuffer(data, np.uint8).reshape(shape[0], shape[1], -1)
+    image = np.asarray(Image.open(io.BytesIO(data)))
+    return image.reshape(image.shape[:2] + (-1,))
+
+
+def unpack_trial(message, decode=True):
+    '''Returns: the row of the trial and a dict with pass mask:frames (frames, H, W, C),
+    with decode=False a dict with pass mask:list of the encoded images'''
+    message = memoryview(message)
+    if bytes(message[:4]) != MAGIC:
+        raise ValueError('not a message of the trial stream')
+    length = struct.unpack('<I', message[4:8])[0]
+    header = json.loads(bytes(message[8:8+length]))
+    if header['version'] != STREAM_VERSION:
+        raise ValueError(f"stream version {header['version']} is not supported, only {STREAM_VERSION}")
+
+    images, offset = {mask_type: [] for mask_type in header['passes']}, 8 + length
+    for sizes in header['sizes']:
+        for mask_type, size in zip(header['passes'], sizes):
+            images[mask_type].append(message[offset:offset+size])
+            offset += size
+    if not decode:
+        return header['row'], {mask_type: [bytes(data) for data in datas] for mask_type, datas in images.items()}
+    return header['row'], {mask_type: np.stack([decode_image(data, header['encodings'][mask_type], header['shape']) for data in datas])
+                           for mask_type, datas in images.items() if datas}
+
+
+class TrialSubscriber:
+    def __init__(self, address, mode='push', hwm=8, decode=True):
+        '''
+        param address: address of the stream of the Runner, e.g. tcp://127.0.0.1:5600 or ipc:///tmp/tdw_trials,
+                       or a list of addresses to receive the trials of several Runners (see get_stream_address)
+        param mode: the stream_mode of the Runner, 'push' (every trial goes to one of the clients) or 'pub' (every client gets every trial)
+        param hwm: number of trials that are queued for this client
+        '''
+        self.context = zmq.Context.instance()
+        self.socket = self.context.socket(zmq.PULL if mode == 'push' else zmq.SUB)
+        self.socket.setsockopt(zmq.RCVHWM, hwm)
+        if mode == 'pub':
+            self.socket.setsockopt(zmq.SUBSCRIBE, b'')
+        for address in [address] if isinstance(address, str) else address:
+            self.socket.connect(address)
+        self.decode = decode
+
+    def receive(self, timeout=None):
+        '''The next trial as (row, frames), None if there is no trial within timeout seconds'''
+        if timeout is not None and not self.socket.poll(int(timeout * 1000)):
+            return None
+        return unpack_trial(self.socket.recv(copy=False).buffer, self.decode)
+
+    def __iter__(self):
+        while True:
+            yield self.receive()
+
+    def close(self):
+        self.socket.close(linger=0)
@@ -0,0 +1,82 @@
+'''
+Parameter sweeps over named controller parameters, for controlled ablations (see Runner.get_param)
+A sweep spec (json) defines the space of the parameters, as a grid or as a Latin hypercube:
+{"name": "slope_angle", "controller": "rolling_down", "trial_type": "object", "num": 10,
+ "method": "grid", "params": {"slope_angle": [216, 223, 230, 237, 244]}}
+{"name": "force", "controller": "collision", "trial_type": "transition", "num": 10,
+ "method": "lhs", "samples": 20, "seed": 0, "params": {"collision_force": [20, 40], "magnitude_randomness": [0, 10]}}
+For grid the params are lists of values, for lhs the params are [low, high] ranges.
+Every point is a set of num trials with its own manifest, the state of the sweep is saved in {path_main}/sweeps/{name}.json,
+so finished points are skipped and unfinished points are resumed when the sweep is started again.
+'''
+import itertools
+import numpy as np
+import pandas as pd
+
+from .manifest import load_manifest, save_manifest
+
+
+def grid_points(params):
+    '''Every combination of the values of params, a dict with name:list of values'''
+    names = list(params)
+    return [dict(zip(names, values)) for values in itertools.product(*[params[name] for name in names])]
+
+
+def lhs_points(params, samples, seed=None):
+    '''Latin hypercube of samples points, params is a dict with name:[low, high]
+    Every range is split in samples strata, every stratum of every parameter is used exactly once'''
+    rng = np.random.default_rng(seed)
+    points = [{} for _ in range(samples)]
+    for name, (low, high) in params.items():
+        strata = (rng.permutation(samples) + rng.random(samples)) / samples
+        for point, value in zip(points, low + strata * (high - low)):
+            point[name] = float(value)
+    return points
+
+
+def get_points(spec):
+    '''The parameter vectors of a sweep spec'''
+    if spec.get('method', 'grid') == 'grid':
+        return grid_points(spec['params'])
+    elif spec['method'] == 'lhs':
+        return lhs_points(spec['params'], spec['samples'], spec.get('seed'))
+    raise ValueError(f"method of the sweep should be 'grid' or 'lhs', not {spec['method']}")
+
+
+def get_sweep_path(path_main, name):
+    return f'{path_main}/sweeps/{name}.json'
+
+
+def load_sweep(path, spec):
+    '''Returns the saved state of the sweep, or a new state with every point of the spec pending
+    The points are saved, so a (seeded or not) lhs sweep continues with the same points'''
+    state = load_manifest(path)
+    if state is not None and state['spec'] == spec:
+        return state
+    return {'spec': spec, 'points': [{'params': params, 'status': 'pending', 'accepted': 0, 'attempted': 0, 'seconds': 0.}
+                                     for params in get_points(spec)]}
+
+
+def save_sweep(path, state):
+    '''Write the state atomically, like the manifests'''
+    save_manifest(path, state)
+
+
+def get_point_name(spec, index):
+    '''Name of the manifest of a point'''
+    return f"{spec['name']}_point{index:03d}"
+
+
+def summarize(state, path=None):
+    '''Acceptance rate and timing per point, saved as csv if path is given'''
+    rows = []
+    for index, point in enumerate(state['points']):
+        row = {'point': index, **point['params'], 'status': point['status'], 'accepted': point['accepted'],
+               'attempted': point['attempted'], 'seconds': round(point['seconds'], 2)}
+        row['acceptance_rate'] = point['accepted'] / point['attempted'] if point['attempted'] else np.nan
+        row['seconds_per_accepted'] = point['seconds'] / point['accepted'] if point['accepted'] else np.nan
+        rows.append(row)
+    df = pd.DataFrame(rows)
+    if path is not None:
+        df.to_csv(path, index=False)
+    return df
@@ -0,0 +1,125 @@
+'''
+Per frame trajectories of the trial objects, the physical ground truth of a trial
+TrajectoryRecorder is an add-on that writes the transforms and rigidbody output of every frame directly into preallocated
+float32 arrays of shape (frames, objects, ...), and keeps a table of all collision events.
+Every rendered communicate is one frame, the same frames as the images of the trial.
+
+Example usage:
+recorder = TrajectoryRecorder()
+self.add_ons.append(recorder)
+recorder.start_trial(self.o_ids)
+... frame loop ...
+recorder.finish_trial(path)
+trajectory = np.load(path)
+trajectory['position']  # (frames, objects, 3)
+'''
+import numpy as np
+
+from tdw.add_ons.add_on import AddOn
+from tdw.output_data import OutputData, Transforms, Rigidbodies, Collision, EnvironmentCollision
+
+# State of a collision event in the events table
+COLLISION_STATES = {'enter': 0, 'stay': 1, 'exit': 2}
+
+
+class TrajectoryRecorder(AddOn):
+    def __init__(self, max_frames=256):
+        super().__init__()
+        self.max_frames = max_frames
+        self.index = None
+
+        # Frames that are not rendered are not recorded either, see Runner.communicate_unrendered
+        self.skip = False
+
+    def get_initialization_commands(self):
+        # The same collision settings as the CollisionManager and the trial commands of collision.py, so they don't override each other
+        return [{"$type": "send_collisions", "enter": True, "stay": False, "exit": False, "collision_types": ["obj", "env"]}]
+
+    def start_trial(self, o_ids):
+        '''Record the next frames for the objects with o_ids'''
+        self.o_ids = list(o_ids)
+        self.index = {o_id: k for k, o_id in enumerate(self.o_ids)}
+        self.frame = 0
+        self._allocate(self.max_frames)
+        self.events = {'frame': [], 'ids': [], 'state': [], 'relative_velocity': [], 'contact_point': []}
+        self._request_output()
+
+    def _allocate(self, num_frames):
+        '''(Re)allocate the buffers for num_frames, the recorded frames are kept'''
+        num_objects = len(self.o_ids)
+        shapes = {'position': 3, 'rotation': 4, 'velocity': 3, 'angular_velocity': 3}
+        buffers = {name: np.full((num_frames, num_objects, size), np.nan, dtype=np.float32) for name, size in shapes.items()}
+        buffers['sleeping'] = np.zeros((num_frames, num_objects), dtype=bool)
+        if self.frame:
+            for name, buffer in buffers.items():
+                buffer[:self.frame] = self.buffers[name][:self.frame]
+        self.buffers = buffers
+
+    def on_send(self, resp):
+        if self.index is None:
+            return
+        if self.skip:
+            self._request_output()
+            return
+        if self.frame == len(self.buffers['position']):
+            self._allocate(2 * self.frame)
+        f = self.frame
+        position, rotation = self.buffers['position'][f], self.buffers['rotation'][f]
+        velocity, angular_velocity, sleeping = self.buffers['velocity'][f], self.buffers['angular_velocity'][f], self.buffers['sleeping'][f]
+        for i in range(len(resp) - 1):
+            r_id = OutputData.get_data_type_id(resp[i])
+            if r_id == "tran":
+                transforms = Transforms(resp[i])
+                for j in range(transforms.get_num()):
+                    k = self.index.get(transforms.get_id(j))
+                    if k is not None:
+                        position[k] = transforms.get_position(j)
+                        rotation[k] = transforms.get_rotation(j)
+            elif r_id == "rigi":
+                rigidbodies = Rigidbodies(resp[i])
+                for j in range(rigidbodies.get_num()):
+                    k = self.index.get(rigidbodies.get_id(j))
+                    if k is not None:
+                        velocity[k] = rigidbodies.get_velocity(j)
+                        angular_velocity[k] = rigidbodies.get_angular_velocity(j)
+                        sleeping[k] = rigidbodies.get_sleeping(j)
+            elif r_id == "coll":
+                collision = Collision(resp[i])
+                self._add_event(collision.get_collider_id(), collision.get_collidee_id(), collision.get_state(),
+                                collision.get_relative_velocity(), collision)
+            elif r_id == "enco":
+                collision = EnvironmentCollision(resp[i])
+                self._add_event(collision.get_object_id(), -1, collision.get_state(), (np.nan, np.nan, np.nan), collision)
+        self.frame += 1
+        self._request_output()
+
+    def _request_output(self):
+        '''Request the output of the next frame, also if a controller turned it off (e.g. open-loop agents)'''
+        self.commands.extend([{"$type": "send_transforms", "frequency": "once", "ids": self.o_ids},
+                              {"$type": "send_rigidbodies", "frequency": "once", "ids": self.o_ids}])
+
+    def _add_event(self, id_a, id_b, state, relative_velocity, collision):
+        '''Add a collision between two objects (id_b is -1 for the environment) to the events table'''
+        if id_a not in self.index and id_b not in self.index:
+            return
+        self.events['frame'].append(self.frame)
+        self.events['ids'].append((id_a, id_b))
+        self.events['state'].append(COLLISION_STATES.get(state, -1))
+        self.events['relative_velocity'].append(relative_velocity)
+        self.events['contact_point'].append(collision.get_contact_point(0) if collision.get_num_contacts() else (np.nan, np.nan, np.nan))
+
+    def finish_trial(self, path):
+        '''Save the recorded frames compressed as npz and stop recording, returns path'''
+        np.savez_compressed(path, o_ids=np.array(self.o_ids, dtype=np.int64),
+                            **{name: buffer[:self.frame] for name, buffer in self.buffers.items()},
+                            collision_frame=np.array(self.events['frame'], dtype=np.int32),
+                            collision_ids=np.array(self.events['ids'], dtype=np.int64).reshape(-1, 2),
+                            collision_state=np.array(self.events['state'], dtype=np.int8),
+                            collision_relative_velocity=np.array(self.events['relative_velocity'], dtype=np.float32).reshape(-1, 3),
+                            collision_contact_point=np.array(self.events['contact_point'], dtype=np.float32).reshape(-1, 3))
+        self.discard_trial()
+        return path
+
+    def discard_trial(self):
+        '''Stop recording without saving, e.g. for rejected trials'''
+        self.index = None
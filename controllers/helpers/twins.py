@@ -0,0 +1,45 @@
+'''
+Counterfactual twins: matched object and transition trials that share the frames before the transition
+With twins, a transition trial is simulated up to the frame where the controller starts the transition (see Runner.branch),
+the state of the trial objects (position, rotation, velocity, angular velocity) is snapshotted there, and after the
+transition trial the object twin continues from the snapshot without the transition (see Runner.run_twin).
+The frames before the transition are rendered once and copied to the object twin.
+'''
+from tdw.output_data import OutputData, Transforms, Rigidbodies
+
+# Commands of the trial initialization that move objects, they are left out when the objects are added again,
+# the objects get the state of the snapshot instead
+MOTION_COMMANDS = ('object_look_at', 'object_look_at_position', 'teleport_object_by', 'rotate_object_by')
+
+
+def get_object_states(resp, o_ids):
+    '''Returns dict with o_id:dict with position, rotation (quaternion), velocity and angular_velocity,
+    None if the transforms or rigidbodies of one of the objects are missing in resp'''
+    transforms, rigidbodies = {}, {}
+    for i in range(len(resp) - 1 if resp else 0):
+        r_id = OutputData.get_data_type_id(resp[i])
+        if r_id == "tran":
+            tran = Transforms(resp[i])
+            for j in range(tran.get_num()):
+                transforms[tran.get_id(j)] = (tran.get_position(j).tolist(), tran.get_rotation(j).tolist())
+        elif r_id == "rigi":
+            rigi = Rigidbodies(resp[i])
+            for j in range(rigi.get_num()):
+                rigidbodies[rigi.get_id(j)] = (rigi.get_velocity(j).tolist(), rigi.get_angular_velocity(j).tolist())
+    if any(o_id not in transforms or o_id not in rigidbodies for o_id in o_ids):
+        return None
+    return {o_id: {'position': transforms[o_id][0], 'rotation': transforms[o_id][1],
+                   'velocity': rigidbodies[o_id][0], 'angular_velocity': rigidbodies[o_id][1]} for o_id in o_ids}
+
+
+def get_restore_commands(trial_commands, states):
+    '''Commands that add the objects of trial_commands again and give them the snapshotted states,
+    forces and other motion commands of the trial initialization are left out'''
+    commands = [command for command in trial_commands if command["$type"] not in MOTION_COMMANDS
+                and 'force' not in command["$type"] and 'torque' not in command["$type"]]
+    for o_id, state in states.items():
+        commands.extend([{"$type": "teleport_object", "id": o_id, "position": dict(zip('xyz', state['position']))},
+                         {"$type": "rotate_object_to", "id": o_id, "rotation": dict(zip('xyzw', state['rotation']))},
+                         {"$type": "set_velocity", "id": o_id, "velocity": dict(zip('xyz', state['velocity']))},
+                         {"$type": "set_angular_velocity", "id": o_id, "angular_velocity": dict(zip('xyz', state['angular_velocity']))}])
+    return commands
@@ -0,0 +1,130 @@
+'''
+Checks of saved trials, used by validate_dataset.py
+Every check works on the saved output of one trial (a row of info.csv), on whole stacks of frames at once:
+- empty or near-constant _img frames (e.g. a camera inside a wall)
+- objects that are absent from the _id pass in every frame
+- objects that leave the view and don't come back
+- transition/agent frames without observed motion afterwards
+'''
+import ast
+import os
+import numpy as np
+from PIL import Image
+
+from .delta import load_delta
+from .helpers import load_frames, load_mkv
+from .raw_capture import load_raw
+from .visibility import get_visibility, load_visibility
+
+
+def parse_value(value):
+    '''Values in info.csv are saved as strings, e.g. "['_img', '_mask']", returns the python value'''
+    if not isinstance(value, str):
+        return None if value is None or (isinstance(value, float) and np.isnan(value)) else value
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
+
+
+def resolve_path(path):
+    '''Paths in info.csv are relative to the directory the controller ran from (the repo or controllers)'''
+    if not isinstance(path, str):
+        return None
+    for candidate in [path, f'../{path}', path[3:] if path.startswith('../') else path]:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def get_stds(frames, chunk=32):
+    '''Standard deviation of the pixel values of every frame, shape (frames,)'''
+    stds = np.zeros(len(frames), dtype=np.float32)
+    for start in range(0, len(frames), chunk):
+        block = np.asarray(frames[start:start+chunk], dtype=np.float32)
+        stds[start:start+len(block)] = block.reshape(len(block), -1).std(axis=1)
+    return stds
+
+
+def get_motion(frames, chunk=32):
+    '''Mean absolute difference between consecutive frames, shape (frames-1,)'''
+    motion = np.zeros(max(len(frames) - 1, 0), dtype=np.float32)
+    for start in range(0, len(frames) - 1, chunk):
+        block = np.asarray(frames[start:start+chunk+1], dtype=np.int16)
+        motion[start:start+len(block)-1] = np.abs(np.diff(block, axis=0)).mean(axis=(1, 2, 3))
+    return motion
+
+
+def load_trial(row):
+    '''Load the saved frames of a trial from the raw file, the frames folder or the mkv file,
+    and the _img frames from the delta file if they are saved as delta
+    The first frame is not used in the videos, so it's left out of every source (the mkv file does not have it)
+    Returns: dict with pass mask:frames (frames-1, H, W, C), None if nothing is saved'''
+    frames = None
+    path_raw = resolve_path(row.get('path_raw'))
+    path_frames = resolve_path(row.get('path_frames'))
+    path_videos = parse_value(row.get('path_videos'))
+    path_mkv = resolve_path(path_videos[0]) if isinstance(path_videos, list) and path_videos and path_videos[0].endswith('.mkv') else None
+    if path_raw is not None:
+        frames = {mask_type: images[1:] for mask_type, images in load_raw(path_raw)[1].items()}
+    elif path_frames is not None:
+        image_folder = f'{path_frames.rstrip("/")}/frames_temp'
+        png = parse_value(row.get('png')) in [True, 'True']
+        frames = {mask_type: load_frames(image_folder, mask_type, png)[1:] for mask_type in parse_value(row.get('pass_masks')) or ['_img']}
+    elif path_mkv is not None:
+        frames = load_mkv(path_mkv)
+
+    # With save_delta the full _img frames are removed, the delta is decoded against the background of the trial
+    path_delta = resolve_path(row.get('path_delta'))
+    if path_delta is not None and (frames is None or not len(frames.get('_img', []))):
+        path_background = resolve_path(row.get('background'))
+        background = np.asarray(Image.open(path_background).convert('RGB')) if path_background is not None else None
+        frames = dict(frames or {}, _img=load_delta(path_delta, background)[1:])
+    return frames
+
+
+def validate_trial(row, min_std=2., min_motion=.5, motion_window=10):
+    '''Check one saved trial
+    param row: dict of a row of info.csv
+    param min_std: frames with a smaller standard deviation of the pixel values count as empty
+    param min_motion: smallest mean absolute pixel difference between frames that counts as motion
+    param motion_window: number of frames after the first transition/agent frame in which motion should be observed
+    Returns: list of reasons why the trial is flagged, empty if it's fine'''
+    frames = load_trial(row)
+    if frames is None or '_img' not in frames or not len(frames['_img']):
+        return ['no frames found']
+    images = frames['_img']
+    reasons = []
+
+    # Empty or near-constant frames
+    stds = get_stds(images)
+    if (stds < min_std).any():
+        reasons.append(f'{int((stds < min_std).sum())} empty frames')
+
+    # Visibility of the objects, saved or computed from the _id pass
+    visibility = None
+    path_visibility = resolve_path(row.get('path_visibility'))
+    colors = parse_value(row.get('segmentation_colors'))
+    if path_visibility is not None:
+        visibility = load_visibility(path_visibility)
+    elif '_id' in frames and colors:
+        o_ids = list(colors)
+        visibility = get_visibility(frames['_id'], [colors[o_id][0] for o_id in o_ids], o_ids)
+    if visibility is not None:
+        fraction, truncated = visibility['fraction'], visibility['truncated']
+        for k, o_id in enumerate(visibility['o_ids']):
+            visible = fraction[:, k] > 0
+            if not visible.any():
+                reasons.append(f'object {o_id} absent from _id')
+            elif not visible[-1] and truncated[np.flatnonzero(visible)[-1], k]:
+                reasons.append(f'object {o_id} leaves the view')
+
+    # The objects should move after the transition or agent started
+    transition_frames = parse_value(row.get('transition_or_agent_frames'))
+    if isinstance(transition_frames, list) and transition_frames:
+        # The frame numbers count the first frame, which is not loaded
+        start = max(transition_frames[0] - 1, 0)
+        motion = get_motion(images[start:start+motion_window+1])
+        if not len(motion) or motion.max() < min_motion:
+            reasons.append(f'no motion after transition frame {transition_frames[0]}')
+    return reasons
@@ -0,0 +1,52 @@
+'''
+Cached per-model verdicts of the automated object vetting, see object_vetting.py
+The verdict file is a json dictionary with the model name as key, e.g.:
+{"apple": {"library": "models_core.json", "library_version": "1.12.7", "passed": true, "reasons": [], ...}}
+helpers.objects filters its lists with these verdicts, so models that failed are never used in trials
+'''
+import json
+import os
+
+# The verdicts are stored next to the data folder, independent of the working directory
+VETTING_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'vetting')
+
+
+def get_verdict_path(library='models_core.json'):
+    '''Returns the path of the verdict file of a model library'''
+    return os.path.join(VETTING_PATH, f"verdicts_{library.replace('.json', '')}.json")
+
+
+def load_verdicts(library='models_core.json'):
+    '''Returns dict with all cached verdicts of library, empty dict if nothing is vetted yet'''
+    try:
+        with open(get_verdict_path(library)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_verdicts(verdicts, library='models_core.json'):
+    '''Write verdicts atomically, so an interrupted run never leaves a half written file'''
+    path = get_verdict_path(library)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(verdicts, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def is_vetted(verdicts, name, library_version):
+    '''True if model name is already vetted for this version of the library'''
+    return name in verdicts and verdicts[name].get('library_version') == library_version
+
+
+def vetted_names(library='models_core.json', passed=True):
+    '''Returns the names of all vetted models that passed (or failed if passed is False),
+    this can be used to expand the object pool with models that are not in helpers.objects yet'''
+    return sorted(name for name, verdict in load_verdicts(library).items() if verdict['passed'] == passed)
+
+
+def filter_vetted(names, library='models_core.json'):
+    '''Remove the models from names that failed vetting,
+    models that are not vetted (yet) are kept, so the hand curated lists keep working without a verdict file'''
+    verdicts = load_verdicts(library)
+    return [name for name in names if verdicts.get(name, {}).get('passed', True)]
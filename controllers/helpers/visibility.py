@@ -0,0 +1,94 @@
+'''
+Per frame visibility of the trial objects, computed from the _id pass
+For every frame and every object the visible fraction of the frame and a truncated-at-border flag are counted at once
+for a whole stack of frames (np.bincount), without a python loop per frame or pixel.
+Controllers can use these metrics as acceptance criteria, see Runner.accept_visibility.
+
+Example usage:
+visibility = get_visibility(id_frames, colors, o_ids)
+visible_at_end(visibility, k=-1)
+longest_hidden_run(visibility, k=0)
+'''
+import numpy as np
+
+from .roi import pack_colors
+
+
+def _count_labels(labels, num_labels):
+    '''Count every label per frame at once, labels has shape (frames, pixels), returns (frames, num_labels)'''
+    offsets = np.arange(len(labels), dtype=np.int32)[:, None] * num_labels
+    counts = np.bincount((labels + offsets).ravel(), minlength=len(labels) * num_labels)
+    return counts.reshape(len(labels), num_labels)
+
+
+def get_visibility(id_frames, colors, o_ids, chunk=32):
+    '''Visible fraction and truncation of every object in every frame
+    param id_frames: _id pass of shape (frames, H, W, 3)
+    param colors: rgb segmentation color of every object, None if the object has no color (e.g. it was not added)
+    param o_ids: the object ids, in the same order as colors
+    param chunk: number of frames that are counted at once, limits the memory use
+    Returns: dict with o_ids, fraction (frames, objects) of the pixels of the frame that show the object
+             and truncated (frames, objects), True if the object touches the border of the frame'''
+    num_frames, height, width = id_frames.shape[:3]
+    num_objects = len(colors)
+
+    # Sorted colors of the objects, pixels are labeled with the index of their object, num_objects for everything else
+    known = np.array([k for k, color in enumerate(colors) if color is not None], dtype=np.int32)
+    packed = pack_colors(np.array([colors[k] for k in known]).reshape(-1, 3))
+    order = np.argsort(packed)
+    packed, known = packed[order], known[order]
+
+    border = np.zeros((height, width), dtype=bool)
+    border[[0, -1], :] = True
+    border[:, [0, -1]] = True
+
+    counts = np.zeros((num_frames, num_objects + 1), dtype=np.int64)
+    border_counts = np.zeros((num_frames, num_objects + 1), dtype=np.int64)
+    for start in range(0, num_frames, chunk):
+        ids = pack_colors(id_frames[start:start+chunk]).reshape(-1, height * width)
+        labels = np.full(ids.shape, num_objects, dtype=np.int32)
+        if len(known):
+            positions = np.minimum(np.searchsorted(packed, ids), len(known) - 1)
+            matched = packed[positions] == ids
+            labels[matched] = known[positions[matched]]
+        counts[start:start+chunk] = _count_labels(labels, num_objects + 1)
+        border_counts[start:start+chunk] = _count_labels(labels[:, border.ravel()], num_objects + 1)
+
+    return {'o_ids': list(o_ids), 'fraction': (counts[:, :num_objects] / (height * width)).astype(np.float32),
+            'truncated': border_counts[:, :num_objects] > 0}
+
+
+def visible_at_end(visibility, k, min_fraction=0., last_frames=1):
+    '''True if object k is visible (more than min_fraction of the frame) in the last last_frames frames'''
+    return bool((visibility['fraction'][-last_frames:, k] > min_fraction).all())
+
+
+def longest_hidden_run(visibility, k):
+    '''Longest number of consecutive frames that object k is fully hidden after it was seen,
+    runs that start when the object was truncated at the border are not counted, since the object left the view'''
+    visible = visibility['fraction'][:, k] > 0
+    truncated = visibility['truncated'][:, k]
+    longest, counting = 0, False
+    for i in np.flatnonzero(np.diff(visible.astype(np.int8))) + 1:
+        # i is the first frame after a change of visibility
+        if not visible[i]:
+            counting, start = not truncated[i-1], i
+        elif counting:
+            longest, counting = max(longest, i - start), False
+    if counting:
+        longest = max(longest, len(visible) - start)
+    return longest
+
+
+def save_visibility(path, visibility):
+    '''Save the metrics compact as npz, the fraction as float16'''
+    np.savez_compressed(path, o_ids=np.array(visibility['o_ids']), fraction=visibility['fraction'].astype(np.float16),
+                        truncated=np.packbits(visibility['truncated'], axis=0), num_frames=len(visibility['fraction']))
+
+
+def load_visibility(path):
+    '''Load the metrics saved with save_visibility'''
+    data = np.load(path)
+    num_frames = int(data['num_frames'])
+    return {'o_ids': data['o_ids'].tolist(), 'fraction': data['fraction'].astype(np.float32),
+            'truncated': np.unpackbits(data['truncated'], axis=0, count=num_frames).astype(bool)}
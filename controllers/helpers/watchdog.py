@@ -0,0 +1,84 @@
+'''
+Build watchdog: deadlines on scene loading, trial initialization and every communicate, and recovery of hung builds
+Every communicate of a Runner has a receive timeout on its socket, a build that does not answer in time raises BuildTimeout.
+Runner.run then kills the build, launches a new one on the same port, restores the scene and retries the trial,
+the reasons of all failed trials are counted in the manifest (see Runner.record_failure).
+
+Example usage:
+deadline = Deadline(300, 'scene load')
+while not loaded:
+    deadline.check()
+'''
+import time
+import zmq
+import psutil
+
+from tdw.controller import Controller
+
+# Deadlines in seconds
+TIMEOUTS = {'communicate': 60, 'scene': 300, 'trial_init': 120}
+
+
+class BuildTimeout(Exception):
+    '''The build did not respond before a deadline'''
+
+
+class Deadline:
+    def __init__(self, seconds, name):
+        self.end = time.time() + seconds
+        self.seconds, self.name = seconds, name
+
+    def check(self):
+        '''Raise BuildTimeout if the deadline has passed'''
+        if time.time() > self.end:
+            raise BuildTimeout(f'{self.name} took longer than {self.seconds}s')
+
+
+def set_timeout(socket, seconds):
+    '''Receive timeout of a zmq socket, None waits forever'''
+    if hasattr(socket, 'set_timeout'):
+        # The socket of a build of the asyncio runtime, see async_runtime.py
+        socket.set_timeout(seconds)
+    else:
+        socket.setsockopt(zmq.RCVTIMEO, -1 if seconds is None else int(seconds * 1000))
+
+
+def kill_build(port):
+    '''Kill the build that was launched for port (Controller.launch_build starts it with "-port {port}")'''
+    killed = []
+    for process in psutil.process_iter(['cmdline']):
+        if f'-port {port}' in (process.info['cmdline'] or []):
+            process.kill()
+            killed.append(process)
+    psutil.wait_procs(killed, timeout=10)
+    return len(killed)
+
+
+def relaunch_build(controller, port, timeout):
+    '''Replace the (hung) build of controller with a new build on the same port, the same way Controller.__init__ connects
+    The add-ons are initialized again, the scene has to be loaded again'''
+    kill_build(port)
+    old_socket = controller.socket
+    old_socket.close(linger=0)
+
+    Controller.launch_build(port=port)
+    socket = zmq.Context.instance().socket(zmq.REP)
+    socket.bind(f'tcp://*:{port}')
+    set_timeout(socket, timeout)
+    if hasattr(old_socket, 'rewrap'):
+        # The socket of a build of the asyncio runtime, see async_runtime.py
+        socket = old_socket.rewrap(socket)
+    controller.socket = socket
+    try:
+        socket.recv()
+    except zmq.Again:
+        raise BuildTimeout(f'the new build on port {port} did not connect within {timeout}s')
+
+    for add_on in controller.add_ons:
+        add_on.commands.clear()
+    controller.communicate([{"$type": "set_error_handling"},
+                            {"$type": "load_scene", "scene_name": "ProcGenScene"}])
+
+    # The add-ons (e.g. the camera) are added again together with the scene
+    for add_on in controller.add_ons:
+        add_on.initialized = False
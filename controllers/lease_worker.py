@@ -0,0 +1,92 @@
+'''
+Readme:
+Example usage on every node: python controllers/lease_worker.py --spec queue.json --queue /shared/queue --path_main /shared/data
+Afterwards, on one node: python controllers/lease_worker.py --queue /shared/queue --path_main /shared/data --merge
+
+Spreads the generation of trials over several nodes (or processes) that share a filesystem, without a scheduler service,
+see helpers/lease_queue.py. Every worker claims work units (a number of trials of one controller and trial_type) with lease files,
+writes its trials to its own shard in {path_main}/shards/, and takes over the units of workers that stopped renewing their lease.
+With --merge the info.csv of all shards is combined into {path_main}/info.csv.
+'''
+import argparse
+import json
+import os
+import random
+import time
+
+from helpers.helpers import message
+from helpers.lease_queue import LeaseQueue, LEASE_TTL, create_units, get_shard_path, merge_shards
+from helpers.manifest import load_manifest, get_manifest_path
+from helpers.runner_main import INFO_COLUMNS
+
+from sweep import CONTROLLERS, SETTINGS
+
+
+def run_worker(queue, path_main, port=1071):
+    '''Claim and run units until every unit is done'''
+    shard = get_shard_path(path_main, queue.node)
+    controller, failed = None, set()
+    while True:
+        unit = queue.claim(skip=failed)
+        if unit is None:
+            if len(queue.done()) + len(failed) >= len(queue.units()):
+                break
+            # The other units are leased, wait for them to finish or to expire
+            time.sleep(queue.ttl / 4)
+            continue
+
+        # A build keeps running as long as the units are of the same controller
+        if controller is None or controller.controller_name != unit['controller']:
+            if controller is not None:
+                controller.communicate({"$type": "terminate"})
+                controller.socket.close()
+            controller = CONTROLLERS[unit['controller']](port=port)
+
+        print(f"Node {queue.node} runs {unit['name']}: {unit['num']} {unit['controller']} {unit['trial_type']} trials")
+        keep_alive = queue.keep_alive(unit['name'])
+        try:
+            random.seed(unit['seed'])
+            result = controller.run(num=unit['num'], trial_type=unit['trial_type'], trial_id=unit['trial_id'], path_main=shard,
+                                    manifest_name=unit['name'], resume=True, reuse_scene=True, terminate=False,
+                                    **dict(SETTINGS[unit['controller']], **unit['run']))
+        finally:
+            keep_alive.set()
+
+        manifest = load_manifest(get_manifest_path(shard, controller.controller_name, unit['trial_type'], unit['name']))
+        if manifest is not None and manifest['trial_num'] == manifest['num']:
+            stats = {key: controller.trial_stats.get(key, 0) for key in ['accepted', 'attempted', 'seconds']}
+            if not queue.complete(unit['name'], shard, stats):
+                print(message(f"The lease of {unit['name']} expired, another node creates it again", 'warning'))
+        else:
+            print(message(f"{unit['name']} did not finish, it is left to the other nodes: {result}", 'warning'))
+            failed.add(unit['name'])
+            queue.release(unit['name'])
+
+    if controller is not None:
+        controller.communicate({"$type": "terminate"})
+    return message(f'Node {queue.node} is done, its trials are in {shard}', 'success')
+
+
+if __name__ == "__main__":
+    # The same base path as Runner
+    default_path = '../data/batch2' if os.getcwd().endswith('controllers') else 'data/batch2'
+
+    parser = argparse.ArgumentParser(description="Create trials from a work queue on a shared filesystem")
+    parser.add_argument("--spec", type=str, default=None, help="json file with the queue spec, see helpers/lease_queue.py, creates the units if needed")
+    parser.add_argument("--queue", type=str, default=None, help="Shared folder of the queue, default is {path_main}/queue")
+    parser.add_argument("--path_main", type=str, default=default_path, help="Shared folder of the data, every node writes to its own shard in it")
+    parser.add_argument("--node", type=str, default=None, help="Name of this worker, by default hostname_pid, the same name continues its own units")
+    parser.add_argument("--ttl", type=float, default=LEASE_TTL, help="Seconds without renewal after which a lease is taken over")
+    parser.add_argument("--port", type=int, default=1071, help="Port of the build")
+    parser.add_argument("--merge", action='store_true', help="Combine the info.csv of all shards into {path_main}/info.csv")
+    args = parser.parse_args()
+
+    queue_dir = args.queue or f'{args.path_main}/queue'
+    if args.merge:
+        added = merge_shards(queue_dir, args.path_main, INFO_COLUMNS)
+        print(message(f'Added {added} trials of the shards to {args.path_main}/info.csv', 'success'))
+    else:
+        if args.spec is not None:
+            with open(args.spec) as f:
+                create_units(queue_dir, json.load(f))
+        print(run_worker(LeaseQueue(queue_dir, args.node, args.ttl), args.path_main, args.port))
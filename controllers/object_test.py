@@ -17,6 +17,7 @@ import shutil
 import random   
 import os
 from helpers.helpers import message, create_arg_parser
+from helpers.watchdog import TIMEOUTS, BuildTimeout, Deadline
 import time
 from tdw.librarian import ModelLibrarian
 
@@ -143,6 +144,7 @@ class Object_tester(Controller):
             self.communicate(commands)
             ext = '.png' if png else '.jpg'
             moved = False
+            deadline = Deadline(TIMEOUTS['scene'], f'loading {self.names[self.index]}')
             while not moved:
                 try:
                     first_frame = os.listdir(f'{path_frames}')[0]
@@ -150,8 +152,12 @@ class Object_tester(Controller):
                         return message('name cannot contain a dot for later evalutation',  'error')
                     shutil.move(f'{path_frames}/{first_frame}', f'{path_backgr}/{self.index}.{self.names[self.index]}{ext}') 
                     moved = True
-                except FileNotFoundError:
+                except (FileNotFoundError, IndexError):
                     # Scene is still loading
+                    try:
+                        deadline.check()
+                    except BuildTimeout as e:
+                        return message(f'{e}, restart the build and continue from index {self.index}', 'error')
                     print(message("Loading scene is taking a long time", 'warning'))
                     time.sleep(5)
 
@@ -0,0 +1,220 @@
+# STATUS: V1 - Experimential
+'''
+Readme:
+Example usage: python object_vetting.py --library models_core.json --batch_size 16
+The goal of this file is to automatically test which objects create bugs and which objects are fine,
+this replaces going through object_test.py screenshots by hand
+
+A batch of models is spawned in a grid, every model gets its own camera, and the physics runs for a couple of frames.
+For every model the following is checked:
+- the model can be added and has bounds, transforms and rigidbody output (the 'NoneType' object is not iterable bugs)
+- the scale is not too big or too small
+- the model settles (falls asleep) and does not fall through the floor
+- the model does not flip over when it is placed upright
+In the last frame a thumbnail of every model in the batch is rendered at once.
+
+The verdicts are cached in data/vetting/verdicts_{library}.json, see helpers/vetting.py
+Models that are already vetted for the same library version are skipped, so runs can be interrupted and resumed.
+helpers.objects removes all the models that failed from its lists.
+
+Possible improvements:
+Test in other rooms than the empty room
+'''
+from tdw.controller import Controller
+from tdw.tdw_utils import TDWUtils
+from tdw.add_ons.third_person_camera import ThirdPersonCamera
+from tdw.add_ons.image_capture import ImageCapture
+from tdw.librarian import ModelLibrarian
+from tdw.output_data import OutputData, Transforms, Rigidbodies, Bounds
+from tdw.version import __version__
+from scipy.spatial.transform import Rotation
+import numpy as np
+import argparse
+import shutil
+import os
+
+from helpers.helpers import message
+from helpers.vetting import VETTING_PATH, load_verdicts, save_verdicts, is_vetted
+
+
+class ObjectVetter(Controller):
+    def __init__(self, library='models_core.json', batch_size=16, spacing=3, port=1071):
+        '''
+        param library: the model library that will be vetted
+        param batch_size: number of models that are spawned and tested at the same time
+        param spacing: distance in meters between the models in the grid
+        '''
+        self.library = library
+        self.records = ModelLibrarian(library).records
+        self.batch_size = batch_size
+
+        # Every model in a batch gets a fixed slot in the grid and its own camera
+        side = int(np.ceil(np.sqrt(batch_size)))
+        self.slots = [{"x": (i % side - (side-1)/2)*spacing, "y": 0, "z": (i // side - (side-1)/2)*spacing} for i in range(batch_size)]
+        self.room_size = int(side*spacing + 4)
+        super().__init__(port=port)
+
+    def set_cameras(self):
+        '''Add one camera per slot, all cameras render in the same frame'''
+        self.avatar_ids = [f'vet_{i}' for i in range(self.batch_size)]
+        for avatar_id, slot in zip(self.avatar_ids, self.slots):
+            camera = ThirdPersonCamera(position={"x": slot['x']+1.2, "y": 1, "z": slot['z']-1.2},
+                                       look_at={"x": slot['x'], "y": .3, "z": slot['z']},
+                                       avatar_id=avatar_id)
+            self.add_ons.append(camera)
+
+    def vet_batch(self, records, settle_frames, max_extent, min_extent, max_tilt):
+        '''Spawn all records, run the physics and return a verdict per record
+        Returns: dict with name:verdict'''
+        verdicts = {record.name: {'library': self.library, 'library_version': __version__, 'passed': False, 'reasons': []}
+                    for record in records}
+        commands, o_ids = [], {}
+        for record, slot in zip(records, self.slots):
+            if record.do_not_use:
+                verdicts[record.name]['reasons'].append('do_not_use')
+                continue
+            try:
+                o_id = self.get_unique_id()
+                commands.extend(self.get_add_physics_object(model_name=record.name,
+                                                            library=self.library,
+                                                            object_id=o_id,
+                                                            position=slot,
+                                                            rotation={"x": 0, "y": 0, "z": 0}))
+                o_ids[o_id] = record.name
+            except (TypeError, KeyError, ValueError) as e:
+                # Sometimes we get TypeError: 'NoneType' object is not iterable, for broken records
+                verdicts[record.name]['reasons'].append(f'spawn_error: {e}')
+
+        commands.extend([{"$type": "send_bounds", "frequency": "once", "ids": list(o_ids)},
+                         {"$type": "send_transforms", "frequency": "always", "ids": list(o_ids)},
+                         {"$type": "send_rigidbodies", "frequency": "always", "ids": list(o_ids)}])
+        resp = self.communicate(commands)
+
+        # Check the scale with the bounds of the first frame
+        has_bounds = set()
+        for i in range(len(resp) - 1):
+            if OutputData.get_data_type_id(resp[i]) == "boun":
+                bounds = Bounds(resp[i])
+                for j in range(bounds.get_num()):
+                    o_id = bounds.get_id(j)
+                    if o_id not in o_ids:
+                        continue
+                    has_bounds.add(o_id)
+                    extents = [float(np.abs(bounds.get_right(j)[0] - bounds.get_left(j)[0])),
+                               float(np.abs(bounds.get_top(j)[1] - bounds.get_bottom(j)[1])),
+                               float(np.abs(bounds.get_front(j)[2] - bounds.get_back(j)[2]))]
+                    verdicts[o_ids[o_id]]['extents'] = extents
+                    if max(extents) > max_extent:
+                        verdicts[o_ids[o_id]]['reasons'].append('too_big')
+                    if max(extents) < min_extent:
+                        verdicts[o_ids[o_id]]['reasons'].append('too_small')
+
+        # Let the physics do its thing, render the thumbnails only on the last frame
+        for i in range(settle_frames):
+            if i == settle_frames - 1:
+                self.capture.set(frequency='once', avatar_ids=self.avatar_ids)
+            resp = self.communicate([])
+
+        # Check output, settling and flipping with the last frame
+        has_output, sleeping = set(), set()
+        for i in range(len(resp) - 1):
+            r_id = OutputData.get_data_type_id(resp[i])
+            if r_id == "tran":
+                transforms = Transforms(resp[i])
+                for j in range(transforms.get_num()):
+                    o_id = transforms.get_id(j)
+                    if o_id not in o_ids:
+                        continue
+                    has_output.add(o_id)
+                    verdict = verdicts[o_ids[o_id]]
+                    if transforms.get_position(j)[1] < -.5:
+                        verdict['reasons'].append('fell_through_floor')
+
+                    # Angle between the up vector of the object and the world up vector
+                    up = Rotation.from_quat(transforms.get_rotation(j)).apply([0, 1, 0])
+                    verdict['tilt'] = float(np.degrees(np.arccos(np.clip(up[1], -1, 1))))
+                    if verdict['tilt'] > max_tilt:
+                        verdict['reasons'].append('flipped')
+            elif r_id == "rigi":
+                rigidbodies = Rigidbodies(resp[i])
+                for j in range(rigidbodies.get_num()):
+                    if rigidbodies.get_sleeping(j) or np.linalg.norm(rigidbodies.get_velocity(j)) < .01:
+                        sleeping.add(rigidbodies.get_id(j))
+
+        for o_id, name in o_ids.items():
+            if o_id not in has_bounds or o_id not in has_output:
+                verdicts[name]['reasons'].append('no_output')
+            if o_id not in sleeping:
+                verdicts[name]['reasons'].append('not_settled')
+
+        # Move the thumbnails of this batch, every camera has its own folder
+        path_thumbnails = f'{VETTING_PATH}/thumbnails'
+        for avatar_id, record in zip(self.avatar_ids, records):
+            path_avatar = f'{self.path_capture}/{avatar_id}'
+            file_names = [fn for fn in os.listdir(path_avatar) if fn.startswith('img_')] if os.path.isdir(path_avatar) else []
+            if record.name in o_ids.values() and file_names:
+                thumbnail = f'{path_thumbnails}/{record.name}{os.path.splitext(max(file_names))[1]}'
+                shutil.move(f'{path_avatar}/{max(file_names)}', thumbnail)
+                verdicts[record.name]['thumbnail'] = thumbnail
+        shutil.rmtree(self.path_capture, ignore_errors=True)
+
+        # Reset the scene by destroying the objects
+        destroy_commands = [{"$type": "destroy_object", "id": o_id} for o_id in o_ids]
+        destroy_commands.extend([{"$type": "send_transforms", "frequency": "never"},
+                                 {"$type": "send_rigidbodies", "frequency": "never"}])
+        self.communicate(destroy_commands)
+
+        for verdict in verdicts.values():
+            verdict['passed'] = verdict['reasons'] == []
+        return verdicts
+
+    def run(self, settle_frames=100, max_extent=2.5, min_extent=.02, max_tilt=45, redo=False):
+        '''
+        param settle_frames: number of frames the physics runs before the model should be asleep
+        param max_extent: models with a larger bounds extent (in meters) fail
+        param min_extent: models with a smaller bounds extent (in meters) fail
+        param max_tilt: models that tilt more degrees than this from upright count as flipped
+        param redo: if True, vet all models again, even if they are already vetted for this library version
+        '''
+        verdicts = load_verdicts(self.library)
+        records = [record for record in self.records if redo or not is_vetted(verdicts, record.name, __version__)]
+        print(f'{len(self.records)-len(records)} models are already vetted, {len(records)} models left')
+
+        self.path_capture = f'{VETTING_PATH}/capture_temp'
+        shutil.rmtree(self.path_capture, ignore_errors=True)
+        os.makedirs(f'{VETTING_PATH}/thumbnails', exist_ok=True)
+
+        # Create room, cameras and capture without images, the thumbnails are requested once per batch
+        self.add_ons.clear()
+        self.set_cameras()
+        self.capture = ImageCapture(path=self.path_capture, avatar_ids=self.avatar_ids, png=False, pass_masks=['_img'])
+        self.add_ons.append(self.capture)
+        self.communicate([TDWUtils.create_empty_room(self.room_size, self.room_size)])
+        self.capture.set(frequency='never', avatar_ids=self.avatar_ids)
+        shutil.rmtree(self.path_capture, ignore_errors=True)
+
+        num_batches = int(np.ceil(len(records)/self.batch_size))
+        for b in range(num_batches):
+            batch = records[b*self.batch_size:(b+1)*self.batch_size]
+            verdicts.update(self.vet_batch(batch, settle_frames, max_extent, min_extent, max_tilt))
+
+            # Save after every batch, so the run can be resumed
+            save_verdicts(verdicts, self.library)
+            print(message(f'Vetted batch ({b+1}/{num_batches})', 'success', round((b+1)/num_batches*10)))
+
+        self.communicate({"$type": "terminate"})
+        failed = [name for name, verdict in verdicts.items() if not verdict['passed']]
+        return message(f'{len(verdicts)-len(failed)}/{len(verdicts)} models passed, see the verdicts in {VETTING_PATH}', 'success')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vet all the models of a library in batches")
+    parser.add_argument("--library", type=str, default='models_core.json', help="Model library to vet")
+    parser.add_argument("--batch_size", type=int, default=16, help="Number of models tested at the same time")
+    parser.add_argument("--settle_frames", type=int, default=100, help="Number of frames before a model should be asleep")
+    parser.add_argument("--redo", action='store_true', help="Vet models again, even if already vetted for this library version")
+    args = parser.parse_args()
+
+    c = ObjectVetter(library=args.library, batch_size=args.batch_size)
+    success = c.run(settle_frames=args.settle_frames, redo=args.redo)
+    print(success)
@@ -44,12 +44,18 @@ from copy import deepcopy
 from PIL import Image
 import os
 from skimage import color, measure
+from helpers.visibility import longest_hidden_run
 
 class Occlusion(Runner):
+    # The transition and agent checks can be one frame late, see Runner.step
+    frame_latency = 1
+
+    # Number of frames the moving object should be fully hidden behind the occluder, with --check_visibility
+    min_hidden_frames = 5
+
     def __init__(self, port=1071):
         self.controller_name = 'occlusion'
-        lib = ModelLibrarian('models_core.json')
-        self.records_dict = {record.name:record for record in lib.records}
+        self.records_dict = {record.name:record for record in get_librarian('models_core.json').records}
         self.camera_pos = {"x": random.uniform(1.5, 2), "y": 0.1, "z": random.uniform(-1, 1)}
         super().__init__(port=port)
     
@@ -80,6 +86,7 @@ class Occlusion(Runner):
             # Camera is on the left of occluder, object stops on the right of occluder
             stop_moving = self.o_occl_loc_z + stop_moving
 
+        resp = None
         for i in range(tot_frames):
             # Check if this is object based or transition trial
             if trial_type == 'transition':
@@ -87,6 +94,8 @@ class Occlusion(Runner):
                 if self.o_moving_loc['z'] > stop_moving and self.direction == 'left' or self.o_moving_loc['z'] < stop_moving and self.direction == 'right':
                     commands = []
                     if not transition_compl:
+                        self.branch(resp)
+
                         # Choose between reverse random speed change, stop
                         speed = random.choice([random.uniform(0.01, 0.3), 0])
                         speed = speed if self.direction == 'right' else -speed                
@@ -100,10 +109,10 @@ class Occlusion(Runner):
                     # Start 'manual' movement
                     transition_frames.append(i)
                     commands.extend([{"$type": "teleport_object_by", "position": {"x": 0, "y": 0, "z": speed}, "id": self.o_ids[0], "absolute": True}])
-                    self.communicate(commands)
+                    self.step(commands)
                 else:
                     # Store response and make frame
-                    resp = self.communicate([])
+                    resp = self.step([])
 
                     # Update previous position with current position, only update z position 
                     # #NOTE: I assume here that the output of get_ob_pos is [x, y, z]
@@ -111,7 +120,7 @@ class Occlusion(Runner):
                         self.o_moving_loc[axis_name] = axis_val
                         
             if trial_type == 'object':
-                self.communicate([])
+                self.step([])
 
             if trial_type == 'agent':
                 if i == 0:
@@ -119,15 +128,16 @@ class Occlusion(Runner):
                                              {"$type": "teleport_object_by", "position": {"x": 0, "y": 0, "z": speed}, "id": self.o_ids[0], "absolute": False}])
                     transition_frames.append(i)
                 elif (get_distance(resp, self.o_ids[0], self.o_ids[2])- bounds) <.05 or agent_success:
-                    resp = self.communicate([])
+                    resp = self.step([])
                     agent_success = True
                 else:
-                    resp = self.communicate([{"$type": "object_look_at", "other_object_id": self.o_ids[2], "id": self.o_ids[0]},
+                    resp = self.step([{"$type": "object_look_at", "other_object_id": self.o_ids[2], "id": self.o_ids[0]},
                                              {"$type": "teleport_object_by", "position": {"x": 0, "y": 0, "z": speed}, "id": self.o_ids[0], "absolute": False}])
                     transition_frames.append(i)
 
             if i == 0:
                 # Check if occluder is occluding one side of the screen as well
+                self.flush()
                 file_names = os.listdir(self.path_frames)
                 file_names.sort()
                 fn = self.path_frames+'/'+[fn for fn in file_names if fn[:5] == 'mask_'][0]
@@ -149,17 +159,24 @@ class Occlusion(Runner):
                             "id": o_id})
         destroy_commands.append({"$type": "send_rigidbodies",
                             "frequency": "never"})
-        self.communicate(destroy_commands)
+        self.communicate_unrendered(destroy_commands)
         if not trial_success:
             return 'Fail', trial_success
         return transition_frames if transition_frames != [] else -1, True
       
+    def coverage_cells(self):
+        return get_valid_pairs(tuple(OCCLUDED), tuple(OCCLUDERS), axis=(1, 2))
+
     def add_occ_objects(self):
         '''This method adds two objects to the scene, one moving and one occluder'''
         records, commands = [], []
 
-        # Random occluded and occluder object, where occluded object is smaller
-        records, bounds = get_two_random_records(smaller_list=OCCLUDED, larger_list=OCCLUDERS, axis=[1,2])
+        # Random (or the least covered) occluded and occluder object, where occluded object is smaller
+        if self.steer_coverage:
+            records, bounds = get_records_of_pair(self.choose_cell(self.coverage_cells()))
+        else:
+            records, bounds = get_two_random_records(smaller_list=OCCLUDED, larger_list=OCCLUDERS, axis=[1,2])
+        self.coverage_cell = (records[0].name, records[1].name)
 
         self.all_names = [record.name for record in records]
         for i, record in enumerate(records):
@@ -224,6 +241,13 @@ class Occlusion(Runner):
         return commands
         
 
+    def accept_visibility(self, visibility):
+        '''The moving object (or agent) should be fully hidden for at least min_hidden_frames, without leaving the view'''
+        hidden = longest_hidden_run(visibility, 0)
+        if hidden < self.min_hidden_frames:
+            return f'the moving object is only hidden for {hidden} frames'
+        return True
+
     def trial_initialization_commands(self):
         '''
         param path: "Images will be save to here"'''
@@ -231,8 +255,15 @@ class Occlusion(Runner):
         self.direction = random.choice(['left', 'right'])
 
         # Define the location of moving object #TODO bigger variations
-        z = random.uniform(-5, -4) if self.direction == 'left' else random.uniform(5, 4)
-        self.o_moving_loc = {"x": random.uniform(-2.5, -1), "y": 0, "z": z}
+        def sample():
+            z = random.uniform(-5, -4) if self.direction == 'left' else random.uniform(5, 4)
+            return {"x": random.uniform(-2.5, -1), "y": 0, "z": z}
+
+        # In other rooms than the empty room, the path of the moving object past the occluder and the camera should be on free floor
+        free_path = lambda position: (self.occupancy.path_free(position, {"x": position['x'], "z": -position['z']}, .4) and
+                                      self.occupancy.is_free({"x": 0, "z": 0}, .5) and
+                                      self.occupancy.is_free({"x": -position['x'], "z": self.camera_pos['z']}, .2))
+        self.o_moving_loc = self.sample_free(sample, radius=.4, accept=free_path)
         
         # Define the z location of occluding object
         self.o_occl_loc_z = random.uniform(-.5, .5)
@@ -267,7 +298,7 @@ class Occlusion(Runner):
         else:
             # Find suitable magnitude for force
             record_moving = get_record_with_name(self.all_names[0])
-            magnitude = get_magnitude(record_moving)
+            magnitude = get_magnitude(record_moving, randomness=self.get_param('magnitude_randomness', 5), floor=self.loaded_scene, physics='mass_1')
 
         # Apply point object towards middle (but behind occluder) #TODO does not account for scale of object
         commands.append({"$type": "object_look_at_position", 
@@ -305,5 +336,13 @@ if __name__ == "__main__":
     print(message('add_object_to_scene is set to False and tot_frames to 200', 'warning'))
     success = c.run(num=args.num, pass_masks=args.pass_masks, room=args.room, tot_frames=200,
                     add_object_to_scene=False, trial_type=args.trial_type,
-                    png=args.png, save_frames=args.save_frames, save_mp4=args.save_mp4)
+                    png=args.png, save_frames=args.save_frames, save_mp4=args.save_mp4,
+                    resume=args.resume, save_delta=args.save_delta, save_roi=args.save_roi, roi_size=args.roi_size,
+                    pipeline=args.pipeline, save_raw=args.save_raw, check_visibility=args.check_visibility,
+                    save_trajectory=args.save_trajectory, timeout=args.timeout,
+                    coverage=args.coverage, quota=args.quota, render_profile=args.render_profile,
+                    video_format=args.video_format, img_codec=args.img_codec, twins=args.twins,
+                    occupancy=args.occupancy, assets=args.assets, skip_settle=args.skip_settle,
+                    stream=args.stream, stream_mode=args.stream_mode, stream_hwm=args.stream_hwm,
+                    stream_timeout=args.stream_timeout, stream_only=args.stream_only)
     print(success)
\ No newline at end of file
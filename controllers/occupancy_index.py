@@ -0,0 +1,48 @@
+'''
+Readme:
+Example usage: python controllers/occupancy_index.py --scenes tdw_room,box_room_2018
+
+Analyzes the free floor of scenes up front (see helpers/occupancy.py), so runs with --occupancy True do not analyze the scene first.
+By default all scenes of scenes.json that are not analyzed yet, the grids are cached in data/batch2/occupancy/{scene_name}.npz
+Add --overwrite to analyze scenes again, e.g. with another --cell size.
+'''
+import argparse
+import os
+import numpy as np
+from tdw.controller import Controller
+
+from helpers.helpers import message, get_librarian
+from helpers.occupancy import CELL, OccupancyGrid, analyze_scene, get_occupancy_path
+
+
+if __name__ == "__main__":
+    # The same base path as Runner
+    default_path = '../data/batch2' if os.getcwd().endswith('controllers') else 'data/batch2'
+
+    parser = argparse.ArgumentParser(description="Cache the free floor of scenes to spawn objects and cameras in free space")
+    parser.add_argument("--scenes", type=str, default=None, help="Comma separated scene names, by default all scenes of scenes.json")
+    parser.add_argument("--path_main", type=str, default=default_path, help="Folder of the occupancy folder")
+    parser.add_argument("--cell", type=float, default=CELL, help="Size in meters of a cell of the grid")
+    parser.add_argument("--overwrite", action='store_true', help="Analyze scenes that are already cached again")
+    parser.add_argument("--port", type=int, default=1071, help="Port of the build")
+    args = parser.parse_args()
+
+    scene_names = [record.name for record in get_librarian("scenes.json").records]
+    scenes = args.scenes.split(',') if args.scenes is not None else scene_names
+    unknown = [scene for scene in scenes if scene not in scene_names]
+    if unknown:
+        print(message(f'scenes should be any of {scene_names}, not {unknown}', 'error'))
+    else:
+        controller = None
+        for scene in scenes:
+            path = get_occupancy_path(args.path_main, scene)
+            if os.path.exists(path) and not args.overwrite:
+                grid = OccupancyGrid.load(path)
+            else:
+                controller = controller or Controller(port=args.port)
+                grid = analyze_scene(controller, scene, args.cell)
+                grid.save(path)
+            print(f'{scene}: {np.mean(grid.free):.0%} of {grid.free.size} cells free, largest clearance {grid.clearance.max():.1f}m')
+        if controller is not None:
+            controller.communicate({"$type": "terminate"})
+        print(message(f'The occupancy grids are saved in {args.path_main}/occupancy', 'success'))
@@ -0,0 +1,35 @@
+'''
+Readme:
+Example usage: python controllers/prefetch_assets.py --cache /shared/assets
+Afterwards, on nodes without network: python controllers/collision.py --assets /shared/assets
+
+Downloads the asset bundles of every scene of scenes.json and every model the controllers use into a local cache (see helpers/asset_cache.py),
+with their checksums and the tdw version in {cache}/assets.json. Bundles that are already cached are skipped, so it can be run again
+after an interruption or after objects are added to helpers/objects.py. Add --verify to check the checksums of the cached bundles.
+'''
+import argparse
+import os
+import platform
+
+from helpers.asset_cache import get_assets, prefetch
+from helpers.helpers import message
+
+
+if __name__ == "__main__":
+    # Next to the data of Runner
+    default_path = '../data/assets' if os.getcwd().endswith('controllers') else 'data/assets'
+
+    parser = argparse.ArgumentParser(description="Download the asset bundles of the scenes and models for runs without network")
+    parser.add_argument("--cache", type=str, default=default_path, help="Folder of the asset cache, pass it as --assets to the controllers")
+    parser.add_argument("--all_models", action='store_true', help="All models of models_core.json instead of only the objects of the controllers")
+    parser.add_argument("--platform", type=str, default=platform.system(), choices=['Linux', 'Windows', 'Darwin'], help="Platform of the nodes")
+    parser.add_argument("--workers", type=int, default=8, help="Number of downloads at the same time")
+    parser.add_argument("--verify", action='store_true', help="Check the sha256 of the cached bundles, mismatches are downloaded again")
+    args = parser.parse_args()
+
+    assets = get_assets(args.all_models)
+    downloaded, failed = prefetch(args.cache, assets, args.platform, args.workers, args.verify)
+    if failed:
+        print(message(f'{len(failed)} of {len(assets)} asset bundles failed, run again to retry them', 'error'))
+    else:
+        print(message(f'All {len(assets)} asset bundles are in {args.cache}, {downloaded} downloaded', 'success'))
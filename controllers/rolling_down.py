@@ -8,7 +8,8 @@ NOTE: stopping is not the same as in occlusion trial and could be perfected
 
 Possible improvements:
 add other objects then cube
-Always make two versions of the exact same trial, object and transition?
+
+Two versions of the exact same trial, object and transition, are made with --twins True (see helpers/twins.py)
 '''
 from tdw.add_ons.third_person_camera import ThirdPersonCamera
 
@@ -18,13 +19,17 @@ import random
 from helpers.runner_main import Runner
 from helpers.objects import ROLLING_FLIPPED
 from helpers.helpers import *
+from helpers.planner import OpenLoopAgent
 
 import shutil
 import os
 
 class Slope(Runner):
-    def __init__(self):
-        super().__init__(port=1071) 
+    # The transition and agent checks can be one frame late, see Runner.step
+    frame_latency = 1
+
+    def __init__(self, port=1071):
+        super().__init__(port=port) 
         #NOTE do not change
         self.controller_name = 'rolling_down'
         
@@ -49,19 +54,32 @@ class Slope(Runner):
         agent_success = False
 
         # Get suitable, yet random force
-        force = get_magnitude(get_record_with_name(self.object_choice))
+        force = get_magnitude(get_record_with_name(self.object_choice), randomness=self.get_param('magnitude_randomness', 5), floor=self.loaded_scene)
         
+        if trial_type == 'agent' and self.open_loop_agent:
+            # Plan the path up the slope from the spawn positions, self.o_loc is the position of the target
+            agent = OpenLoopAgent(self.o_ids[0], self.o_ids[1], self.agent_pos, self.o_loc, speed, .1, tot_frames,
+                                  correction_every=self.correction_every)
+            resp = None
+
         trial_success = True
         for i in range(tot_frames):
             try:
-                if i >= 1 and trial_type == 'transition':
+                if trial_type == 'agent' and self.open_loop_agent:
+                    agent.correct(i, resp)
+                    commands, acted = agent.get_commands(i)
+                    if acted:
+                        transition_frames.append(i)
+                    resp = self.communicate(commands)
+                elif i >= 1 and trial_type == 'transition':
                     # self.o_ids[0] is agent, self.scene_o_ids[1]was
                     if get_distance(resp, moving_o_id, wall_id) < .25 and not transition_activated:
-                        resp = self.communicate([{"$type": "add_constant_force", "id": self.o_ids[0], "force": {"x": -force, "y": 0, "z": 0}, "relative_force": {"x": 0, "y": 0, "z": 0}, "torque": {"x": 0, "y": 0, "z": 0}, "relative_torque": {"x": 0, "y": 0, "z": 0}}])
+                        self.branch(resp)
+                        resp = self.step([{"$type": "add_constant_force", "id": self.o_ids[0], "force": {"x": -force, "y": 0, "z": 0}, "relative_force": {"x": 0, "y": 0, "z": 0}, "torque": {"x": 0, "y": 0, "z": 0}, "relative_torque": {"x": 0, "y": 0, "z": 0}}])
                         transition_activated = True
                         transition_frames.append(i)
                     else:
-                        resp = self.communicate([])
+                        resp = self.step([])
                 elif trial_type == 'agent':
                     if not first_resp:
                         resp = self.communicate([{"$type": "object_look_at", "other_object_id": self.o_ids[1], "id": self.o_ids[0]},
@@ -69,14 +87,14 @@ class Slope(Runner):
                         first_resp = True
                         transition_frames.append(i)
                     elif get_distance(resp, self.o_ids[0], self.o_ids[1]) <.1 or agent_success:
-                        resp = self.communicate([])
+                        resp = self.step([])
                         agent_success = True
                     else:
-                        resp = self.communicate([{"$type": "object_look_at", "other_object_id": self.o_ids[1], "id": self.o_ids[0]},
+                        resp = self.step([{"$type": "object_look_at", "other_object_id": self.o_ids[1], "id": self.o_ids[0]},
                                                 {"$type": "teleport_object_by", "position": {"x": 0, "y": 0, "z": speed}, "id": self.o_ids[0], "absolute": False}])
                         transition_frames.append(i)
                 else:
-                    resp = self.communicate([])
+                    resp = self.step([])
             except TypeError:
                 #NOTE Somehow it seems important to communicate one more time anyways, otherwise the objects do not get removed properly
                 resp = self.communicate([])
@@ -91,7 +109,7 @@ class Slope(Runner):
                             "id": o_id})
         destroy_commands.append({"$type": "send_rigidbodies",
                             "frequency": "never"})
-        self.communicate(destroy_commands)
+        self.communicate_unrendered(destroy_commands)
 
         if not trial_success:
             return 'Fail', trial_success
@@ -125,7 +143,7 @@ class Slope(Runner):
 
 
         rotation = {"x": 0, "y": 0}
-        rotation["z"] = random.uniform(216, 244) if self.trial_type != 'agent' else 244
+        rotation["z"] = self.get_param('slope_angle', lambda: random.uniform(216, 244)) if self.trial_type != 'agent' else 244
 
         # Add slope
         commands.extend(self.get_add_physics_object(model_name="cube",
@@ -184,6 +202,9 @@ class Slope(Runner):
         self.add_ons.append(camera)
         return position, look_at
 
+    def coverage_cells(self):
+        return [(name, None) for name in self.objects]
+
     def trial_initialization_commands(self):
         o_id = self.get_unique_id()
 
@@ -192,8 +213,9 @@ class Slope(Runner):
 
         commands = []
 
-        object_choice = random.choice(self.objects)
+        object_choice = self.choose_cell(self.coverage_cells())[0]
         self.object_choice = object_choice
+        self.coverage_cell = (object_choice, None)
 
         # self.names is put in the csv files, so the developers know which object(s) are chosen
         self.names = {'object':object_choice}
@@ -213,6 +235,7 @@ class Slope(Runner):
 
             # Put agent random position
             position = {"x": random.uniform(2.5, 3), "y": random.uniform(0, .5), "z": random.uniform(-.15,.15)}
+            self.agent_pos = position
             
 
         # Add object
@@ -240,5 +263,14 @@ if __name__ == "__main__":
     print(message('add_object_to_scene is set to True', 'warning'))
     success = c.run(num=args.num, pass_masks=args.pass_masks, room=args.room, tot_frames=args.tot_frames,
                     add_object_to_scene=True, trial_type=args.trial_type,
-                    png=args.png, save_frames=args.save_frames, save_mp4=args.save_mp4)
+                    png=args.png, save_frames=args.save_frames, save_mp4=args.save_mp4,
+                    resume=args.resume, save_delta=args.save_delta, save_roi=args.save_roi, roi_size=args.roi_size,
+                    open_loop_agent=args.open_loop_agent, correction_every=args.correction_every,
+                    pipeline=args.pipeline, save_raw=args.save_raw, check_visibility=args.check_visibility,
+                    save_trajectory=args.save_trajectory, timeout=args.timeout,
+                    coverage=args.coverage, quota=args.quota, render_profile=args.render_profile,
+                    video_format=args.video_format, img_codec=args.img_codec, twins=args.twins,
+                    occupancy=args.occupancy, assets=args.assets, skip_settle=args.skip_settle,
+                    stream=args.stream, stream_mode=args.stream_mode, stream_hwm=args.stream_hwm,
+                    stream_timeout=args.stream_timeout, stream_only=args.stream_only)
     print(success)
\ No newline at end of file
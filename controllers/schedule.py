@@ -0,0 +1,97 @@
+'''
+Readme:
+Example usage: python controllers/schedule.py --spec schedules/balanced.json --builds 8
+
+Creates a target number of trials for every controller and trial_type (see helpers/scheduler.py for the spec),
+so the targets finish at about the same time instead of some workers finishing hours before others.
+The seconds per accepted trial of every target are measured while running, an idle build takes a chunk of trials
+of the target with the most remaining work, with priorities and deadlines.
+A build keeps its controller and loaded scene as long as it gets chunks of the same controller.
+Interrupted schedules continue where they stopped when started again with the same spec.
+The progress per target is saved in data/batch2/schedules/{name}_summary.csv
+'''
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from helpers.async_runtime import BuildRuntime
+from helpers.helpers import message
+from helpers.manifest import load_manifest, get_manifest_path
+from helpers.scheduler import Scheduler, get_schedule_path, summarize
+
+from sweep import CONTROLLERS, SETTINGS
+
+
+async def close_controller(runtime, controller):
+    await runtime.call(controller.communicate, {"$type": "terminate"})
+    controller.socket.close()
+
+
+async def run_build(runtime, port, spec, scheduler, path_main):
+    '''Run chunks on one build until every target is done, the trials are saved in path_main next to the state of the schedule'''
+    controller = None
+    while True:
+        work = scheduler.next_chunk()
+        if work is None:
+            if not scheduler.busy():
+                break
+            # Chunks of other builds might not finish, wait if their trials are handed out again
+            await asyncio.sleep(1)
+            continue
+        index, chunk, resume = work
+        target = scheduler.targets[index]
+
+        # Launch a build for another controller on the same port
+        if controller is None or controller.controller_name != target['controller']:
+            if controller is not None:
+                await close_controller(runtime, controller)
+            controller = await runtime.create(CONTROLLERS[target['controller']], port)
+        run_kwargs = {**SETTINGS[target['controller']], **spec.get('run', {}), **target.get('run', {}), 'path_main': path_main}
+
+        print(f"Build at port {port} runs {chunk['name']}: {chunk['size']} {target['controller']} {target['trial_type']} trials")
+        # The chunk is timed here, run() only measures its seconds when it finishes without errors
+        controller.trial_stats, start = {}, time.time()
+        result = await runtime.call(controller.run, num=chunk['size'], trial_type=target['trial_type'], resume=resume,
+                                    reuse_scene=True, terminate=False, manifest_name=chunk['name'], **run_kwargs)
+        stats = dict(controller.trial_stats, seconds=time.time() - start)
+        manifest = load_manifest(get_manifest_path(path_main, controller.controller_name, target['trial_type'], chunk['name']))
+        scheduler.finish_chunk(index, chunk, stats, manifest['trial_num'] if manifest is not None else 0)
+        if chunk['status'] != 'done':
+            print(message(f"{chunk['name']} did not finish: {result}", 'warning'))
+
+    if controller is not None:
+        await close_controller(runtime, controller)
+
+
+async def run_schedule(runtime, spec, path_main, port_start=1071, builds=4):
+    path_state = get_schedule_path(path_main, spec['name'])
+    scheduler = Scheduler(path_state, spec)
+    runtime.start(builds)
+    await asyncio.gather(*[run_build(runtime, port, spec, scheduler, path_main) for port in range(port_start, port_start + builds)])
+
+    summary = summarize(scheduler, f"{path_main}/schedules/{spec['name']}_summary.csv")
+    print(summary.to_string(index=False))
+    return message(f"Schedule {spec['name']} is saved at {path_state}", 'success')
+
+
+if __name__ == "__main__":
+    # The same base path as Runner
+    default_path = '../data/batch2' if os.getcwd().endswith('controllers') else 'data/batch2'
+
+    parser = argparse.ArgumentParser(description="Create a target number of trials for every controller and trial_type")
+    parser.add_argument("--spec", type=str, required=True, help="json file with the schedule spec, see helpers/scheduler.py")
+    parser.add_argument("--path_main", type=str, default=default_path, help="Folder with info.csv")
+    parser.add_argument("--builds", type=int, default=4, help="Number of builds that run chunks at the same time")
+    parser.add_argument("--port", type=int, default=1071, help="Port of the first build, the other builds use the next ports")
+    args = parser.parse_args()
+
+    with open(args.spec) as f:
+        spec = json.load(f)
+    unknown = [target['controller'] for target in spec['targets'] if target['controller'] not in CONTROLLERS]
+    if unknown:
+        print(message(f"controllers of the schedule should be any of {list(CONTROLLERS)}, not {unknown}", 'error'))
+    else:
+        runtime = BuildRuntime()
+        print(asyncio.run_coroutine_threadsafe(run_schedule(runtime, spec, args.path_main, args.port, args.builds), runtime.loop).result())
@@ -0,0 +1,101 @@
+'''
+Readme:
+Example usage: python controllers/sweep.py --spec sweeps/slope_angle.json --builds 4
+
+Runs a parameter sweep (see helpers/sweep.py for the spec), e.g. the slope angle of rolling_down or the force of collision.
+The points are scheduled over --builds builds, every build keeps its controller and loaded scene between points.
+Every trial has its parameter vector in the 'params' column of info.csv.
+Interrupted sweeps continue where they stopped when started again with the same spec.
+The acceptance rate and timing per point are saved in data/batch2/sweeps/{name}_summary.csv
+'''
+import argparse
+import asyncio
+import json
+import os
+
+from helpers.async_runtime import BuildRuntime
+from helpers.helpers import message
+from helpers.manifest import load_manifest, get_manifest_path
+from helpers.sweep import load_sweep, save_sweep, get_sweep_path, get_point_name, summarize
+
+from collision import Collision
+from containment import Containment
+from occlusion import Occlusion
+from rolling_down import Slope
+from warming_up import UpWarmer
+
+CONTROLLERS = {'collision': Collision, 'containment': Containment, 'occlusion': Occlusion, 'rolling_down': Slope,
+               'warming_up': UpWarmer}
+
+# Same settings as the separate controllers use, see their main, the run kwargs of the spec override these
+SETTINGS = {'collision': dict(add_object_to_scene=False, tot_frames=150, pass_masks=['_img', '_mask', '_category']),
+            'containment': dict(add_object_to_scene=True, tot_frames=200),
+            'occlusion': dict(add_object_to_scene=False, tot_frames=200, pass_masks=['_img', '_mask']),
+            'rolling_down': dict(add_object_to_scene=True, tot_frames=200),
+            'warming_up': dict(add_object_to_scene=False, tot_frames=200)}
+
+
+async def run_build(runtime, port, spec, state, points, path_state, path_main):
+    '''Run points on one build until no points are left, the scene is loaded once and reused
+    The trials are saved in path_main, next to the state of the sweep'''
+    controller = await runtime.create(CONTROLLERS[spec['controller']], port)
+    run_kwargs = {**SETTINGS[spec['controller']], **spec.get('run', {}), 'path_main': path_main}
+    while not points.empty():
+        index = points.get_nowait()
+        point = state['points'][index]
+        print(f"Build at port {port} runs point {index}: {point['params']}")
+        result = await runtime.call(controller.run, num=spec['num'], trial_type=spec['trial_type'], params=point['params'],
+                                    resume=point['status'] == 'running', reuse_scene=True, terminate=False,
+                                    manifest_name=get_point_name(spec, index), **run_kwargs)
+        for key in ['accepted', 'attempted', 'seconds']:
+            point[key] += controller.trial_stats.get(key, 0)
+        # The point is done when its manifest has all trials committed
+        manifest = load_manifest(get_manifest_path(path_main, controller.controller_name, spec['trial_type'],
+                                                   get_point_name(spec, index)))
+        point['status'] = 'done' if manifest is not None and manifest['trial_num'] == manifest['num'] else 'running'
+        if point['status'] != 'done':
+            print(message(f'Point {index} did not finish: {result}', 'warning'))
+        save_sweep(path_state, state)
+
+    await runtime.call(controller.communicate, {"$type": "terminate"})
+    controller.socket.close()
+
+
+async def run_sweep(runtime, spec, path_main, port_start=1071, builds=4):
+    path_state = get_sweep_path(path_main, spec['name'])
+    state = load_sweep(path_state, spec)
+    points = asyncio.Queue()
+    for index, point in enumerate(state['points']):
+        if point['status'] != 'done':
+            points.put_nowait(index)
+    print(f"{len(state['points']) - points.qsize()} points of the sweep are done, {points.qsize()} points left")
+    if points.qsize():
+        save_sweep(path_state, state)
+        builds = min(builds, points.qsize())
+        runtime.start(builds)
+        await asyncio.gather(*[run_build(runtime, port, spec, state, points, path_state, path_main)
+                               for port in range(port_start, port_start + builds)])
+
+    summary = summarize(state, f"{path_main}/sweeps/{spec['name']}_summary.csv")
+    print(summary.to_string(index=False))
+    return message(f"Sweep {spec['name']} is saved at {path_state}", 'success')
+
+
+if __name__ == "__main__":
+    # The same base path as Runner
+    default_path = '../data/batch2' if os.getcwd().endswith('controllers') else 'data/batch2'
+
+    parser = argparse.ArgumentParser(description="Run a sweep over named controller parameters")
+    parser.add_argument("--spec", type=str, required=True, help="json file with the sweep spec, see helpers/sweep.py")
+    parser.add_argument("--path_main", type=str, default=default_path, help="Folder with info.csv")
+    parser.add_argument("--builds", type=int, default=4, help="Number of builds that run points at the same time")
+    parser.add_argument("--port", type=int, default=1071, help="Port of the first build, the other builds use the next ports")
+    args = parser.parse_args()
+
+    with open(args.spec) as f:
+        spec = json.load(f)
+    if spec['controller'] not in CONTROLLERS:
+        print(message(f"controller of the sweep should be any of {list(CONTROLLERS)}", 'error'))
+    else:
+        runtime = BuildRuntime()
+        print(asyncio.run_coroutine_threadsafe(run_sweep(runtime, spec, args.path_main, args.port, args.builds), runtime.loop).result())
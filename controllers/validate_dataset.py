@@ -0,0 +1,107 @@
+'''
+Readme:
+Example usage: python controllers/validate_dataset.py --workers 8
+
+Validates the trials that are already saved, instead of finding broken trials by watching the videos.
+Every new row of info.csv is checked in parallel worker processes, see helpers/validation.py for the checks.
+Flagged trials are moved to data/batch2/quarantine/ (with the same folder structure) and their rows get the reasons.
+The result is saved in the 'validation' column of info.csv, rows that already have a result are skipped,
+so every run only validates the new trials. Use --redo to validate everything again.
+
+NOTE: info.csv is re-read before it is updated, but avoid running this while trials of the same path are being created
+'''
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import os
+import shutil
+
+from helpers.helpers import message
+from helpers.metadata import load_info, update_info
+from helpers.validation import validate_trial, parse_value, resolve_path
+
+# Columns with paths of the output of a trial, these are moved to the quarantine
+PATH_COLUMNS = ('path_videos', 'path_frames', 'path_delta', 'path_roi', 'path_raw', 'path_visibility', 'path_trajectory')
+VALIDATION_COLUMNS = ('validation', 'quarantined')
+
+
+def get_key(row):
+    return (str(row['trial_id']), str(row['trial_num']), str(row['trial_type']))
+
+
+def quarantine(row, path_main):
+    '''Move all saved output of a trial to the quarantine, returns the new values of the path columns'''
+    moved = {}
+    for column in PATH_COLUMNS:
+        value = parse_value(row.get(column))
+        paths = value if isinstance(value, list) else [value]
+        new_paths = []
+        for path in paths:
+            resolved = resolve_path(path)
+            if resolved is None:
+                new_paths.append(path)
+                continue
+            relative = os.path.relpath(os.path.abspath(resolved), os.path.abspath(path_main))
+            new_path = f'{path_main}/quarantine/{relative}'
+            os.makedirs(os.path.dirname(new_path.rstrip('/')), exist_ok=True)
+            shutil.move(resolved.rstrip('/'), new_path.rstrip('/'))
+            new_paths.append(new_path)
+        moved[column] = str(new_paths) if isinstance(value, list) else new_paths[0]
+    return moved
+
+
+def _validate(args):
+    row, kwargs = args
+    try:
+        return validate_trial(row, **kwargs)
+    except Exception as e:
+        return [f'validation failed: {e}']
+
+
+def validate_dataset(path_main, workers=None, redo=False, batch_size=64, **kwargs):
+    '''Validate all new trials of path_main/info.csv in parallel, quarantine the flagged trials
+    param batch_size: info.csv is updated after every batch, so an interrupted run keeps its results
+    kwargs are passed to validate_trial'''
+    path_info = f'{path_main}/info.csv'
+    df = load_info(path_info, VALIDATION_COLUMNS)
+    rows = [row for _, row in df.iterrows() if redo or not isinstance(row['validation'], str)]
+    rows = [{column: value for column, value in row.items()} for row in rows]
+    print(f'{len(df)-len(rows)} trials are already validated, {len(rows)} trials left')
+
+    flagged = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for b in range(0, len(rows), batch_size):
+            batch = rows[b:b+batch_size]
+            results = {}
+            for row, reasons in zip(batch, executor.map(_validate, [(row, kwargs) for row in batch])):
+                update = {'validation': '; '.join(reasons) if reasons else 'ok', 'quarantined': bool(reasons)}
+                if reasons and parse_value(row.get('quarantined')) not in [True, 'True']:
+                    update.update(quarantine(row, path_main))
+                flagged += bool(reasons)
+                results[get_key(row)] = update
+
+            def annotate(df):
+                for i, row in df.iterrows():
+                    for column, value in results.get(get_key(row), {}).items():
+                        df.at[i, column] = value
+                return df
+            update_info(path_info, VALIDATION_COLUMNS, annotate)
+            done = min(b+batch_size, len(rows))
+            print(message(f'Validated trials ({done}/{len(rows)})', 'success', round(done/len(rows)*10)))
+
+    return message(f'{flagged}/{len(rows)} trials are flagged and moved to {path_main}/quarantine', 'success')
+
+
+if __name__ == "__main__":
+    # The same base path as Runner
+    default_path = '../data/batch2' if os.getcwd().endswith('controllers') else 'data/batch2'
+
+    parser = argparse.ArgumentParser(description="Validate the saved trials and quarantine the broken ones")
+    parser.add_argument("--path_main", type=str, default=default_path, help="Folder with info.csv")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes, default is the number of cpus")
+    parser.add_argument("--redo", action='store_true', help="Validate all trials again, also the trials that are already validated")
+    parser.add_argument("--min_std", type=float, default=2., help="Frames with a smaller standard deviation of the pixels are empty")
+    parser.add_argument("--min_motion", type=float, default=.5, help="Smallest mean pixel difference between frames that counts as motion")
+    args = parser.parse_args()
+
+    success = validate_dataset(args.path_main, workers=args.workers, redo=args.redo, min_std=args.min_std, min_motion=args.min_motion)
+    print(success)
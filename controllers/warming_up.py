@@ -23,13 +23,12 @@ import random
 from helpers.objects import *
 from tdw.add_ons.third_person_camera import ThirdPersonCamera
 from random import uniform
-from helpers.helpers import get_magnitude, get_record_with_name, create_arg_parser, message
+from helpers.helpers import get_magnitude, get_record_with_name, create_arg_parser, message, get_librarian
 
 class UpWarmer(Runner):
     def __init__(self, port=1071):
         self.controller_name = 'warming_up'
-        lib = ModelLibrarian('models_core.json')
-        self.records = {record.name:record for record in lib.records}
+        self.records = {record.name:record for record in get_librarian('models_core.json').records}
 
         # Concatenate the ALL lists
         self.objects = CONTAINERS + CONTAINED + OCCLUDERS + OCCLUDERS_SEE_THROUGH + OCCLUDED +\
@@ -45,7 +44,7 @@ class UpWarmer(Runner):
     def set_force(self, commands=[]):
         '''Apply force to object into random direction'''
         # Get suitable random force
-        force = get_magnitude(get_record_with_name(self.objects[0]))
+        force = get_magnitude(get_record_with_name(self.objects[0]), randomness=self.get_param('magnitude_randomness', 5), floor=self.loaded_scene)
 
         if random.choice([True, False]):
             # Rotate the object
@@ -80,6 +79,9 @@ class UpWarmer(Runner):
         self.add_ons.append(self.camera)
         return self.camera_pos, look_at
         
+    def coverage_cells(self):
+        return [(name, None) for name in self.objects]
+
     def trial_initialization_commands(self):
         # Choose between falling or force collision #TODO check if random choice still works
         coll_type = random.choice([['fall'], ['force'], ['fall', 'force']])
@@ -94,7 +96,11 @@ class UpWarmer(Runner):
                     "y": uniform(0, 360) if random.choice([True, False]) else 0, 
                     "z": uniform(0, 360) if random.choice([True, False]) else 0} if 'fall' in coll_type else {"x": 0, "y": 0, "z": 0}
 
-        # To choose random object without putting back
+        # To choose random object without putting back, the least covered object becomes the first object
+        if self.steer_coverage:
+            name = self.choose_cell(self.coverage_cells())[0]
+            self.objects.insert(0, self.objects.pop(self.objects.index(name)))
+        self.coverage_cell = (self.objects[0], None)
         commands.extend(self.get_add_physics_object(model_name=self.objects[0],
                                                     library='models_core.json',
                                                     object_id=self.o_ids[0],
@@ -120,5 +126,13 @@ if __name__ == "__main__":
     print(message('The trial_type param is ignored', 'warning'))
     success = c.run(num=args.num, pass_masks=args.pass_masks, room=args.room, tot_frames=args.tot_frames,
                     add_object_to_scene=args.add_object_to_scene,
-                    png=args.png, save_frames=args.save_frames, save_mp4=args.save_mp4)
+                    png=args.png, save_frames=args.save_frames, save_mp4=args.save_mp4,
+                    resume=args.resume, save_delta=args.save_delta, save_roi=args.save_roi, roi_size=args.roi_size,
+                    pipeline=args.pipeline, save_raw=args.save_raw, check_visibility=args.check_visibility,
+                    save_trajectory=args.save_trajectory, timeout=args.timeout,
+                    coverage=args.coverage, quota=args.quota, render_profile=args.render_profile,
+                    video_format=args.video_format, img_codec=args.img_codec,
+                    occupancy=args.occupancy, assets=args.assets, skip_settle=args.skip_settle,
+                    stream=args.stream, stream_mode=args.stream_mode, stream_hwm=args.stream_hwm,
+                    stream_timeout=args.stream_timeout, stream_only=args.stream_only)
     print(success)
\ No newline at end of file
@@ -15,9 +15,26 @@ while input_passed != True:
 for i in range(user_input):
     for controller in ['collision', 'containment', 'occlusion', 'rolling_down']:
         for trial_type in ['object', 'transition', 'agent']:
+            # The object trials are the twins of the transition trials
+            if args.twins and trial_type == 'object':
+                continue
             command = f'python controllers/{controller}.py'
             command += f' --num {args.num} --trial_type {trial_type} --png {args.png} --pass_masks {args.pass_masks} --framerate {args.framerate}'
             command += f' --room {args.room} --tot_frames {args.tot_frames} --add_object_to_scene {args.add_object_to_scene}'
             command += f' --save_frames {args.save_frames} --save_mp4 {args.save_mp4}'
+            command += f' --video_format {args.video_format} --img_codec {args.img_codec}'
+            command += f' --roi_size {args.roi_size} --correction_every {args.correction_every} --timeout {args.timeout}'
+            # type=bool parses any value as True, so the flags are only passed when they are set
+            for flag in ['save_delta', 'save_roi', 'open_loop_agent', 'pipeline', 'save_raw', 'check_visibility', 'save_trajectory', 'coverage']:
+                command += f' --{flag} True' if getattr(args, flag) else ''
+            command += f' --quota {args.quota}' if args.quota is not None else ''
+            command += f' --render_profile {args.render_profile}' if args.render_profile is not None else ''
+            command += ' --twins True' if args.twins and trial_type == 'transition' else ''
+            command += ' --occupancy True' if args.occupancy else ''
+            command += f' --assets {args.assets}' if args.assets is not None else ''
+            command += ' --skip_settle True' if args.skip_settle else ''
+            command += f' --stream {args.stream} --stream_mode {args.stream_mode} --stream_hwm {args.stream_hwm} --stream_timeout {args.stream_timeout}' if args.stream is not None else ''
+            command += ' --stream_only True' if args.stream_only else ''
+            command += ' --resume' if args.resume else ''
             print(command)
             system(command)
\ No newline at end of file